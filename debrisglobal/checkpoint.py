@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpoint of the debris thicknesses and elevations of a grid cell that have been completed by meltmodel_global
+
+Each completed debris thickness and elevation (the statistics of the MC simulations that are recorded in the output)
+is saved to its own .npz file in the checkpoint directory of the output file, and a manifest lists the completed ones.
+When a run is interrupted (e.g., pre-empted on the supercomputer), running the same batch again loads the completed
+debris thicknesses instead of simulating them, and the output file is assembled once all of them are completed. The
+slabs are then removed and the manifest marks the grid cell as completed, so the grid cells of a batch that were
+completed are skipped. Files are written to a temporary file that is renamed, so an interrupted write does not leave a
+corrupt checkpoint. The solver telemetry of each completed debris thickness and elevation is kept in the manifest and
+restored with its statistics, so a resumed run reports the same telemetry as a run that was not interrupted
+(simulations that were lost when the run was interrupted are not counted).
+
+The manifest records the debris thicknesses, elevations, time period, model settings, statistics of the MC
+simulations, a hash of the debris properties of the MC simulations (which differ between runs if they are sampled
+without mc_seed), energy balance model and solver options and output profile of the run; a checkpoint from a run with
+a different configuration is discarded. The model has no other random state, and option_ts_continuation is not used
+with checkpoints, so the resumed debris thicknesses start from the same surface temperature as in a run that was not
+interrupted. Other changes (e.g., to the model itself) are not detected, so the checkpoint directory needs to be
+removed to simulate completed grid cells again.
+"""
+
+# Built-in libaries
+import hashlib
+import json
+import os
+# External libraries
+import numpy as np
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+def checkpoint_config(debris_thickness_all, time_pd, elev_list, args):
+    """ Configuration of the run recorded in the manifest (a checkpoint is only used for the same configuration)
+
+    Parameters
+    ----------
+    debris_thickness_all : np.array
+        debris thicknesses [m]
+    time_pd : pd.DatetimeIndex
+        timesteps of the run
+    elev_list : list
+        elevations [m]
+    args : argparse.Namespace
+        arguments of meltmodel_global (energy balance model and solver options)
+    """
+    # Debris properties of the MC simulations (sampled with mc_design, mc_antithetic, mc_seed and 
+    #  debris_properties_bounds, or loaded from debris_properties_fn)
+    properties_hash = hashlib.sha1()
+    for properties in [debris_prms.albedo_random, debris_prms.z0_random, debris_prms.k_random, 
+                       debris_prms.z0_random_snow, debris_prms.albedo_random_ice, debris_prms.z0_random_ice,
+                       debris_prms.sin_factor_random]:
+        properties_hash.update(np.ascontiguousarray(properties, dtype=np.float64).tobytes())
+    return {'hd_cm': [float(x) for x in np.round(np.array(debris_thickness_all) * 100, 6)],
+            'elev': [float(x) for x in elev_list],
+            'time': [str(time_pd[0]), str(time_pd[-1]), int(len(time_pd))],
+            'experiment_no': int(debris_prms.experiment_no),
+            'mc_simulations': int(debris_prms.mc_simulations),
+            'mc_stat_cns': list(debris_prms.mc_stat_cns),
+            'mc_stat_quantiles': str(debris_prms.mc_stat_quantiles),
+            'debris_properties': properties_hash.hexdigest(),
+            'option_snow': int(debris_prms.option_snow),
+            'option_sim_windows': int(debris_prms.option_sim_windows),
+            'option_hd_adaptive': int(debris_prms.option_hd_adaptive),
+            'option_layers_adaptive': int(debris_prms.option_layers_adaptive),
+            'output_profile': str(debris_prms.output_profile),
+            'option_vectorized': int(args.option_vectorized),
+            'option_hd_lockstep': int(args.option_hd_lockstep),
+            'option_elev_lockstep': int(args.option_elev_lockstep),
+            'option_numba': int(args.option_numba),
+            'option_ts_solver': int(args.option_ts_solver),
+            'option_ts_continuation': int(args.option_ts_continuation)}
+
+
+class Checkpoint():
+    """ Completed debris thicknesses and elevations of a grid cell
+
+    Parameters
+    ----------
+    checkpoint_fp : str
+        checkpoint directory of the output file
+    config : dict
+        configuration of the run (see checkpoint_config)
+    """
+    def __init__(self, checkpoint_fp, config):
+        self.checkpoint_fp = checkpoint_fp
+        self.manifest_fullfn = checkpoint_fp + 'manifest.json'
+        self.manifest = None
+        if os.path.exists(self.manifest_fullfn):
+            with open(self.manifest_fullfn, 'r') as f:
+                manifest = json.load(f)
+            if manifest['config'] == config:
+                self.manifest = manifest
+            else:
+                print('Checkpoint from a different configuration, starting over:', checkpoint_fp)
+                for slab_fn in manifest['slabs'].values():
+                    if os.path.exists(checkpoint_fp + slab_fn):
+                        os.remove(checkpoint_fp + slab_fn)
+        if self.manifest is None:
+            self.manifest = {'config': config, 'slabs': {}, 'n_iter_hist': {}, 'completed': False}
+            if os.path.exists(checkpoint_fp) == False:
+                os.makedirs(checkpoint_fp)
+            self._write_manifest()
+
+    @staticmethod
+    def slab_key(nelev, n_thickness):
+        return str(nelev) + '_' + str(n_thickness)
+
+    def _write_manifest(self):
+        """ Write the manifest to a temporary file that is renamed (the manifest is never partially written) """
+        with open(self.manifest_fullfn + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(self.manifest_fullfn + '.tmp', self.manifest_fullfn)
+
+    def cell_completed(self):
+        """ Whether the output of the grid cell was completed by a previous run """
+        return self.manifest['completed']
+
+    def completed(self, nelev, n_thickness):
+        """ Whether the debris thickness and elevation were completed by a previous run """
+        return self.slab_key(nelev, n_thickness) in self.manifest['slabs']
+
+    def load(self, nelev, n_thickness):
+        """ Statistics of the MC simulations (output_slab) of a completed debris thickness and elevation """
+        slab_fn = self.manifest['slabs'][self.slab_key(nelev, n_thickness)]
+        with np.load(self.checkpoint_fp + slab_fn) as data:
+            return {vn: data[vn] for vn in data.files}
+
+    def iteration_histogram(self, nelev, n_thickness):
+        """ Solver telemetry (see ts_solver.py) of a completed debris thickness and elevation (None if not saved) """
+        slab_key = self.slab_key(nelev, n_thickness)
+        if slab_key not in self.manifest['n_iter_hist']:
+            return None
+        return np.array(self.manifest['n_iter_hist'][slab_key], dtype=np.int64)
+
+    def save(self, nelev, n_thickness, output_slab, n_iter_hist=None):
+        """ Save the statistics of the MC simulations (and the solver telemetry of their simulations) of a debris 
+        thickness and elevation once completed """
+        slab_key = self.slab_key(nelev, n_thickness)
+        slab_fn = 'slab_' + slab_key + '.npz'
+        with open(self.checkpoint_fp + slab_fn + '.tmp', 'wb') as f:
+            np.savez(f, **output_slab)
+        os.replace(self.checkpoint_fp + slab_fn + '.tmp', self.checkpoint_fp + slab_fn)
+        self.manifest['slabs'][slab_key] = slab_fn
+        if n_iter_hist is not None:
+            self.manifest['n_iter_hist'][slab_key] = [int(x) for x in n_iter_hist]
+        self._write_manifest()
+
+    def mark_completed(self):
+        """ Mark the grid cell as completed once its output is written and remove the slabs """
+        self.manifest['completed'] = True
+        self._write_manifest()
+        for slab_fn in self.manifest['slabs'].values():
+            if os.path.exists(self.checkpoint_fp + slab_fn):
+                os.remove(self.checkpoint_fp + slab_fn)
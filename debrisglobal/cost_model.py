@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runtime of meltmodel_global for each grid cell, calibrated from the timings of previous runs
+
+The runtime of a grid cell is modeled as
+    runtime [s] = work * (cost_a + cost_b * snow_fraction)
+where the work is the number of years simulated (record length of roi_datedict) times the number of Monte Carlo
+simulations times the estimated cost of the debris thicknesses and elevations (scheduler.meltmodel_cost, which is 1
+for a thick debris simulation), and the snow fraction is the fraction of the timesteps with an air temperature below
+Tsnow_threshold at the mean elevation of the debris (the timesteps with snow on the surface are more expensive).
+
+The coefficients are fit (least squares, non-negative) to the runtime of the tasks recorded by the scheduler in the
+timings of meltmodel_global (timings_fp), so they include the hardware and model options of those runs; the timings
+are assumed to be from the current configuration (period, Monte Carlo simulations and elevations). Without timings,
+the default coefficients are those of the energy balance model in Python. spc_split_lists.py uses the model to balance
+the batches and to predict the runtime of each batch.
+"""
+
+# Built-in libaries
+import json
+import os
+# External libraries
+import numpy as np
+import pandas as pd
+import xarray as xr
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.scheduler as scheduler
+
+
+# Default coefficients [s per year, simulation and thick debris] (energy balance model in Python)
+cost_a_default = 2.5
+cost_b_default = 0
+
+
+def period_years(start_date=debris_prms.start_date, end_date=debris_prms.end_date):
+    """ Number of years simulated (hourly timesteps from start_date to end_date) """
+    nsteps = len(pd.date_range(start=start_date, end=pd.Timestamp(end_date) + pd.Timedelta(hours=23), freq='H'))
+    return nsteps / (24 * 365)
+
+
+def snow_fraction(lat_deg, lon_deg):
+    """ Fraction of the timesteps with an air temperature below Tsnow_threshold at the mean elevation of the debris
+    (lapse rate of globaldebris_input; nan if there is no meteorological data for the grid cell) """
+    if lat_deg < 0:
+        lat_str = 'S-'
+    else:
+        lat_str = 'N-'
+    metdata_fn = debris_prms.metdata_fn_sample.replace('XXXX', str(int(np.abs(lat_deg)*100)) + lat_str +
+                                                         str(int(lon_deg*100)) + 'E-')
+    if os.path.exists(debris_prms.metdata_fp + metdata_fn) == False:
+        return np.nan
+    with xr.open_dataset(debris_prms.metdata_fp + metdata_fn) as ds:
+        ds_period = ds.sel(time=slice(debris_prms.start_date, pd.Timestamp(debris_prms.end_date) +
+                                      pd.Timedelta(hours=23)))
+        Tair = (ds_period['t2m'].values +
+                debris_prms.lapserate * (float(ds['dc_zmean'].values) - float(ds['z'].values)))
+    return float((Tair < debris_prms.Tsnow_threshold).mean())
+
+
+def cell_work(n_cells=1, debris_thicknesses=debris_prms.debris_thickness_all, n_elev=len(debris_prms.elev_cns)):
+    """ Work of grid cells [years * simulations * thick debris simulations] """
+    return (n_cells * period_years() * debris_prms.mc_simulations *
+            scheduler.meltmodel_cost(debris_thicknesses, n_elev=n_elev))
+
+
+def read_timings(timings_fp=debris_prms.timings_fp):
+    """ Runtime, work and snow fraction of the tasks recorded in the timings of meltmodel_global (None if there are
+    no timings) """
+    dfs = []
+    if os.path.exists(timings_fp):
+        for i in sorted(os.listdir(timings_fp)):
+            if i.startswith('meltmodel_global_batch') and i.endswith('_timings.csv'):
+                dfs.append(pd.read_csv(timings_fp + i))
+    if len(dfs) == 0:
+        return None
+    df = pd.concat(dfs, ignore_index=True)
+    # Labels are lat_lon_hd<debris thicknesses>; cost is the estimated cost of the debris thicknesses and elevations
+    df['lat'] = [float(x.split('_')[0]) for x in df['label']]
+    df['lon'] = [float(x.split('_')[1]) for x in df['label']]
+    df['work'] = df['cost'] * period_years() * debris_prms.mc_simulations
+    snow_dict = {latlon: snow_fraction(latlon[0], latlon[1]) for latlon in set(zip(df['lat'], df['lon']))}
+    df['snow_fraction'] = [snow_dict[latlon] for latlon in zip(df['lat'], df['lon'])]
+    # Tasks of grid cells without meteorological data are not used
+    df = df.loc[np.isfinite(df['snow_fraction']) & (df['work'] > 0) & (df['runtime_s'] > 0)]
+    if len(df) == 0:
+        return None
+    return df
+
+
+def calibrate(df):
+    """
+    Fit the coefficients of the cost model to the runtime of the tasks
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        runtime [s], work and snow fraction of each task (see read_timings)
+
+    Returns
+    -------
+    coeffs : dict
+        coefficients cost_a and cost_b, number of tasks and relative root mean square error of the runtime
+    """
+    runtime = df['runtime_s'].values
+    X = np.column_stack([df['work'].values, df['work'].values * df['snow_fraction'].values])
+    # Least squares of the relative error (each task has the same weight)
+    X_rel = X / runtime[:,np.newaxis]
+    coeffs = np.linalg.lstsq(X_rel, np.ones(len(runtime)), rcond=None)[0]
+    # Negative coefficient: fit the coefficient that fits best on its own
+    if (coeffs < 0).any():
+        coeffs_single = []
+        for ncol in range(2):
+            coeffs_ncol = np.zeros(2)
+            if (X_rel[:,ncol]**2).sum() > 0:
+                coeffs_ncol[ncol] = X_rel[:,ncol].sum() / (X_rel[:,ncol]**2).sum()
+            coeffs_single.append(coeffs_ncol)
+        coeffs = min(coeffs_single, key=lambda x: ((X_rel @ x - 1)**2).sum())
+    rel_err = X_rel @ coeffs - 1
+    return {'cost_a': float(coeffs[0]), 'cost_b': float(coeffs[1]), 'n_tasks': int(len(runtime)),
+            'rel_rmse': float((rel_err**2).mean()**0.5)}
+
+
+def save(coeffs, cost_model_fullfn=debris_prms.cost_model_fullfn):
+    """ Save the coefficients of the cost model """
+    if os.path.exists(os.path.dirname(cost_model_fullfn)) == False:
+        os.makedirs(os.path.dirname(cost_model_fullfn))
+    with open(cost_model_fullfn, 'w') as f:
+        json.dump(coeffs, f, indent=1)
+
+
+def load(cost_model_fullfn=debris_prms.cost_model_fullfn):
+    """ Coefficients of the cost model (defaults if it has not been calibrated) """
+    if os.path.exists(cost_model_fullfn):
+        with open(cost_model_fullfn, 'r') as f:
+            return json.load(f)
+    print('Cost model has not been calibrated, using the default coefficients:', cost_model_fullfn)
+    return {'cost_a': cost_a_default, 'cost_b': cost_b_default, 'n_tasks': 0, 'rel_rmse': np.nan}
+
+
+def fill_snow_fraction(snow_frac):
+    """ Snow fraction of the grid cells without meteorological data set to the mean of the others (0 if none) """
+    snow_frac = np.array(snow_frac, dtype=float)
+    if np.isfinite(snow_frac).any():
+        return np.where(np.isfinite(snow_frac), snow_frac, np.nanmean(snow_frac))
+    return np.zeros(snow_frac.shape)
+
+
+def predict(coeffs, work, snow_frac):
+    """ Runtime [s] predicted by the cost model """
+    return np.array(work) * (coeffs['cost_a'] + coeffs['cost_b'] * fill_snow_fraction(snow_frac))
+
+
+def walltime_str(runtime_s):
+    """ Wall time in the format of SLURM (HH:MM:SS), rounded up to the next minute """
+    minutes = int(np.ceil(runtime_s / 60))
+    return str(minutes // 60).zfill(2) + ':' + str(minutes % 60).zfill(2) + ':00'
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Daily melt dataset ("ostrem" curves) used to sum the melt over the dates of the DEM differencing
+
+Used by meltmodel_global.py to export the daily melt directly from the simulations and by meltcurves.py to derive it
+from the hourly output (meltmodel_fn is the filename of the hourly output, also read by tscurves.py and
+meltmodel_emulator.py).
+"""
+
+# External libraries
+import collections
+import numpy as np
+import xarray as xr
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+def meltmodel_fn(latlon):
+    """ Filename of the meltmodel_global output of a grid cell """
+    lat_deg, lon_deg = latlon[0], latlon[1]
+    if lat_deg < 0:
+        lat_str = 'S-'
+    else:
+        lat_str = 'N-'
+    latlon_str = str(int(abs(lat_deg)*100)) + lat_str + str(int(lon_deg*100)) + 'E-'
+    if debris_prms.experiment_no == 3:
+        mc_str = ''
+    else:
+        mc_str = str(int(debris_prms.mc_simulations)) + 'MC_'
+    return debris_prms.fn_prefix + latlon_str + mc_str + debris_prms.date_start + '.nc'
+
+
+def daily_sum(values, axis=0):
+    """ Sum hourly values to daily values (the number of timesteps along axis must be a multiple of 24) """
+    values = np.moveaxis(values, axis, 0)
+    values_daily = values.reshape((int(values.shape[0] / 24), 24) + values.shape[1:]).sum(axis=1)
+    return np.moveaxis(values_daily, 0, axis)
+
+
+def create_xrdataset_daily_melt(hd_cm_values, time_daily, elev_values, option_std=True, option_ts=False):
+    """
+    Create empty xarray dataset that will be used to record daily melt data from simulation runs.
+
+    Parameters
+    ----------
+    hd_cm_values : np.array
+        debris thickness [cm]
+    time_daily : pd.DatetimeIndex
+        first timestep of each day
+    elev_values : list
+        elevations [m a.s.l.]
+    option_std : bool
+        include the standard deviation of the daily melt
+    option_ts : bool
+        include the daily mean surface temperature
+
+    Returns
+    -------
+    output_ds_all : xarray Dataset
+        empty xarray dataset that contains variables and attributes to be filled in by simulation runs
+    encoding : dictionary
+        encoding used with exporting xarray dataset to netcdf
+    """
+    # Variable coordinates dictionary
+    output_coords_dict = collections.OrderedDict()
+    output_coords_dict['melt'] = collections.OrderedDict([('hd_cm', hd_cm_values), ('time', time_daily),
+                                                          ('elev', elev_values)])
+    if option_std:
+        output_coords_dict['melt_std'] = collections.OrderedDict([('hd_cm', hd_cm_values), ('time', time_daily),
+                                                                  ('elev', elev_values)])
+    if option_ts:
+        output_coords_dict['ts'] = collections.OrderedDict([('hd_cm', hd_cm_values), ('time', time_daily),
+                                                            ('elev', elev_values)])
+    # Attributes dictionary
+    output_attrs_dict = {
+            'latitude': {'long_name': 'latitude',
+                         'units': 'degrees north'},
+            'longitude': {'long_name': 'longitude',
+                          'units': 'degrees_east'},
+            'roi': {'long_name': 'region of interest'},
+            'time': {'long_name': 'time'},
+            'hd_cm': {'long_name': 'debris thickness',
+                      'units:': 'cm'},
+            'elev': {'long_name': 'elevation',
+                     'units': 'm a.s.l.'},
+            'melt': {'long_name': 'glacier melt, in water equivalent',
+                     'units': 'm'},
+            'melt_std': {'long_name': 'glacier melt, in water equivalant, standard deviation',
+                         'units': 'm'},
+            'ts': {'long_name': 'debris surface temperature, daily mean',
+                   'units': 'K'}
+            }
+
+    # Add variables to empty dataset and merge together
+    count_vn = 0
+    encoding = {}
+    for vn in output_coords_dict.keys():
+        count_vn += 1
+        empty_holder = np.zeros([len(output_coords_dict[vn][i]) for i in list(output_coords_dict[vn].keys())])
+        output_ds = xr.Dataset({vn: (list(output_coords_dict[vn].keys()), empty_holder)},
+                               coords=output_coords_dict[vn])
+        # Merge datasets of stats into one output
+        if count_vn == 1:
+            output_ds_all = output_ds
+        else:
+            output_ds_all = xr.merge((output_ds_all, output_ds))
+
+    # Add attributes
+    for vn in output_ds_all.variables:
+        try:
+            output_ds_all[vn].attrs = output_attrs_dict[vn]
+        except:
+            pass
+        # Encoding (specify _FillValue, offsets, etc.)
+        encoding[vn] = {'_FillValue': False,
+                        'zlib':True,
+                        'complevel':9
+                        }
+    return output_ds_all, encoding
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Number of layers and conduction time step of the debris temperature profile
+
+The reference configuration divides the debris into 10 layers (h = debris_thickness / 10) and solves the
+Crank-Nicholson scheme every timestep, coupled with the surface energy balance (the debris temperature profile is
+updated at every iteration of the surface temperature). With option_layers_adaptive = 1, the configuration of each
+debris thickness is chosen from the diffusion number of the reference layers, C = k delta_t / (2 row_d c_d h**2):
+  - fast conduction (C > layers_C_fine, thin debris): the profile is close to linear within a timestep, so fewer
+    layers are used, as long as the diffusion number of the coarser layers stays above layers_C_fine
+  - slow conduction (C <= layers_C_coarse, thick debris): the diurnal wave barely reaches the ice, so the debris
+    below the surface is only updated every n_sub timesteps, with one conduction step of n_sub * delta_t (the largest
+    n_sub for which C n_sub <= layers_C_coarse). The surface energy balance is still solved every timestep, with the
+    temperature of the first layer from the last update, so the iterations of the surface temperature no longer
+    require the Crank-Nicholson scheme. The melt of a conduction step is spread evenly over its timesteps. Timesteps
+    with snow on the debris are coupled as in the reference (the conduction step ends at the previous timestep), as the
+    surface temperature under snow is set by the conduction between the snow and the debris.
+  - otherwise the reference configuration is used (n_sub = 0)
+The accuracy relative to the reference configuration is reported by layers_accuracy.py.
+"""
+
+# External libraries
+import numpy as np
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+n_layers_ref = 10
+
+
+def diffusion_number(k, h):
+    """ Constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme (diffusion number of a timestep) """
+    return k * debris_prms.delta_t / (2 * debris_prms.row_d * debris_prms.c_d * h**2)
+
+
+def debris_layers(debris_thickness, k, option_adaptive=None):
+    """
+    Layers and conduction time step of each simulation
+
+    Parameters
+    ----------
+    debris_thickness : float or np.array
+        debris thickness [m]
+    k : float or np.array
+        thermal conductivity [W m-1 K-1]
+    option_adaptive : int
+        switch to choose the layers and conduction time step from the diffusion number (1) or to use the reference
+        configuration (0); default is option_layers_adaptive
+
+    Returns
+    -------
+    N : int or np.array
+        number of internal calculation layers + 1 to include the surface layer
+    h : float or np.array
+        height of each internal layer [m]
+    C : float or np.array
+        constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme
+    n_sub : int or np.array
+        number of timesteps in each conduction step of the decoupled debris (0 if coupled, as in the reference)
+    """
+    if option_adaptive is None:
+        option_adaptive = debris_prms.option_layers_adaptive
+    debris_thickness = np.asarray(debris_thickness, dtype=float)
+    k = np.asarray(k, dtype=float)
+    # Reference: 10 layers and conduction coupled to the surface every timestep
+    h = debris_thickness / n_layers_ref
+    N = (debris_thickness/h + 1).astype(int)
+    C = diffusion_number(k, h)
+    n_sub = np.zeros(C.shape, dtype=int)
+
+    if option_adaptive == 1:
+        # Fast conduction: fewer layers, whose diffusion number remains above layers_C_fine
+        h_fine = (2 * debris_prms.layers_C_fine / k * debris_prms.row_d * debris_prms.c_d / debris_prms.delta_t)**-0.5
+        N_fine = np.clip(np.ceil(debris_thickness / h_fine).astype(int) + 1, debris_prms.layers_N_min, N)
+        fine = C > debris_prms.layers_C_fine
+        N = np.where(fine, N_fine, N)
+        h = np.where(fine, debris_thickness / (N - 1), h)
+        C = np.where(fine, diffusion_number(k, h), C)
+        # Slow conduction: debris decoupled from the surface and updated every n_sub timesteps
+        coarse = C <= debris_prms.layers_C_coarse
+        n_sub[coarse] = np.minimum(np.floor(debris_prms.layers_C_coarse / C[coarse]), debris_prms.layers_nsub_max)
+
+    if n_sub.ndim == 0:
+        return int(N), float(h), float(C), int(n_sub)
+    return N, h, C, n_sub
+
+
+def conduction_step_end(i, n_sub, nsteps):
+    """ Whether the conduction step of the decoupled debris ends at timestep i (the first step starts at i = 1) """
+    return i > 0 and (i % n_sub == 0 or i == nsteps - 1)
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Debris-covered glacier energy balance model compiled with Numba
+
+The physics are identical to CrankNicholson and calc_surface_fluxes in meltmodel_global.py, which remain the reference
+implementation. The whole timestep loop (Crank-Nicholson scheme, surface energy fluxes and Newton-Raphson iteration for
+the surface temperature) is compiled, so a simulation for one debris thickness and one set of debris properties runs
+without calling back into Python.
+
+Constants are read from globaldebris_input when the functions are first compiled (once per process).
+Numba is only required when this module is imported (i.e., when meltmodel_global.py is run with -option_numba=1).
+"""
+
+# External libraries
+import numba
+import numpy as np
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+# ===== CONSTANTS =====
+# Numba treats module-level globals as compile-time constants
+Lv = debris_prms.Lv
+Ls = debris_prms.Ls
+Lf = debris_prms.Lf
+R_const = debris_prms.R_const
+Rd = debris_prms.Rd
+P0 = debris_prms.P0
+cA = debris_prms.cA
+cW = debris_prms.cW
+cSnow = debris_prms.cSnow
+c_d = debris_prms.c_d
+row_d = debris_prms.row_d
+k_snow = debris_prms.k_snow
+density_air_0 = debris_prms.density_air_0
+density_water = debris_prms.density_water
+density_ice = debris_prms.density_ice
+emissivity = debris_prms.emissivity
+emissivity_snow = debris_prms.emissivity_snow
+stefan_boltzmann = debris_prms.stefan_boltzmann
+eS_snow = debris_prms.eS_snow
+snow_tau_0 = debris_prms.snow_tau_0
+snow_c_v = debris_prms.snow_c_v
+snow_c_ir = debris_prms.snow_c_ir
+albedo_vo = debris_prms.albedo_vo
+albedo_iro = debris_prms.albedo_iro
+delta_t = debris_prms.delta_t
+
+
+@numba.njit(cache=False)
+def crank_nicholson_nb(Td, Td_past, i, debris_thickness, N, h, C, A_Crank, S_Crank):
+    """ Run Crank-Nicholson scheme to obtain debris temperature (see CrankNicholson in meltmodel_global.py)
+
+    Parameters
+    ----------
+    Td : np.array
+        debris temperature [K] for timestep i (rows = internal layers); surface and base must already be set
+    Td_past : np.array
+        debris temperature [K] for timestep i-1 (rows = internal layers)
+    i : int
+        step number
+    debris_thickness : float
+        debris thickness [m]
+    N : int
+        number of layers
+    h : float
+        height of debris layers [m]
+    C : float
+        constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme
+    A_Crank, S_Crank : np.array
+        work arrays of length N for the forward sweep (overwritten)
+    """
+    if i == 0:
+        Td_gradient = (Td[0] - Td[N-1])/debris_thickness
+        for j in range(1,N-1):
+            Td[j] = Td[0] - (j*h)*Td_gradient
+
+    else:
+        a_Crank = C
+        b_Crank = 2*C+1
+        c_Crank = C
+        for j in range(1,N-1):
+            if j == 1:
+                d_Crank = C*Td[0] + C*Td_past[0] + (1-2*C)*Td_past[j] + C*Td_past[j+1]
+            elif j < (N-2):
+                d_Crank = C*Td_past[j-1] + (1-2*C)*Td_past[j] + C*Td_past[j+1]
+            else:
+                d_Crank = 2*C*Td[N-1] + C*Td_past[N-3] + (1-2*C)*Td_past[N-2]
+
+            if j == 1:
+                A_Crank[j] = b_Crank
+                S_Crank[j] = d_Crank
+            else:
+                A_Crank[j] = b_Crank - a_Crank / A_Crank[j-1] * c_Crank
+                S_Crank[j] = d_Crank + a_Crank / A_Crank[j-1] * S_Crank[j-1]
+
+        for j in range(N-2,0,-1):
+            if j == (N-2):
+                Td[j] = S_Crank[j] / A_Crank[j]
+            else:
+                Td[j] = 1 / A_Crank[j] * (S_Crank[j] + c_Crank * Td[j+1])
+
+
+@numba.njit(cache=False)
+def calc_surface_fluxes_nb(Td0, Td1, Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, P, density_air_i,
+                           Albedo, k, a_neutral_debris, h, dsnow_t0, tsnow_t0, snow_tau_t0, ill_angle_rad_i,
+                           a_neutral_snow, debris_thickness, option_snow, option_snow_fromAWS):
+    """ Calculate surface energy fluxes for timestep i (see calc_surface_fluxes in meltmodel_global.py)
+
+    Parameters
+    ----------
+    Td0, Td1 : floats
+        debris temperature [K] of the surface and first internal layer
+    Remaining parameters are the same as calc_surface_fluxes
+
+    Returns
+    -------
+    F_Ts_i, dF_Ts_i : floats
+        Net energy flux [W m-2] and its derivative
+    dsnow_i, tsnow_i, snow_tau_i : floats
+        Snow depth [mwe], temperature [K] and non-dimensional age at end of time step
+    """
+    # Snow depth [m w.e.]
+    dsnow_i = dsnow_t0 + snow_i
+    snow_tau_i = snow_tau_t0
+    tsnow_i = 273.15
+
+    # First option: Snow depth is based on snow fall, so need to melt snow
+    if dsnow_i > 0 and option_snow==1 and option_snow_fromAWS == 0:
+        tsnow_i = (dsnow_t0 * tsnow_t0 + snow_i * Tair_i) / dsnow_i
+
+        # Thermal conductivity at debris/snow interface
+        if debris_thickness < 0.4:
+            h_eff = debris_thickness
+        else:
+            h_eff = 0.4
+        if dsnow_i < 0.4:
+            dsnow_eff = dsnow_i
+        else:
+            dsnow_eff = 0.4
+        k_snow_interface = (h_eff + dsnow_eff) / (dsnow_eff/k_snow + h_eff/k)
+
+        # Albedo
+        snow_r1 = np.exp(5000 * (1 / 273.16 - 1 / tsnow_i))
+        snow_r2 = min(snow_r1**10, 1.)
+        snow_r3 = 0.03 # change to 0.01 if in Antarctica
+        snow_tau_i += (snow_r1 + snow_r2 + snow_r3) / snow_tau_0 * delta_t
+        if snow_i > 0.01:
+            snow_tau_i = 0.
+        elif snow_i > 0:
+            snow_tau_i = snow_tau_i * (1 - 100 * snow_i)
+        snow_age = snow_tau_i / (1 + snow_tau_i)
+        albedo_vd = (1 - snow_c_v * snow_age) * albedo_vo
+        albedo_ird = (1 - snow_c_ir * snow_age) * albedo_iro
+        if np.cos(ill_angle_rad_i) < 0.5:
+            b_ill = 2
+            f_psi = 1/b_ill * ((1 + b_ill) / (1 + 2 * b_ill * np.cos(ill_angle_rad_i)) - 1)
+        else:
+            f_psi = 0.
+        albedo_v = albedo_vd + 0.4 * f_psi * (1 - albedo_vd)
+        albedo_ir = albedo_ird + 0.4 * f_psi * (1 - albedo_ird)
+        albedo_snow = (albedo_v + albedo_ir) / 2
+        if albedo_snow > 0.9:
+            albedo_snow = 0.9
+        elif albedo_snow < 0:
+            albedo_snow = 0.
+        if dsnow_i < 0.1:
+            r_adj = (1 - dsnow_i/0.1)*np.exp(dsnow_i / (2*0.1))
+            albedo_snow = r_adj * Albedo + (1 - r_adj) * albedo_snow
+
+        # Snow Energy Balance
+        Rn_snow = (Sin_i * (1 - albedo_snow) + emissivity_snow * (Lin_AWS_i - (stefan_boltzmann * tsnow_i**4)))
+        H_snow = a_neutral_snow * density_air_i * cA * u_AWS_i * (Tair_i - tsnow_i)
+        eZ = eZ_i
+        e_snow = eS_snow * np.exp(2838 * (tsnow_i - 273.15) / (0.4619 * tsnow_i * 273.15))
+        if e_snow > eS_snow:
+            e_snow = eS_snow
+        LE_snow = 0.622 * Ls / (Rd * Tair_i) * a_neutral_snow * u_AWS_i * (eZ - e_snow)
+        Pflux_snow = (Rain_AWS_i * (Lf * density_water + cW * density_water * (max(273.15, Tair_i) - 273.15)) /
+                      delta_t)
+        Qc_snow_debris = k_snow_interface * (Td0 - tsnow_i)/h
+
+        if LE_snow > 0:
+            Fnet_snow = Rn_snow + H_snow + LE_snow + Pflux_snow + Qc_snow_debris
+            snow_sublimation = 0.
+        else:
+            Fnet_snow = Rn_snow + H_snow + Pflux_snow + Qc_snow_debris
+            snow_sublimation = -1 * LE_snow / (density_water * Lv) * delta_t
+
+        # Cold content of snow [W m2]
+        Qcc_snow = cSnow * density_water * dsnow_i * (273.15 - tsnow_i) / delta_t
+        # Max energy spent cooling snowpack based on 1 degree temperature change
+        Qcc_snow_neg1 = -1 * cSnow * density_water * dsnow_i / delta_t
+
+        if Fnet_snow > Qcc_snow:
+            tsnow_i = 273.15
+            Fnet_snow -= Qcc_snow
+            Fnet_snow2debris = 0.
+        elif Fnet_snow < Qcc_snow_neg1:
+            tsnow_i -= 1
+            Fnet_snow2debris = Fnet_snow - Qcc_snow_neg1
+            Fnet_snow = 0.
+            Fnet_snow2debris_max = -1* c_d * row_d * h / delta_t
+            if Fnet_snow2debris < Fnet_snow2debris_max:
+                Fnet_snow2debris = Fnet_snow2debris_max
+        else:
+            tsnow_i += Fnet_snow / (cSnow * density_water * dsnow_i) * delta_t
+            Fnet_snow = 0.
+            Fnet_snow2debris = 0.
+
+        # Snow melt [m snow] with remaining energy, if any
+        snow_melt_energy = Fnet_snow / (density_water * Lf) * delta_t
+        snow_melt = snow_melt_energy + snow_sublimation
+
+        # Snow depth [m w.e.]
+        dsnow_i -= snow_melt
+        if dsnow_i < 0:
+            dsnow_i = 0.
+        if dsnow_i == 0:
+            snow_tau_i = 0.
+
+        # Solve for temperature in debris (Rn, LE, H, and P equal 0)
+        Qc_i = k * (Td1 - Td0) / h
+        Qc_snow_i = -Qc_snow_debris
+        F_Ts_i = 0 + 0 + 0 + Qc_i + 0 + Qc_snow_i  + Fnet_snow2debris
+        dF_Ts_i = 0 + 0 + 0 + -k/h + 0 + -k_snow_interface/h
+
+    # Second option: Snow depth is prescribed from AWS, so don't need to melt snow
+    elif dsnow_i > 0 and option_snow==1 and option_snow_fromAWS == 1:
+        dsnow_i = snow_i
+        tsnow_i = Tair_i
+        if tsnow_i > 273.15:
+            tsnow_i = 273.15
+        if debris_thickness < 0.4:
+            h_eff = debris_thickness
+        else:
+            h_eff = 0.4
+        if dsnow_i < 0.4:
+            dsnow_eff = dsnow_i
+        else:
+            dsnow_eff = 0.4
+        k_snow_interface = (h_eff + dsnow_eff) / (dsnow_eff/k_snow + h_eff/k)
+        Qc_snow_debris = k_snow_interface * (Td0 - tsnow_i)/h
+        Qc_i = k * (Td1 - Td0) / h
+        Qc_snow_i = -Qc_snow_debris
+        F_Ts_i = 0 + 0 + 0 + Qc_i + 0 + Qc_snow_i
+        dF_Ts_i = 0 + 0 + 0 + -k/h + 0 + -k_snow_interface/h
+
+    else:
+        # Debris-covered glacier Energy Balance (no snow)
+        if Rain_AWS_i > 0:
+            eS_Saturated = 611 * np.exp(-Lv / R_const * (1 / Td0 - 1 / 273.15))
+            eS = eS_Saturated
+            eZ = eZ_i
+            LE_i = 0.622 * density_air_0 / P0 * Lv * a_neutral_debris * u_AWS_i * (eZ -eS)
+        else:
+            LE_i = 0.
+        Rn_i = Sin_i * (1 - Albedo) + emissivity * (Lin_AWS_i - (5.67e-8 * Td0**4))
+        H_i = density_air_0 * (P / P0) * cA * a_neutral_debris * u_AWS_i * (Tair_i - Td0)
+        P_flux_i = density_water * cW * Rain_AWS_i / delta_t * (Tair_i - Td0)
+        Qc_i = k * (Td1 - Td0) / h
+        F_Ts_i = Rn_i + LE_i + H_i + Qc_i + P_flux_i
+
+        # Derivatives
+        if Rain_AWS_i > 0:
+            dLE_i = (-0.622 * density_air_0 / P0 * Lv * a_neutral_debris * u_AWS_i * 611 *
+                     np.exp(-Lv / R_const * (1 / Td0 - 1 / 273.15)) * (Lv / R_const * Td0**-2))
+        else:
+            dLE_i = 0.
+        dRn_i = -4 * emissivity * 5.67e-8 * Td0**3
+        dH_i = -1 * density_air_0 * P / P0 * cA * a_neutral_debris * u_AWS_i
+        dP_flux_i = -density_water * cW * Rain_AWS_i/ delta_t
+        dQc_i = -k / h
+        dF_Ts_i = dRn_i + dLE_i + dH_i + dQc_i + dP_flux_i
+
+    return F_Ts_i, dF_Ts_i, dsnow_i, tsnow_i, snow_tau_i
+
+
+@numba.njit(cache=False)
+def conduction_step_nb(Td, Td_past, Ts_mean, debris_thickness, N, h, C_step, k, A_Crank, S_Crank):
+    """ Conduction step of the debris decoupled from the surface (see debris_layers.py)
+
+    The debris below the surface is updated from Td_past with the mean surface temperature of the step (Ts_mean) and
+    a diffusion number of the length of the step (C_step); the surface temperature of Td is not changed.
+
+    Returns
+    -------
+    Qc_ice : float
+        mean conductive heat flux into the ice over the step [W m-2] (trapezoid of the start and end of the step)
+    """
+    Qc_ice = k * (Td_past[N-2] - Td_past[N-1]) / h
+    if Qc_ice < 0:
+        Qc_ice = 0.
+    Ts_i = Td[0]
+    Td[0] = Ts_mean
+    Td_past[0] = Ts_mean
+    crank_nicholson_nb(Td, Td_past, 1, debris_thickness, N, h, C_step, A_Crank, S_Crank)
+    Td[0] = Ts_i
+    Qc_ice_end = k * (Td[N-2] - Td[N-1]) / h
+    if Qc_ice_end > 0:
+        Qc_ice = (Qc_ice + Qc_ice_end) / 2
+    else:
+        Qc_ice = Qc_ice / 2
+    return Qc_ice
+
+
+@numba.njit(cache=False)
+def debris_eb_nb(Tair, eZ, u_AWS, Sin, Lin_AWS, Rain_AWS, snow, P, density_air, Albedo, k, a_neutral_debris,
+                 a_neutral_snow, ill_angle_rad, debris_thickness, N, h, C, n_iter_max, option_snow, option_snow_fromAWS,
+                 Ts_neighbor, n_sub=0):
+    """ Run the debris-covered glacier energy balance model for every timestep of a single simulation
+
+    Parameters
+    ----------
+    Tair, eZ, u_AWS, Sin, Lin_AWS, Rain_AWS, snow, ill_angle_rad : np.array
+        meteorological data (eZ is the vapor pressure of the air [Pa]) and solar illumination angle for each timestep
+    P : float
+        pressure [Pa]
+    density_air : np.array
+        density of air [kg m-3] for each timestep
+    Albedo, k, a_neutral_debris, a_neutral_snow : floats
+        debris albedo and thermal conductivity, and debris and snow turbulent heat flux transfer coefficients
+    debris_thickness : float
+        debris thickness [m]
+    N : int
+        number of layers
+    h : float
+        height of debris layers [m]
+    C : float
+        constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme
+    n_iter_max : int
+        maximum number of Newton-Raphson iterations
+    option_snow, option_snow_fromAWS : int
+        switches for the snow model (see calc_surface_fluxes)
+    Ts_neighbor : np.array
+        surface temperature [K] of a neighboring debris thickness for each timestep used for the initial guess of the
+        surface temperature (see ts_solver.continuation_start), or an empty array to start from the previous timestep
+    n_sub : int
+        number of timesteps in each conduction step of the debris decoupled from the surface, or 0 to update the
+        debris temperature profile at every iteration (see debris_layers.py)
+
+    Returns
+    -------
+    Melt : np.array
+        melt [m ice] for each timestep
+    dsnow : np.array
+        snow depth [mwe] for each timestep
+    Td_record : np.array
+        surface (row 0) and basal debris layer (row 1) temperatures [K] for each timestep
+    n_iterations : np.array
+        number of Newton-Raphson iterations for each timestep
+    """
+    nsteps = Tair.shape[0]
+    Td = np.zeros(N)
+    Td_past = np.zeros(N)
+    A_Crank = np.zeros(N)
+    S_Crank = np.zeros(N)
+    Td_record = np.zeros((2, nsteps))
+    n_iterations = np.zeros(nsteps)
+    Melt = np.zeros(nsteps)
+    dsnow = np.zeros(nsteps)
+
+    # Initial values
+    dsnow_t0 = 0.
+    tsnow_t0 = 273.15
+    snow_tau_t0 = 0.
+    tsnow_i = 273.15
+    snow_tau_i = 0.
+    # Decoupled debris: sum of the surface temperature since the last conduction step
+    Ts_sum = 0.
+    i_conduction = 0
+    coupled = True
+
+    for i in range(nsteps):
+        if i > 0:
+            Td, Td_past = Td_past, Td
+        Td[N-1] = 273.15
+
+        if i > 0:
+            dsnow_t0 = dsnow[i-1]
+            tsnow_t0 = tsnow_i
+            snow_tau_t0 = snow_tau_i
+
+        # The decoupled debris below the surface is only updated at the end of each conduction step; timesteps with
+        # snow on the debris are coupled, so the conduction step ends at the previous timestep
+        coupled = (n_sub == 0 or i == 0 or (option_snow == 1 and dsnow_t0 + snow[i] > 0))
+        if coupled and i_conduction < i - 1:
+            Qc_ice = conduction_step_nb(Td_past, Td, Ts_sum / (i - 1 - i_conduction), debris_thickness, N, h,
+                                        C * (i - 1 - i_conduction), k, A_Crank, S_Crank)
+            for i_step in range(i_conduction+1, i):
+                Melt[i_step] = Qc_ice * delta_t / (density_ice * Lf)
+            Ts_sum = 0.
+            i_conduction = i - 1
+        elif not coupled:
+            Td[1:N-1] = Td_past[1:N-1]
+
+        # Initially assume Ts = Tair, for all other time steps assume it's equal to previous Ts
+        #  (or follow the surface temperature of the neighboring debris thickness)
+        if Ts_neighbor.shape[0] > 0:
+            if i == 0:
+                Td[0] = Ts_neighbor[0]
+            else:
+                Td[0] = Td_past[0] + Ts_neighbor[i] - Ts_neighbor[i-1]
+        elif i == 0:
+            Td[0] = Tair[i]
+        else:
+            Td[0] = Td_past[0]
+
+        # Debris temperature profile and surface energy fluxes
+        if coupled:
+            crank_nicholson_nb(Td, Td_past, i, debris_thickness, N, h, C, A_Crank, S_Crank)
+        F_Ts_i, dF_Ts_i, dsnow[i], tsnow_i, snow_tau_i = (
+                calc_surface_fluxes_nb(Td[0], Td[1], Tair[i], eZ[i], u_AWS[i], Sin[i], Lin_AWS[i], Rain_AWS[i],
+                                       snow[i], P, density_air[i], Albedo, k, a_neutral_debris, h, dsnow_t0, tsnow_t0, snow_tau_t0,
+                                       ill_angle_rad[i], a_neutral_snow, debris_thickness, option_snow,
+                                       option_snow_fromAWS))
+
+        # Newton-Raphson method to solve for surface temperature
+        Ts_past = 0.
+        while abs(Td[0] - Ts_past) > 0.01 and n_iterations[i] < n_iter_max:
+            n_iterations[i] = n_iterations[i] + 1
+            Ts_past = Td[0]
+            # max step size is 1 degree C
+            Td[0] = Ts_past - F_Ts_i /dF_Ts_i
+            if (Td[0] - Ts_past) > 1:
+                Td[0] = Ts_past + 1
+            elif (Td[0] - Ts_past) < -1:
+                Td[0] = Ts_past - 1
+
+            if coupled:
+                crank_nicholson_nb(Td, Td_past, i, debris_thickness, N, h, C, A_Crank, S_Crank)
+            F_Ts_i, dF_Ts_i, dsnow[i], tsnow_i, snow_tau_i = (
+                    calc_surface_fluxes_nb(Td[0], Td[1], Tair[i], eZ[i], u_AWS[i], Sin[i], Lin_AWS[i],
+                                           Rain_AWS[i], snow[i], P, density_air[i], Albedo, k, a_neutral_debris, h, dsnow_t0,
+                                           tsnow_t0, snow_tau_t0, ill_angle_rad[i], a_neutral_snow, debris_thickness,
+                                           option_snow, option_snow_fromAWS))
+
+            if n_iterations[i] == n_iter_max:
+                Td[0] = (Td[0] + Ts_past) / 2
+
+        if coupled:
+            Qc_ice = k * (Td[N-2] - Td[N-1]) / h
+            if Qc_ice < 0:
+                Qc_ice = 0.
+            # Melt [m ice]
+            Melt[i] = Qc_ice * delta_t / (density_ice * Lf)
+            i_conduction = i
+
+        # Conduction step of the decoupled debris with the mean surface temperature of the step
+        else:
+            Ts_sum += Td[0]
+            if i % n_sub == 0 or i == nsteps - 1:
+                Qc_ice = conduction_step_nb(Td, Td_past, Ts_sum / (i - i_conduction), debris_thickness, N, h,
+                                            C * (i - i_conduction), k, A_Crank, S_Crank)
+                # Melt [m ice] spread evenly over the timesteps of the conduction step
+                for i_step in range(i_conduction+1, i+1):
+                    Melt[i_step] = Qc_ice * delta_t / (density_ice * Lf)
+                Ts_sum = 0.
+                i_conduction = i
+
+        Td_record[0,i] = Td[0]
+        Td_record[1,i] = Td[N-2]
+
+    return Melt, dsnow, Td_record, n_iterations
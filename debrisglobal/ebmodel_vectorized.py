@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Debris-covered glacier energy balance model vectorized across the Monte Carlo ensemble, debris thicknesses and
+elevations
+
+The physics are identical to CrankNicholson and calc_surface_fluxes in meltmodel_global.py, but every simulation is
+advanced together as one column of a (layers x columns) array. A column is one combination of debris thickness and
+Monte Carlo member (and optionally elevation), so each column has its own debris thickness, albedo, surface roughness,
+thermal conductivity and incoming shortwave factor, and columns at different elevations have their own forcing. 
+Columns with fewer layers are padded below the debris/ice interface (the layers and conduction step of each column
+are chosen by debris_layers.py). The Newton-Raphson iteration for the surface temperature keeps a per-column
+convergence mask, so columns that have converged are no longer updated while the others keep iterating.
+"""
+
+# External libraries
+import numpy as np
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.ts_solver as ts_solver
+import debrisglobal.debris_layers as debris_layers
+
+
+def crank_nicholson_vec(Td_cur, Td_prev, i, debris_thickness, N, h, C, A_Crank):
+    """ Run Crank-Nicholson scheme to obtain debris temperature for all columns at timestep i
+
+    Parameters
+    ----------
+    Td_cur : np.array
+        debris temperature [K] at the current timestep (rows = layers, columns = simulations); the surface (row 0)
+        and the debris/ice interface (row N-1) must already be set
+    Td_prev : np.array
+        debris temperature [K] at the previous timestep (rows = layers, columns = simulations)
+    i : int
+        step number
+    debris_thickness : np.array
+        debris thickness [m] of each column
+    N : np.array
+        number of layers of each column (rows below N-1 are padding)
+    h : np.array
+        height of debris layers [m] of each column
+    C : np.array
+        constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme of each column
+    A_Crank : np.array
+        forward elimination coefficients (rows = layers, columns = simulations), which only depend on C and are
+        therefore constant through time (see crank_nicholson_coeffs)
+
+    Returns
+    -------
+    Td_cur : np.array
+        updated debris temperature [K] at the current timestep
+    """
+    N_max = Td_cur.shape[0]
+    col_idx = np.arange(Td_cur.shape[1])
+    # For t = 0, which is i = 1, assume initial condition of linear temperature profile in the debris
+    if i == 0:
+        Td_gradient = (Td_cur[0] - Td_cur[N-1,col_idx])/debris_thickness
+        for j in np.arange(1,N_max-1):
+            Td_cur[j] = np.where(j < N-1, Td_cur[0] - (j*h)*Td_gradient, Td_cur[j])
+        return Td_cur
+
+    # Equations A9 in Reid and Brock (2010)
+    d_Crank = np.zeros(Td_cur.shape)
+    for j in np.arange(2,N_max-1):
+        d_Crank[j] = C*Td_prev[j-1] + (1-2*C)*Td_prev[j] + C*Td_prev[j+1]
+    d_Crank[N-2,col_idx] = (2*C*Td_cur[N-1,col_idx] + C*Td_prev[N-3,col_idx] + (1-2*C)*Td_prev[N-2,col_idx])
+    d_Crank[1] = C*Td_cur[0] + C*Td_prev[0] + (1-2*C)*Td_prev[1] + C*Td_prev[2]
+    # note notation:
+    #  "i-1" refers to the past
+    #  "j-1" refers to the cell above it
+    #  "j+1" refers to the cell below it
+
+    # Equations A10 and A11 in Reid and Brock (2010)
+    S_Crank = np.zeros(Td_cur.shape)
+    S_Crank[1] = d_Crank[1]
+    for j in np.arange(2,N_max-1):
+        S_Crank[j] = d_Crank[j] + C / A_Crank[j-1] * S_Crank[j-1]
+
+    # Equations A12 in Reid and Brock (2010)
+    for j in np.arange(N_max-2,0,-1):
+        if j < N_max-2:
+            Td_cur[j] = np.where(j < N-2, 1 / A_Crank[j] * (S_Crank[j] + C * Td_cur[j+1]), Td_cur[j])
+        Td_cur[j] = np.where(j == N-2, S_Crank[j] / A_Crank[j], Td_cur[j])
+    return Td_cur
+
+
+def crank_nicholson_coeffs(N_max, C):
+    """ Forward elimination coefficients (A in Equations A10 of Reid and Brock, 2010)
+
+    a, b and c of the tridiagonal system are C, 2C+1 and C for every layer and timestep, so A only needs to be
+    computed once per column rather than at every timestep and Newton-Raphson iteration.
+
+    Parameters
+    ----------
+    N_max : int
+        number of layers of the deepest column
+    C : np.array
+        constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme of each column
+
+    Returns
+    -------
+    A_Crank : np.array
+        forward elimination coefficients (rows = layers, columns = simulations)
+    """
+    A_Crank = np.ones((N_max, C.shape[0]))
+    for j in np.arange(1,N_max-1):
+        if j == 1:
+            A_Crank[j] = 2*C+1
+        else:
+            A_Crank[j] = 2*C+1 - C / A_Crank[j-1] * C
+    return A_Crank
+
+
+def conduction_step_vec(Td_cur, Td_prev, Ts_mean, debris_thickness, N, h, C_step, k):
+    """ Conduction step of the debris decoupled from the surface (see debris_layers.py)
+
+    The debris below the surface is updated from Td_prev with the mean surface temperature of the step (Ts_mean) and
+    a diffusion number of the length of the step (C_step); the surface temperature of Td_cur is not changed.
+
+    Returns
+    -------
+    Td_cur : np.array
+        updated debris temperature [K] at the end of the step (rows = layers, columns = simulations)
+    Qc_ice : np.array
+        mean conductive heat flux into the ice over the step [W m-2] (trapezoid of the start and end of the step)
+    """
+    cols = np.arange(Td_cur.shape[1])
+    Qc_ice_start = k * (Td_prev[N-2,cols] - Td_prev[N-1,cols]) / h
+    Ts_i = Td_cur[0].copy()
+    Td_cur[0] = Ts_mean
+    Td_prev[0] = Ts_mean
+    Td_cur = crank_nicholson_vec(Td_cur, Td_prev, 1, debris_thickness, N, h, C_step,
+                                 crank_nicholson_coeffs(Td_cur.shape[0], C_step))
+    Td_cur[0] = Ts_i
+    Qc_ice_end = k * (Td_cur[N-2,cols] - Td_cur[N-1,cols]) / h
+    Qc_ice = (np.maximum(Qc_ice_start, 0) + np.maximum(Qc_ice_end, 0)) / 2
+    return Td_cur, Qc_ice
+
+
+def column_values(values, idx):
+    """ Values of the columns idx of an input that is either the same for all columns (scalar) or one per column """
+    if np.ndim(values) == 0:
+        return values
+    return values[idx]
+
+
+def calc_surface_fluxes_vec(Td0, Td1, Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, P, density_air_i,
+                            Albedo, k, a_neutral_debris, h, dsnow_t0, tsnow_t0, snow_tau_t0, ill_angle_rad_i,
+                            a_neutral_snow, debris_thickness, option_snow=0):
+    """ Calculate surface energy fluxes for timestep i for all columns
+
+    Vectorized version of calc_surface_fluxes in meltmodel_global.py (snow depth based on snow fall, i.e.,
+    option_snow_fromAWS = 0). Columns with snow on the surface follow the snow branch and all others follow the
+    debris branch.
+
+    Parameters
+    ----------
+    Td0, Td1 : np.array
+        temperature of the surface and the first internal debris layer [K] of each column
+    Tair_i, eZ_i, Lin_AWS_i, Rain_AWS_i, snow_i, ill_angle_rad_i : float or np.array
+        meteorological data (eZ_i is the vapor pressure of the air [Pa]), either the same for all columns or one
+        value per column (e.g., columns at different elevations)
+    u_AWS_i, Sin_i : np.array
+        wind speed and incoming shortwave radiation, which depend on the column's surface roughness and Sin factor
+    P, density_air_i : float or np.array
+        pressure [Pa] and density of air [kg m-3], either the same for all columns or one value per column
+    Albedo, k, a_neutral_debris, a_neutral_snow : np.array
+        debris albedo, thermal conductivity, and turbulent heat flux transfer coefficients of each column
+    h : np.array
+        debris layer height [m] of each column
+    dsnow_t0, tsnow_t0, snow_tau_t0 : np.array
+        snow depth, temperature and dimensionless age at start of time step before any snow or melt has occurred
+    debris_thickness : np.array
+        debris thickness [m] of each column
+    option_snow : int
+        switch to use snow model (1) or not (0)
+
+    Returns
+    -------
+    F_Ts_i, dF_Ts_i : np.array
+        net surface energy flux [W m-2] and its derivative with respect to surface temperature
+    dsnow_i, tsnow_i, snow_tau_i : np.array
+        snow depth [mwe], snow temperature [K] and non-dimensional snow age at end of time step
+    """
+    # Snow depth [m w.e.]
+    dsnow_i = dsnow_t0 + snow_i
+    snow_tau_i = snow_tau_t0.copy()
+    tsnow_i = np.zeros(dsnow_i.shape) + 273.15
+    F_Ts_i = np.zeros(dsnow_i.shape)
+    dF_Ts_i = np.zeros(dsnow_i.shape)
+
+    if option_snow == 1:
+        snow_idx = np.where(dsnow_i > 0)[0]
+    else:
+        snow_idx = np.array([], dtype=int)
+    nosnow_idx = np.setdiff1d(np.arange(dsnow_i.shape[0]), snow_idx, assume_unique=True)
+
+    # ===== Snow on the surface =====
+    if len(snow_idx) > 0:
+        s = snow_idx
+        Tair_s = column_values(Tair_i, s)
+        snow_s = column_values(snow_i, s)
+        Rain_s = column_values(Rain_AWS_i, s)
+        ds_s = dsnow_i[s]
+        ts_s = (dsnow_t0[s] * tsnow_t0[s] + snow_s * Tair_s) / ds_s
+        k_s = k[s]
+        h_s = h[s]
+
+        # Thermal conductivity at debris/snow interface assuming conductance resistance is additive
+        h_eff = np.minimum(debris_thickness[s], 0.4)
+        dsnow_eff = np.minimum(ds_s, 0.4)
+        k_snow_interface = (h_eff + dsnow_eff) / (dsnow_eff/debris_prms.k_snow + h_eff/k_s)
+
+
+        # Albedo
+        snow_r1 = np.exp(5000 * (1 / 273.16 - 1 / ts_s))
+        snow_r2 = np.minimum(snow_r1**10, 1)
+        snow_r3 = 0.03 # change to 0.01 if in Antarctica
+        # change in non-dimensional snow surface age
+        tau_s = snow_tau_i[s] + (snow_r1 + snow_r2 + snow_r3) / debris_prms.snow_tau_0 * debris_prms.delta_t
+        # new snow affect on snow age
+        tau_s = np.where(snow_s > 0.01, 0, np.where(snow_s > 0, tau_s * (1 - 100 * snow_s), tau_s))
+        # snow age
+        snow_age = tau_s / (1 + tau_s)
+        # albedo as a function of snow age and band
+        albedo_vd = (1 - debris_prms.snow_c_v * snow_age) * debris_prms.albedo_vo
+        albedo_ird = (1 - debris_prms.snow_c_ir * snow_age) * debris_prms.albedo_iro
+        # increase in albedo based on illumination angle
+        cos_ill_s = np.cos(column_values(ill_angle_rad_i, s))
+        b_ill = 2
+        f_psi = np.where(cos_ill_s < 0.5, 1/b_ill * ((1 + b_ill) / (1 + 2 * b_ill * cos_ill_s) - 1), 0)
+        albedo_v = albedo_vd + 0.4 * f_psi * (1 - albedo_vd)
+        albedo_ir = albedo_ird + 0.4 * f_psi * (1 - albedo_ird)
+        albedo_snow = (albedo_v + albedo_ir) / 2
+        # ensure albedo is within bounds
+        albedo_snow[albedo_snow > 0.9] = 0.9
+        albedo_snow[albedo_snow < 0] = 0
+        # if snow less than 0.1 m, then underlying debris influences albedo
+        r_adj = (1 - ds_s/0.1)*np.exp(ds_s / (2*0.1))
+        albedo_snow = np.where(ds_s < 0.1, r_adj * Albedo[s] + (1 - r_adj) * albedo_snow, albedo_snow)
+
+        # Snow Energy Balance
+        Rn_snow = (Sin_i[s] * (1 - albedo_snow) + debris_prms.emissivity_snow * (column_values(Lin_AWS_i, s) -
+                   (debris_prms.stefan_boltzmann * ts_s**4)))
+        H_snow = (a_neutral_snow[s] * column_values(density_air_i, s) * debris_prms.cA * u_AWS_i[s] * 
+                  (Tair_s - ts_s))
+        eZ = column_values(eZ_i, s)
+        e_snow = debris_prms.eS_snow * np.exp(2838 * (ts_s - 273.15) / (0.4619 * ts_s * 273.15))
+        e_snow[e_snow > debris_prms.eS_snow] = debris_prms.eS_snow
+        LE_snow = 0.622 * debris_prms.Ls / (debris_prms.Rd * Tair_s) * a_neutral_snow[s] * u_AWS_i[s] * (eZ - e_snow)
+        Pflux_snow = (Rain_s * (debris_prms.Lf * debris_prms.density_water + debris_prms.cW *
+                                debris_prms.density_water *
+                                (np.maximum(273.15, Tair_s) - 273.15)) / debris_prms.delta_t)
+        Qc_snow_debris = k_snow_interface * (Td0[s] - ts_s)/h_s
+
+        # Net energy available for snow depends on latent heat flux
+        Fnet_snow = np.where(LE_snow > 0, Rn_snow + H_snow + LE_snow + Pflux_snow + Qc_snow_debris,
+                             Rn_snow + H_snow + Pflux_snow + Qc_snow_debris)
+        snow_sublimation = np.where(LE_snow > 0, 0,
+                                    -1 * LE_snow / (debris_prms.density_water * debris_prms.Lv) * debris_prms.delta_t)
+
+        # Cold content of snow [W m2]
+        Qcc_snow = debris_prms.cSnow * debris_prms.density_water * ds_s * (273.15 - ts_s) / debris_prms.delta_t
+        # Max energy spent cooling snowpack based on 1 degree temperature change
+        Qcc_snow_neg1 = -1 * debris_prms.cSnow * debris_prms.density_water * ds_s / debris_prms.delta_t
+
+        warm_mask = Fnet_snow > Qcc_snow
+        cool_mask = (~warm_mask) & (Fnet_snow < Qcc_snow_neg1)
+        temp_mask = (~warm_mask) & (~cool_mask)
+        Fnet_snow2debris = np.zeros(ds_s.shape)
+        # Snow warmed up to melting temperature and remaining energy melts the snow
+        ts_new = ts_s.copy()
+        ts_new[warm_mask] = 273.15
+        Fnet_new = Fnet_snow.copy()
+        Fnet_new[warm_mask] = Fnet_snow[warm_mask] - Qcc_snow[warm_mask]
+        # Limit the change in snow temperature and remaining energy goes to cool down the debris, which is limited
+        #  to cooling the top layer by 1 degree
+        ts_new[cool_mask] = ts_s[cool_mask] - 1
+        Fnet_snow2debris[cool_mask] = Fnet_snow[cool_mask] - Qcc_snow_neg1[cool_mask]
+        Fnet_new[cool_mask] = 0
+        Fnet_snow2debris_max = -1* debris_prms.c_d * debris_prms.row_d * h_s / debris_prms.delta_t
+        Fnet_snow2debris = np.where(Fnet_snow2debris < Fnet_snow2debris_max, Fnet_snow2debris_max, Fnet_snow2debris)
+        # Otherwise only changes the temperature
+        ts_new[temp_mask] = (ts_s[temp_mask] + Fnet_snow[temp_mask] /
+                             (debris_prms.cSnow * debris_prms.density_water * ds_s[temp_mask]) * debris_prms.delta_t)
+        Fnet_new[temp_mask] = 0
+
+        # Snow melt [m snow] with remaining energy, if any
+        snow_melt_energy = Fnet_new / (debris_prms.density_water * debris_prms.Lf) * debris_prms.delta_t
+        snow_melt = snow_melt_energy + snow_sublimation
+
+        # Snow depth [m w.e.]
+        ds_s = ds_s - snow_melt
+        ds_s[ds_s < 0] = 0
+        tau_s[ds_s == 0] = 0
+
+        # Solve for temperature in debris (Rn, LE, H, and P equal 0)
+        Qc_i = k_s * (Td1[s] - Td0[s]) / h_s
+        F_Ts_i[s] = Qc_i - Qc_snow_debris + Fnet_snow2debris
+        dF_Ts_i[s] = -k_s/h_s - k_snow_interface/h_s
+
+        dsnow_i[s] = ds_s
+        tsnow_i[s] = ts_new
+        snow_tau_i[s] = tau_s
+
+    # ===== Debris-covered glacier energy balance (no snow) =====
+    if len(nosnow_idx) > 0:
+        n = nosnow_idx
+        Td0_n = Td0[n]
+        u_n = u_AWS_i[n]
+        a_n = a_neutral_debris[n]
+        k_n = k[n]
+        h_n = h[n]
+        Tair_n = column_values(Tair_i, n)
+        Rain_n = column_values(Rain_AWS_i, n)
+        P_n = column_values(P, n)
+        rain_any = np.any(Rain_n > 0)
+        if rain_any:
+            # if raining, assume the surface is saturated
+            eS_Saturated = 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Td0_n - 1 / 273.15))
+            eS = eS_Saturated
+            eZ = column_values(eZ_i, n)
+            LE_i = np.where(Rain_n > 0, (0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * a_n * 
+                                         u_n * (eZ -eS)), 0)
+        else:
+            LE_i = 0
+        Rn_i = (Sin_i[n] * (1 - Albedo[n]) + debris_prms.emissivity * (column_values(Lin_AWS_i, n) - 
+                                                                         (5.67e-8 * Td0_n**4)))
+        H_i = (debris_prms.density_air_0 * (P_n / debris_prms.P0) * debris_prms.cA * a_n * u_n *
+               (Tair_n - Td0_n))
+        P_flux_i = debris_prms.density_water * debris_prms.cW * Rain_n / debris_prms.delta_t * (Tair_n - Td0_n)
+        Qc_i = k_n * (Td1[n] - Td0_n) / h_n
+        F_Ts_i[n] = Rn_i + LE_i + H_i + Qc_i + P_flux_i
+
+        # Derivatives
+        if rain_any:
+            dLE_i = np.where(Rain_n > 0, (-0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * 
+                                          a_n * u_n * 611 * 
+                                          np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Td0_n - 1 / 273.15))
+                                          * (debris_prms.Lv / debris_prms.R_const * Td0_n**-2)), 0)
+        else:
+            dLE_i = 0
+        dRn_i = -4 * debris_prms.emissivity * 5.67e-8 * Td0_n**3
+        dH_i = -1 * debris_prms.density_air_0 * P_n / debris_prms.P0 * debris_prms.cA * a_n * u_n
+        dP_flux_i = -debris_prms.density_water * debris_prms.cW * Rain_n/ debris_prms.delta_t
+        dQc_i = -k_n / h_n
+        dF_Ts_i[n] = dRn_i + dLE_i + dH_i + dQc_i + dP_flux_i
+
+    return F_Ts_i, dF_Ts_i, dsnow_i, tsnow_i, snow_tau_i
+
+
+def debris_eb_ensemble(Tair, eZ, u_AWS_raw, Sin, Lin_AWS, Rain_AWS, snow, P, density_air, ill_angle_rad, 
+                       debris_thickness, albedo, z0, k, z0_snow, sin_factor, n_iter_max=debris_prms.n_iter_max,
+                       option_snow=debris_prms.option_snow, option_snow_fromAWS=debris_prms.option_snow_fromAWS,
+                       latlon=None, n_iter_hist=None, n_iter_hist_row=None, forcing_col=None, Ts_neighbor=None,
+                       option_layers_adaptive=None):
+    """ Debris-covered glacier energy balance for many simulations (columns) at once
+
+    Parameters
+    ----------
+    Tair, eZ, u_AWS_raw, Sin, Lin_AWS, Rain_AWS, snow : np.array
+        meteorological data for each timestep (air temperature, vapor pressure of the air and rain and snow from
+        forcing_precompute in meltmodel_global.py); rows are timesteps and, if 2-D, columns are the forcings
+        selected by forcing_col (e.g., elevations)
+    P : float or np.array
+        pressure [Pa] (of each forcing if an array)
+    density_air : np.array
+        density of air [kg m-3] for each timestep (and forcing if 2-D)
+    ill_angle_rad : np.array
+        solar illumination angle [radians] for each timestep
+    debris_thickness : float or np.array
+        debris thickness [m], either the same for all columns or one per column
+    albedo, z0, k, z0_snow, sin_factor : np.array
+        debris albedo, surface roughness [m], thermal conductivity [W m-1 K-1], snow surface roughness [m] and
+        multiplicative factor for incoming shortwave radiation of each column
+    n_iter_max : int
+        maximum number of Newton-Raphson iterations
+    option_snow : int
+        switch to use snow model (1) or not (0)
+    option_snow_fromAWS : int
+        switch to use snow depth (1) instead of snow fall (0); only snow fall is supported
+    latlon : tuple
+        latitude and longitude used for printing when the Newton-Raphson method maxes out
+    n_iter_hist : np.array
+        histogram of the number of iterations per timestep (see ts_solver.py) that is updated in place (optional)
+    n_iter_hist_row : np.array
+        row of n_iter_hist of each column if n_iter_hist has a histogram for each group of columns (optional)
+    forcing_col : np.array
+        index of the forcing of each column, used for the forcing that is 2-D (or P if an array)
+    Ts_neighbor : np.array
+        surface temperature [K] (rows = timestep, columns = simulations) of a neighboring debris thickness used for the
+        initial guess of the surface temperature (optional, see ts_solver.continuation_start)
+    option_layers_adaptive : int
+        switch to choose the layers and conduction step from the diffusion number (1) or to use the reference
+        configuration (0); default is option_layers_adaptive of globaldebris_input (see debris_layers.py)
+
+    Returns
+    -------
+    Melt_all : np.array
+        melt [m ice] (rows = timestep, columns = simulations)
+    dsnow_all : np.array
+        snow depth [m w.e.] (rows = timestep, columns = simulations)
+    Ts_all : np.array
+        surface temperature [K] (rows = timestep, columns = simulations)
+    """
+    assert option_snow_fromAWS == 0, 'Vectorized energy balance only supports snow based on snow fall'
+
+    albedo = np.asarray(albedo, dtype=float).ravel()
+    z0 = np.asarray(z0, dtype=float).ravel()
+    k = np.asarray(k, dtype=float).ravel()
+    z0_snow = np.asarray(z0_snow, dtype=float).ravel()
+    sin_factor = np.asarray(sin_factor, dtype=float).ravel()
+    ncols = albedo.shape[0]
+    debris_thickness = np.zeros(ncols) + debris_thickness
+    nsteps = Tair.shape[0]
+
+    # Number of layers, height of each layer, constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme 
+    #  and conduction step of the decoupled debris (see debris_layers.py)
+    N, h, C, n_sub = debris_layers.debris_layers(debris_thickness, k, option_adaptive=option_layers_adaptive)
+    N_max = N.max()
+    decoupled_idx = np.where(n_sub > 0)[0]
+
+    # Turbulent heat flux transfer coefficient (neutral conditions)
+    a_neutral_debris = debris_prms.Kvk**2/(np.log(debris_prms.za/z0))**2
+    a_neutral_snow = debris_prms.Kvk**2/(np.log(debris_prms.za/z0_snow))**2
+    # Adjust wind speed from sensor height to 2 m accounting for surface roughness
+    u_factor = np.log(2/z0)/(np.log(debris_prms.zw/z0))
+    A_Crank = crank_nicholson_coeffs(N_max, C)
+
+    Melt_all = np.zeros((nsteps, ncols))
+    dsnow_all = np.zeros((nsteps, ncols))
+    Ts_all = np.zeros((nsteps, ncols))
+
+    # Debris temperature at the previous and current timestep
+    #  the debris/ice interface and any padding below it are fixed at the melting point
+    Td_prev = np.zeros((N_max, ncols)) + 273.15
+    Td_cur = np.zeros((N_max, ncols)) + 273.15
+    all_idx = np.arange(ncols)
+    # Snow state at the start of the timestep
+    dsnow_t0 = np.zeros(ncols)
+    tsnow_t0 = np.zeros(ncols) + 273.15
+    snow_tau_t0 = np.zeros(ncols)
+    # Decoupled debris: sum of the surface temperature since the last conduction step
+    Ts_sum = np.zeros(ncols)
+    i_conduction = np.zeros(ncols, dtype=int)
+
+    def forcing_values(values, idx):
+        """ Forcing of the columns idx (forcing that is the same for all columns is returned as is) """
+        if forcing_col is None:
+            return values
+        return column_values(values, forcing_col[idx])
+
+    def eval_columns(idx, Td_sub, i):
+        """ Debris temperature profile and surface energy fluxes for a subset of columns """
+        # the decoupled debris below the surface is only updated at the end of each conduction step
+        coupled_sub = coupled[idx]
+        if coupled_sub.all():
+            Td_sub = crank_nicholson_vec(Td_sub, Td_prev[:,idx], i, debris_thickness[idx], N[idx], h[idx], C[idx],
+                                         A_Crank[:,idx])
+        elif coupled_sub.any():
+            c = idx[coupled_sub]
+            Td_sub[:,coupled_sub] = crank_nicholson_vec(Td_sub[:,coupled_sub], Td_prev[:,c], i, debris_thickness[c],
+                                                        N[c], h[c], C[c], A_Crank[:,c])
+        return (Td_sub,) + calc_surface_fluxes_vec(
+                Td_sub[0], Td_sub[1], forcing_values(Tair[i], idx), forcing_values(eZ[i], idx), 
+                forcing_values(u_AWS_raw[i], idx) * u_factor[idx], forcing_values(Sin[i], idx) * sin_factor[idx],
+                forcing_values(Lin_AWS[i], idx), forcing_values(Rain_AWS[i], idx), forcing_values(snow[i], idx), 
+                forcing_values(P, idx), forcing_values(density_air[i], idx), albedo[idx], k[idx], 
+                a_neutral_debris[idx], h[idx], dsnow_t0[idx], tsnow_t0[idx], snow_tau_t0[idx], 
+                forcing_values(ill_angle_rad[i], idx), a_neutral_snow[idx], debris_thickness[idx], 
+                option_snow=option_snow)
+
+    for i in np.arange(0,nsteps):
+        Td_cur[N-1,all_idx] = 273.15
+        # The decoupled debris below the surface is only updated at the end of each conduction step; timesteps with
+        #  snow on the debris are coupled, so the conduction step ends at the previous timestep
+        coupled = (n_sub == 0) | (i == 0)
+        if option_snow == 1:
+            coupled = coupled | (dsnow_t0 + forcing_values(snow[i], all_idx) > 0)
+        if i > 0 and len(decoupled_idx) > 0:
+            e = np.where(coupled & (i_conduction < i - 1))[0]
+            if len(e) > 0:
+                n_conduction = i - 1 - i_conduction[e]
+                Td_prev[:,e], Qc_ice_step = conduction_step_vec(
+                        Td_prev[:,e], Td_cur[:,e], Ts_sum[e] / n_conduction, debris_thickness[e], N[e], h[e],
+                        C[e] * n_conduction, k[e])
+                # Melt [m ice] spread evenly over the timesteps of the conduction step
+                for n in np.unique(n_conduction):
+                    Melt_all[i-n:i,e[n_conduction == n]] = (
+                            Qc_ice_step[n_conduction == n] * debris_prms.delta_t / 
+                            (debris_prms.density_ice * debris_prms.Lf))
+                Ts_sum[e] = 0
+                i_conduction[e] = i - 1
+            d = np.where(~coupled)[0]
+            Td_cur[1:,d] = Td_prev[1:,d]
+        # Initially assume Ts = Tair, for all other time steps assume it's equal to previous Ts
+        #  (or follow the surface temperature of the neighboring debris thickness)
+        if Ts_neighbor is not None:
+            Td_cur[0] = ts_solver.continuation_start(Ts_all, Ts_neighbor, i)
+        elif i == 0:
+            Td_cur[0] = forcing_values(Tair[i], all_idx)
+        else:
+            Td_cur[0] = Td_prev[0]
+
+        Td_cur, F_Ts, dF_Ts, dsnow, tsnow, snow_tau = eval_columns(all_idx, Td_cur, i)
+
+        # Newton-Raphson method to solve for surface temperature
+        n_iterations = np.zeros(ncols)
+        Ts_past = np.zeros(ncols)
+        active_idx = np.where(np.abs(Td_cur[0] - Ts_past) > 0.01)[0]
+        while len(active_idx) > 0:
+            a = active_idx
+            n_iterations[a] = n_iterations[a] + 1
+            Ts_past[a] = Td_cur[0,a]
+            # max step size is 1 degree C
+            Ts_new = Ts_past[a] - F_Ts[a] / dF_Ts[a]
+            Ts_new = np.where(Ts_new - Ts_past[a] > 1, Ts_past[a] + 1, Ts_new)
+            Ts_new = np.where(Ts_new - Ts_past[a] < -1, Ts_past[a] - 1, Ts_new)
+            Td_sub = Td_cur[:,a]
+            Td_sub[0] = Ts_new
+
+            Td_sub, F_Ts[a], dF_Ts[a], dsnow[a], tsnow[a], snow_tau[a] = eval_columns(a, Td_sub, i)
+
+            maxed_mask = n_iterations[a] == n_iter_max
+            if maxed_mask.any():
+                Td_sub[0,maxed_mask] = (Td_sub[0,maxed_mask] + Ts_past[a][maxed_mask]) / 2
+                for ncol in a[maxed_mask]:
+                    print(latlon, 'debris_thickness:', debris_thickness[ncol], 'column:', ncol, 'Timestep ', i,
+                          'maxed out at ', n_iterations[ncol], 'iterations.')
+            Td_cur[:,a] = Td_sub
+
+            active_idx = a[(np.abs(Td_cur[0,a] - Ts_past[a]) > 0.01) & (n_iterations[a] < n_iter_max)]
+        
+        if n_iter_hist is not None:
+            ts_solver.update_iteration_histogram(n_iter_hist, n_iterations, rows=n_iter_hist_row)
+
+        Qc_ice = k * (Td_cur[N-2,all_idx] - Td_cur[N-1,all_idx]) / h
+        Qc_ice[Qc_ice < 0] = 0
+        # Melt [m ice]
+        Melt_all[i] = Qc_ice * debris_prms.delta_t / (debris_prms.density_ice * debris_prms.Lf)
+
+        i_conduction[coupled] = i
+
+        # Conduction step of the decoupled debris with the mean surface temperature of the step
+        if len(decoupled_idx) > 0 and not coupled.all():
+            d = np.where(~coupled)[0]
+            Ts_sum[d] += Td_cur[0,d]
+            e = d[(i % n_sub[d] == 0) | (i == nsteps - 1)]
+            if len(e) > 0:
+                n_conduction = i - i_conduction[e]
+                Td_cur[:,e], Qc_ice_step = conduction_step_vec(
+                        Td_cur[:,e], Td_prev[:,e], Ts_sum[e] / n_conduction, debris_thickness[e], N[e], h[e],
+                        C[e] * n_conduction, k[e])
+                # Melt [m ice] spread evenly over the timesteps of the conduction step
+                for n in np.unique(n_conduction):
+                    Melt_all[i-n+1:i+1,e[n_conduction == n]] = (
+                            Qc_ice_step[n_conduction == n] * debris_prms.delta_t / 
+                            (debris_prms.density_ice * debris_prms.Lf))
+                Ts_sum[e] = 0
+                i_conduction[e] = i
+        dsnow_all[i] = dsnow
+        Ts_all[i] = Td_cur[0]
+
+        # Update state for next timestep
+        Td_prev, Td_cur = Td_cur, Td_prev
+        dsnow_t0 = dsnow
+        tsnow_t0 = tsnow
+        snow_tau_t0 = snow_tau
+
+    return Melt_all, dsnow_all, Ts_all
+
+
+def debris_eb_lockstep(Tair, eZ, u_AWS_raw, Sin, Lin_AWS, Rain_AWS, snow, P, density_air, ill_angle_rad,
+                       debris_thickness_all, albedo, z0, k, z0_snow, sin_factor, **kwargs):
+    """ Debris-covered glacier energy balance for all debris thicknesses and members in one pass through the forcing
+
+    Every combination of debris thickness and member becomes one column of debris_eb_ensemble, so the forcing is
+    only swept once regardless of the number of debris thicknesses.
+
+    Parameters
+    ----------
+    debris_thickness_all : np.array
+        debris thicknesses [m], all of which must be greater than zero
+    albedo, z0, k, z0_snow, sin_factor : np.array
+        properties of each member (see debris_eb_ensemble)
+    other parameters and keyword arguments are passed to debris_eb_ensemble; n_iter_hist can be 2-D with the 
+    histogram of each debris thickness (rows)
+
+    Returns
+    -------
+    Melt_all, dsnow_all, Ts_all : np.array
+        melt [m ice], snow depth [m w.e.] and surface temperature [K] (dimensions = timestep, debris thickness,
+        member)
+    """
+    debris_thickness_all = np.asarray(debris_thickness_all, dtype=float)
+    assert (debris_thickness_all > 0).all(), 'Lockstep simulations are only for debris-covered ice'
+    nmembers = np.asarray(albedo).ravel().shape[0]
+    n_hd = debris_thickness_all.shape[0]
+    mc_idx = np.tile(np.arange(nmembers), n_hd)
+    if kwargs.get('n_iter_hist') is not None and kwargs['n_iter_hist'].ndim == 2:
+        kwargs['n_iter_hist_row'] = np.repeat(np.arange(n_hd), nmembers)
+
+    outputs = debris_eb_ensemble(
+            Tair, eZ, u_AWS_raw, Sin, Lin_AWS, Rain_AWS, snow, P, density_air, ill_angle_rad,
+            np.repeat(debris_thickness_all, nmembers), np.asarray(albedo).ravel()[mc_idx],
+            np.asarray(z0).ravel()[mc_idx], np.asarray(k).ravel()[mc_idx], np.asarray(z0_snow).ravel()[mc_idx],
+            np.asarray(sin_factor).ravel()[mc_idx], **kwargs)
+    return tuple(x.reshape((x.shape[0], n_hd, nmembers)) for x in outputs)
+
+
+def debris_eb_lockstep_elev(Tair, eZ, u_AWS_raw, Sin, Lin_AWS, Rain_AWS, snow, P, density_air, ill_angle_rad,
+                            debris_thickness_all, albedo, z0, k, z0_snow, sin_factor, **kwargs):
+    """ Debris-covered glacier energy balance for all elevations, debris thicknesses and members in one pass
+
+    The elevations only differ in the forcing from forcing_precompute (air temperature, pressure, rain/snow
+    partitioning, vapor pressure and density of air), so each column uses the forcing of its elevation.
+
+    Parameters
+    ----------
+    Tair, eZ, Rain_AWS, snow, density_air : np.array
+        forcing of each elevation (dimensions = timestep, elevation)
+    P : np.array
+        pressure [Pa] of each elevation
+    u_AWS_raw, Sin, Lin_AWS, ill_angle_rad : np.array
+        forcing for each timestep, which is the same for all elevations
+    debris_thickness_all : np.array
+        debris thicknesses [m], all of which must be greater than zero
+    albedo, z0, k, z0_snow, sin_factor : np.array
+        properties of each member (see debris_eb_ensemble)
+    other keyword arguments are passed to debris_eb_ensemble; n_iter_hist can be 2-D with the histogram of each 
+    elevation and debris thickness (rows = elevation x debris thickness, debris thickness varying fastest)
+
+    Returns
+    -------
+    Melt_all, dsnow_all, Ts_all : np.array
+        melt [m ice], snow depth [m w.e.] and surface temperature [K] (dimensions = timestep, elevation, debris
+        thickness, member)
+    """
+    debris_thickness_all = np.asarray(debris_thickness_all, dtype=float)
+    assert (debris_thickness_all > 0).all(), 'Lockstep simulations are only for debris-covered ice'
+    nelev = np.asarray(Tair).shape[1]
+    nmembers = np.asarray(albedo).ravel().shape[0]
+    n_hd = debris_thickness_all.shape[0]
+    mc_idx = np.tile(np.arange(nmembers), n_hd * nelev)
+    if kwargs.get('n_iter_hist') is not None and kwargs['n_iter_hist'].ndim == 2:
+        kwargs['n_iter_hist_row'] = np.repeat(np.arange(nelev * n_hd), nmembers)
+
+    outputs = debris_eb_ensemble(
+            Tair, eZ, u_AWS_raw, Sin, Lin_AWS, Rain_AWS, snow, np.asarray(P), density_air, ill_angle_rad,
+            np.tile(np.repeat(debris_thickness_all, nmembers), nelev), np.asarray(albedo).ravel()[mc_idx],
+            np.asarray(z0).ravel()[mc_idx], np.asarray(k).ravel()[mc_idx], np.asarray(z0_snow).ravel()[mc_idx],
+            np.asarray(sin_factor).ravel()[mc_idx], forcing_col=np.repeat(np.arange(nelev), n_hd * nmembers),
+            **kwargs)
+    return tuple(x.reshape((x.shape[0], nelev, n_hd, nmembers)) for x in outputs)
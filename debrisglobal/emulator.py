@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Surrogate emulator of the daily melt and surface temperature simulated by meltmodel_global
+
+The emulator is a ridge regression trained on meltmodel_global output (see meltmodel_emulator.py):
+  - the inputs are summary statistics of the daily forcing at the pixel elevation (daily_features), including the
+    forcing of the previous days as a proxy for the snowpack and debris heat storage, and the elevation
+  - the features and their squares and products are multiplied by basis functions of debris thickness (hd_basis), so
+    the melt and surface temperature curves change smoothly with the forcing
+  - the normal equations are accumulated one grid cell at a time, so training does not need all the output in memory;
+    as each row of the design matrix is the outer product of the hd basis and the features, the normal equations are
+    Kronecker products of the (small) normal equations of the basis and of the features
+  - the training envelope is the range of each feature in the training data; in_envelope checks new forcing against
+    it, so meltmodel_global can fall back to the physical model outside the training data
+"""
+
+# External libraries
+import numpy as np
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+feature_cns = ['tair_mean', 'tair_max', 'tair_min', 'sin_mean', 'lin_mean', 'rh_mean', 'u_mean', 'snow_sum',
+               'rain_sum', 'tair_mean_7d', 'pdd_30d', 'snow_sum_30d', 'pdd_90d', 'snow_sum_90d', 'elev']
+# Scale of the debris thickness basis functions [m]
+hd_scales = [0.05, 0.25, 1]
+
+
+def rolling_sum(values, ndays):
+    """ Sum of the current and previous ndays-1 days (shorter at the start) """
+    values_cumsum = np.cumsum(values)
+    values_sum = values_cumsum.copy()
+    values_sum[ndays:] = values_cumsum[ndays:] - values_cumsum[:-ndays]
+    return values_sum
+
+
+def daily_features(Tair, RH, u, Sin, Lin, Rain, snow, elev):
+    """
+    Summary statistics of the daily forcing used as inputs of the emulator
+
+    Parameters
+    ----------
+    Tair, RH, u, Sin, Lin, Rain, snow : np.array
+        hourly air temperature [K], relative humidity [-], wind speed [m s-1], incoming shortwave and longwave
+        radiation [W m-2], rain [m] and snow fall [m w.e.] at the pixel elevation (number of timesteps must be a
+        multiple of 24)
+    elev : float
+        elevation [m a.s.l.]
+
+    Returns
+    -------
+    features : np.array
+        features (columns in the order of feature_cns) of each day (rows)
+    """
+    ndays = int(len(Tair) / 24)
+    Tair_daily = (Tair.reshape(ndays, 24) - 273.15)
+    tair_mean = Tair_daily.mean(axis=1)
+    pdd = np.maximum(tair_mean, 0)
+    snow_sum = snow.reshape(ndays, 24).sum(axis=1)
+    features = np.column_stack([tair_mean, Tair_daily.max(axis=1), Tair_daily.min(axis=1),
+                                Sin.reshape(ndays, 24).mean(axis=1), Lin.reshape(ndays, 24).mean(axis=1),
+                                RH.reshape(ndays, 24).mean(axis=1), u.reshape(ndays, 24).mean(axis=1), snow_sum,
+                                Rain.reshape(ndays, 24).sum(axis=1),
+                                rolling_sum(tair_mean, 7) / np.minimum(np.arange(1, ndays+1), 7),
+                                rolling_sum(pdd, 30), rolling_sum(snow_sum, 30), rolling_sum(pdd, 90),
+                                rolling_sum(snow_sum, 90), np.repeat(elev, ndays)])
+    return features
+
+
+def hd_basis(hd):
+    """ Basis functions of debris thickness [m]: constant, clean ice and 1 / (1 + hd / scale) """
+    hd = np.asarray(hd, dtype=float)
+    return np.column_stack([np.ones(hd.shape), (hd == 0).astype(float)] + [1 / (1 + hd / x) for x in hd_scales])
+
+
+class Emulator():
+    """ Ridge regression of the daily melt and surface temperature on the forcing features and debris thickness
+
+    Parameters
+    ----------
+    ridge : float
+        ridge penalty relative to the mean of the diagonal of the normal equations
+    """
+    def __init__(self, ridge=debris_prms.emulator_ridge):
+        self.ridge = ridge
+        self.feature_mean = None
+        self.feature_std = None
+        self.coeff_melt = None
+        self.coeff_ts = None
+        self.envelope_min = None
+        self.envelope_max = None
+        self.hd_max = 0
+        self.XtX_melt = None
+
+    def expand(self, features):
+        """ Standardized features with their squares and products """
+        z = (features - self.feature_mean) / self.feature_std
+        iu = np.triu_indices(z.shape[1])
+        return np.column_stack([np.ones(z.shape[0]), z, z[:,iu[0]] * z[:,iu[1]]])
+
+    def set_scaling(self, features):
+        """ Scaling of the features (from the features of all the training data, before accumulate) """
+        self.feature_mean = features.mean(axis=0)
+        self.feature_std = features.std(axis=0)
+        self.feature_std[self.feature_std == 0] = 1
+
+    def accumulate(self, features, hd, melt_daily, ts_daily):
+        """
+        Add a grid cell and elevation to the normal equations
+
+        Parameters
+        ----------
+        features : np.array
+            daily features (see daily_features)
+        hd : np.array
+            debris thicknesses [m]
+        melt_daily : np.array
+            daily melt [m w.e.] of each debris thickness (rows) and day (columns)
+        ts_daily : np.array
+            daily mean surface temperature [K] of each debris thickness (rows) and day (columns)
+        """
+        z = self.expand(features)
+        ZtZ = z.T @ z
+        basis = hd_basis(hd)
+        # surface temperature is only modeled for debris
+        basis_ts = basis[np.asarray(hd) > 0]
+        if self.XtX_melt is None:
+            nx = basis.shape[1] * z.shape[1]
+            self.XtX_melt = np.zeros((nx, nx))
+            self.Xty_melt = np.zeros(nx)
+            self.XtX_ts = np.zeros((nx, nx))
+            self.Xty_ts = np.zeros(nx)
+            self.envelope_min = features.min(axis=0)
+            self.envelope_max = features.max(axis=0)
+        self.XtX_melt += np.kron(basis.T @ basis, ZtZ)
+        self.Xty_melt += (basis.T @ np.asarray(melt_daily) @ z).ravel()
+        self.XtX_ts += np.kron(basis_ts.T @ basis_ts, ZtZ)
+        self.Xty_ts += (basis_ts.T @ np.asarray(ts_daily)[np.asarray(hd) > 0] @ z).ravel()
+        self.envelope_min = np.minimum(self.envelope_min, features.min(axis=0))
+        self.envelope_max = np.maximum(self.envelope_max, features.max(axis=0))
+        self.hd_max = np.max([self.hd_max, np.max(hd)])
+
+    def solve(self):
+        """ Solve the normal equations for the coefficients """
+        for vn in ['melt', 'ts']:
+            XtX = getattr(self, 'XtX_' + vn)
+            penalty = self.ridge * np.mean(np.diag(XtX)) * np.eye(XtX.shape[0])
+            setattr(self, 'coeff_' + vn, np.linalg.solve(XtX + penalty, getattr(self, 'Xty_' + vn)))
+
+    def predict(self, features, hd):
+        """ Daily melt [m w.e.] and mean surface temperature [K] of each debris thickness (rows) and day (columns) """
+        z = self.expand(features)
+        basis = hd_basis(hd)
+        melt_daily = np.maximum(basis @ self.coeff_melt.reshape(basis.shape[1], z.shape[1]) @ z.T, 0)
+        ts_daily = basis @ self.coeff_ts.reshape(basis.shape[1], z.shape[1]) @ z.T
+        ts_daily[np.asarray(hd) == 0,:] = 0
+        return melt_daily, ts_daily
+
+    def in_envelope(self, features, hd, margin=debris_prms.emulator_envelope_margin,
+                    max_frac=debris_prms.emulator_envelope_max_frac):
+        """ Whether the forcing and debris thicknesses are within the training data
+
+        Parameters
+        ----------
+        features : np.array
+            daily features (see daily_features)
+        hd : np.array
+            debris thicknesses [m]
+        margin : float
+            margin beyond the range of each feature, relative to the range
+        max_frac : float
+            maximum fraction of days with any feature outside the range (plus margin)
+        """
+        envelope_range = self.envelope_max - self.envelope_min
+        outside = ((features < self.envelope_min - margin * envelope_range) |
+                   (features > self.envelope_max + margin * envelope_range)).any(axis=1)
+        return outside.mean() <= max_frac and np.max(hd) <= self.hd_max
+
+    def save(self, emulator_fullfn):
+        """ Save the coefficients, scaling and envelope """
+        np.savez(emulator_fullfn, feature_cns=np.array(feature_cns), hd_scales=np.array(hd_scales),
+                 feature_mean=self.feature_mean, feature_std=self.feature_std, coeff_melt=self.coeff_melt,
+                 coeff_ts=self.coeff_ts, envelope_min=self.envelope_min, envelope_max=self.envelope_max,
+                 hd_max=self.hd_max, ridge=self.ridge)
+
+    @classmethod
+    def load(cls, emulator_fullfn):
+        """ Load an emulator saved with save """
+        with np.load(emulator_fullfn) as data:
+            assert list(data['feature_cns']) == feature_cns and list(data['hd_scales']) == hd_scales, (
+                    'emulator trained with different features, retrain with meltmodel_emulator.py')
+            emulator = cls(ridge=float(data['ridge']))
+            for vn in ['feature_mean', 'feature_std', 'coeff_melt', 'coeff_ts', 'envelope_min', 'envelope_max']:
+                setattr(emulator, vn, data[vn])
+            emulator.hd_max = float(data['hd_max'])
+        return emulator
@@ -4,11 +4,14 @@
 Model input for intercomparison experiment
 """
 # Built-in libraries
+import collections
 import os
 import pickle
 # External libraries
 import numpy as np
 import pandas as pd
+# Local libraries
+import debrisglobal.mc_sampling as mc_sampling
 
 #%% ===== FREQUENTLY CHANGED PARAMETERS (at top for convenience) =====
 # Main directory
@@ -53,6 +56,9 @@ if experiment_no == 4:
 else:
     mc_simulations = 1
     mc_stat_cns = ['mean']
+# Median and MAD of the Monte Carlo simulations: 'exact' keeps every simulation, while 'sketch' estimates them with
+#  memory that does not depend on the number of simulations (approximate, see mc_stats.py)
+mc_stat_quantiles = 'exact'
 
 #eb_fp = output_fp + 'exp' + str(experiment_no) + '/' + roi + '/'
 eb_fp = output_fp + 'exp' + str(experiment_no) + '/spc/' + roi + '/'
@@ -232,6 +238,9 @@ metdata_fp = main_directory + '/../climate_data/' + roi + '/'
 #metdata_fp = '/Volumes/LaCie/ERA5/hourly/' + roi + '/'
 metdata_elev_fn = 'ERA5_elev.nc'
 metdata_lr_fullfn = main_directory + '/../climate_data/ERA5_lapserates_monthly.nc'
+# Solar geometry (ephemeris) cache keyed by lat/lon and simulation period
+option_ephemeris_cache = 1
+ephemeris_fp = main_directory + '/../output/ephemeris/' + roi + '/'
 mb_binned_fp = main_directory + '/../output/mb_bins/csv/'
 mb_bin_size = 10
 output_fig_fp = main_directory + '/../output/figures/'
@@ -481,6 +490,54 @@ roi_datedict = {'01': ['1994-01-01', '2018-12-31'],
 start_date = roi_datedict[roi][0]  # start date for debris_ts_model.py
 end_date = roi_datedict[roi][1]     # end date for debris_ts_model.py
 fn_prefix = 'Rounce2015_' + roi + '-'
+# Option to write each debris thickness to the output file as it completes (1) or the whole file at the end (0)
+option_output_incremental = 1
+output_chunk_time = 24*365   # number of timesteps in each chunk of the output netcdf
+# Option to checkpoint each completed debris thickness and elevation, so a run that is interrupted resumes from them 
+#  and skips the grid cells that were completed (1) or not (0); see debrisglobal/checkpoint.py
+option_checkpoint = 0
+checkpoint_fp = output_fp + 'checkpoints/' + roi + '/'
+# Number of tasks per process issued by the scheduler (the debris thicknesses of a grid cell are split into blocks 
+#  when there are too few grid cells) and directory of the runtime of each task; see debrisglobal/scheduler.py
+scheduler_tasks_per_process = 4
+timings_fp = output_fp + 'timings/' + roi + '/'
+# Maximum number of columns (debris thicknesses x MC simulations x elevations) simulated together in one pass through
+#  the forcing with option_hd_lockstep or option_elev_lockstep (fewer elevations per pass once a pass only has one 
+#  debris thickness); each column holds the melt, snow depth and surface temperature of every timestep several 
+#  times (~8 MB per column for 20 years of hourly forcing)
+lockstep_max_cols = 500
+# Cost model of the runtime of each grid cell calibrated from the timings (see debrisglobal/cost_model.py), used by
+#  spc_split_lists.py to balance the batches and predict the wall time of each batch
+cost_model_fullfn = output_fp + 'timings/cost_model.json'
+cost_model_walltime_factor = 1.5    # safety factor of the predicted runtime for the wall time of the batches
+# Output precision and compression profile ('archive', 'fast' or 'analysis', see output_profiles in meltmodel_global)
+output_profile = 'archive'
+# Option to export the daily melt ("ostrem" file read by meltcurves.py) directly from the simulations (1) or not (0)
+option_output_daily = 1
+# Option to export the hourly output (1) or not (0); only needed for tscurves.py or to reprocess the daily melt
+option_output_hourly = 1
+# Option to simulate only the windows used by meltcurves.py and tscurves.py (1) or the full period (0)
+#  (see sim_windows_idx in meltmodel_global)
+option_sim_windows = 0
+sim_windows_spinup_days = 365   # spin-up [days] before each window
+sim_windows_ts_days = 30        # days before and after the surface temperature acquisition (see tscurves.py)
+# Option to simulate a subset of debris_thickness_all refined from the residuals of the melt and surface temperature 
+#  curves and interpolate the others (1) or to simulate all debris thicknesses (0); see debrisglobal/hd_adaptive.py
+option_hd_adaptive = 0
+hd_adaptive_anchors = [0.05, 0.1, 0.2, 0.5, 1, 2, 3]    # debris thicknesses [m] simulated first
+hd_adaptive_fit_min = 0.05      # thinner debris [m] is always simulated and is not used to refine the curves
+hd_adaptive_tol_melt = 0.01     # tolerance of the relative residual of the melt curve [-]
+hd_adaptive_tol_melt_clean = 0.001  # tolerance of the absolute residual of the melt curve relative to clean ice [-]
+hd_adaptive_tol_ts = 0.25       # tolerance of the residual of the mean daily maximum surface temperature [K]
+# Option to use the surrogate emulator (trained with meltmodel_emulator.py) for the daily melt and surface temperature 
+#  where the forcing is within the training envelope (1) or to always use the energy balance model (0)
+option_emulator = 0
+emulator_fp = output_fp + 'emulator/'
+emulator_fn = roi + '_emulator.npz'
+emulator_ridge = 1e-6               # ridge penalty (relative to the mean of the diagonal of the normal equations)
+emulator_envelope_margin = 0.05     # margin beyond the range of each feature in the training data (relative)
+emulator_envelope_max_frac = 0.01   # maximum fraction of days outside the training envelope
+emulator_holdout_frac = 0.2         # fraction of grid cells held out to validate the emulator
 elev_cns = ['zmean']
 #elev_cns = ['zmean', 'zstdlow', 'zstdhigh']
 
@@ -496,40 +553,64 @@ if experiment_no == 3:
     sin_factor_random = np.array([1.])            # multiplicative factor
 
 elif experiment_no == 4:
+    # Uniform distributions of the debris properties (lower and upper bounds)
+    debris_properties_bounds = collections.OrderedDict([
+            ('albedo', (0.1, 0.3)),             # albedo
+            ('k', (0.5, 1.5)),                  # thermal conductivity (W m-1 K-1)
+            ('z0', (0.008, 0.024)),             # surface roughness (m)
+            ('albedo_ice', (0.3, 0.5)),         # clean ice albedo
+            ('z0_ice', (0.0001, 0.004)),        # clean ice surface roughness (m)
+            ('Sin_factor', (0.8, 1.2))])        # Sin multiplicative factor to adjust Sin for topography, etc.
+    # Sampling design of the members: 'random', 'lhs' (Latin hypercube) or 'sobol' (see mc_sampling.py); 
+    #  mc_convergence.py estimates how many members each design needs
+    mc_design = 'random'
+    mc_antithetic = 0           # Switch to pair the members antithetically (1) or not (0)
+    mc_seed = None              # seed of the sampling (None to use the global random state), part of the filename
     debris_properties_fp = output_fp + 'debris_properties/'
     debris_properties_fn = 'debris_properties_global.csv'
+    if mc_design != 'random' or mc_antithetic == 1 or mc_seed is not None:
+        if mc_seed is None:
+            mc_seed_str = ''
+        else:
+            mc_seed_str = '_seed' + str(mc_seed)
+        debris_properties_fn = debris_properties_fn.replace(
+                '.csv', '_' + mc_design + '_antithetic' * mc_antithetic + mc_seed_str + '_' + str(mc_simulations) + 
+                '.csv')
+    debris_properties_df = None
     if os.path.exists(debris_properties_fp + debris_properties_fn):
         debris_properties_df = pd.read_csv(debris_properties_fp + debris_properties_fn)
-        albedo_random = debris_properties_df['albedo'].values
-        z0_random = debris_properties_df['z0'].values
-        k_random = debris_properties_df['k'].values
-        albedo_random_ice = debris_properties_df['albedo_ice'].values
-        z0_random_ice = debris_properties_df['z0_ice'].values
-        z0_random_snow = z0_random_ice
-        sin_factor_random = debris_properties_df['Sin_factor'].values
-    else:
-        # Albedo (uniform distribution 0.1 - 0.3)
-        albedo_random = np.random.uniform(low=0.1, high=0.3, size=mc_simulations)
-        # Surface roughness (m)
-        z0_random = np.random.uniform(low=0.008, high=0.024, size=mc_simulations)
-        # Thermal conductivity (uniform distribution 0.5 - 1.5 W m-1 K-1)
-        k_random = np.random.uniform(low=0.5, high=1.5, size=mc_simulations)
-        # Clean ice albedo (uniform distribution 0.3 - 0.5)
-        albedo_random_ice = np.random.uniform(low=0.3, high=0.5, size=mc_simulations)
-        # Clean ice surface roughness (m)
-        z0_random_ice = np.random.uniform(low=0.0001, high=0.004, size=mc_simulations)
-        z0_random_snow = z0_random_ice
-        # Sin multiplicative factor to adjust Sin for topography, etc. (uniform distribution 0.8 - 1.2)
-        sin_factor_random = np.random.uniform(low=0.8, high=1.2, size=mc_simulations)
-
-        debris_properties_values = np.column_stack((albedo_random, k_random, z0_random,
-                                                    albedo_random_ice, z0_random_ice, sin_factor_random))
+        # Properties are only used if they were sampled from the same bounds (recorded with the properties; files 
+        #  without them, e.g., from earlier runs, are checked against the bounds)
+        for cn, bounds in debris_properties_bounds.items():
+            if cn + '_lower' in debris_properties_df.columns:
+                bounds_same = np.allclose([debris_properties_df[cn + '_lower'].values[0], 
+                                           debris_properties_df[cn + '_upper'].values[0]], bounds)
+            else:
+                bounds_same = ((debris_properties_df[cn].values >= bounds[0]).all() and 
+                               (debris_properties_df[cn].values <= bounds[1]).all())
+            if not bounds_same:
+                print('Debris properties sampled from other bounds, sampling them again:', 
+                      debris_properties_fp + debris_properties_fn)
+                debris_properties_df = None
+                break
+    if debris_properties_df is None:
+        debris_properties_df = mc_sampling.sample_debris_properties(
+                mc_simulations, debris_properties_bounds, design=mc_design, antithetic=(mc_antithetic == 1),
+                seed=mc_seed)
+        for cn, bounds in debris_properties_bounds.items():
+            debris_properties_df[cn + '_lower'] = bounds[0]
+            debris_properties_df[cn + '_upper'] = bounds[1]
         # Export properties
-        debris_properties_cns = ['albedo', 'k', 'z0', 'albedo_ice', 'z0_ice', 'Sin_factor']
-        debris_properties_df = pd.DataFrame(debris_properties_values, columns=debris_properties_cns)
         if not os.path.exists(debris_properties_fp):
             os.makedirs(debris_properties_fp)
         debris_properties_df.to_csv(debris_properties_fp + debris_properties_fn, index=False)
+    albedo_random = debris_properties_df['albedo'].values
+    z0_random = debris_properties_df['z0'].values
+    k_random = debris_properties_df['k'].values
+    albedo_random_ice = debris_properties_df['albedo_ice'].values
+    z0_random_ice = debris_properties_df['z0_ice'].values
+    z0_random_snow = z0_random_ice
+    sin_factor_random = debris_properties_df['Sin_factor'].values
 
 # Extra
 #debris_albedo = 0.2     # -, debris albedo
@@ -588,6 +669,19 @@ k_snow = 0.10               # Rahimi and Konrad (2012), Sturm etal (2002), Sturm
 
 # Newton-Raphson Method constants
 n_iter_max = 100
+# Option to choose the number of debris layers and the conduction time step from the diffusion number of each debris 
+#  thickness (1) or to use 10 layers and the timestep of the forcing for every debris thickness (0); see 
+#  debrisglobal/debris_layers.py and layers_accuracy.py for the accuracy relative to the reference configuration.
+#  With the values below, the melt is within 0.2% and the root mean square error of the hourly surface temperature is
+#  below 0.6 K for debris thicknesses of 0.02-2 m (only debris thinner than 0.1 m uses fewer layers, and only debris 
+#  thicker than 2 m is decoupled), but individual hours of thin debris still differ by up to ~11 K (120 days of a 
+#  synthetic grid cell, 8 members). Larger layers_C_coarse (e.g., 0.1) decouples 1-2 m of debris, with errors of up to
+#  13% in the melt and 10-36 K in individual hours.
+option_layers_adaptive = 0
+layers_C_fine = 20      # diffusion number above which fewer layers are used (thin debris)
+layers_N_min = 5        # minimum number of layers (including the surface and the debris/ice interface)
+layers_C_coarse = 0.01  # diffusion number of the conduction step below which the surface is decoupled (thick debris)
+layers_nsub_max = 24    # maximum number of timesteps in a conduction step
 
 #%% FUNCTIONS
 def selectglaciersrgitable(glac_no=None,
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive sampling of the debris thicknesses simulated by meltmodel_global
+
+The melt and surface temperature curves are smooth functions of debris thickness, so only a subset of
+debris_thickness_all needs to be simulated:
+  - the anchors (nearest debris thicknesses to hd_adaptive_anchors), clean ice and all debris thinner than
+    hd_adaptive_fit_min (the increase in melt below a few cm is not represented by the melt curve) are simulated first
+  - each simulated debris thickness is compared to the curve through its neighboring simulated debris thicknesses:
+    the melt curve (melt_fromdebris_func in meltcurves.py, i.e., 1/melt is linear in debris thickness) for the melt
+    summed over the mass balance period and a linear curve for the mean daily maximum surface temperature. Wherever
+    the residual of the melt exceeds both hd_adaptive_tol_melt (relative) and hd_adaptive_tol_melt_clean times the
+    melt of clean ice (absolute, so the small melt under thick debris is not refined to the last cm, while the floor
+    scales with the melt of the grid cell and period) or the residual of the surface temperature exceeds
+    hd_adaptive_tol_ts, the debris thicknesses in the middle of the neighboring intervals are added
+  - this repeats until the residuals are below the tolerances or there are no debris thicknesses left to add
+The debris thicknesses that are not simulated are interpolated linearly between the neighboring simulated thicknesses
+and the melt statistics are scaled by the ratio of the melt curve to the linear interpolation.
+The residuals are computed from the neighboring debris thicknesses rather than from the melt curve and Hill equation
+fit to all debris thicknesses, as the fits to all debris thicknesses can deviate by more than the tolerance even when
+the curves are well resolved.
+"""
+
+# External libraries
+import numpy as np
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+def melt_fromdebris_func(h, a, k):
+    """ Second order reaction rate equation used to estimate melt from debris thickness (see meltcurves.py) """
+    return 1 / (1 / a + k * h)
+
+
+def melt_curve_interp(hd, hd_low, hd_high, melt_low, melt_high):
+    """ Melt from the melt curve through two debris thicknesses (linear interpolation if either melt is zero) """
+    w = (hd - hd_low) / (hd_high - hd_low)
+    if melt_low <= 0 or melt_high <= 0:
+        return (1-w) * melt_low + w * melt_high
+    k = (1 / melt_high - 1 / melt_low) / (hd_high - hd_low)
+    a = 1 / (1 / melt_low - k * hd_low)
+    return melt_fromdebris_func(hd, a, k)
+
+
+class AdaptiveThicknesses():
+    """ Debris thicknesses to simulate, iterated in batches that are refined from the residuals of the curves
+
+    Parameters
+    ----------
+    debris_thickness_all : np.array
+        debris thicknesses [m] of the output
+    time_pd : pd.DatetimeIndex
+        hourly timesteps of the simulations
+    mb_yrfrac : list
+        start and end of the mass balance period [year fraction] used to sum the melt
+    anchors : list
+        debris thicknesses [m] simulated first
+    fit_min : float
+        debris thicknesses [m] below this are always simulated and are not used to refine the curves
+    tol_melt : float
+        tolerance of the relative residual of the melt [-]
+    tol_melt_clean : float
+        tolerance of the absolute residual of the melt relative to the melt of clean ice [-] (the largest melt of
+        the simulated debris thicknesses if clean ice is not simulated)
+    tol_ts : float
+        tolerance of the residual of the mean daily maximum surface temperature [K]
+    """
+    def __init__(self, debris_thickness_all, time_pd, mb_yrfrac=debris_prms.mb_yrfrac_dict[debris_prms.roi],
+                 anchors=debris_prms.hd_adaptive_anchors, fit_min=debris_prms.hd_adaptive_fit_min,
+                 tol_melt=debris_prms.hd_adaptive_tol_melt, tol_melt_clean=debris_prms.hd_adaptive_tol_melt_clean,
+                 tol_ts=debris_prms.hd_adaptive_tol_ts):
+        self.hd = np.asarray(debris_thickness_all, dtype=float)
+        self.fit_min = fit_min
+        self.tol_melt = tol_melt
+        self.tol_melt_clean = tol_melt_clean
+        self.tol_ts = tol_ts
+        self.slabs = {}
+        self.melt_mb = {}
+        self.ts_max = {}
+        self.n_batches = 0
+
+        # Timesteps of the mass balance period (nearest day, consistent with the "ostrem" curves)
+        time_daily = time_pd[0::24]
+        time_daysperyear = np.array([366 if x%4 == 0 else 365 for x in time_daily.year])
+        time_yearfrac = time_daily.year + (time_daily.dayofyear-1) / time_daysperyear
+        start_idx = np.abs(time_yearfrac - mb_yrfrac[0]).argmin()
+        end_idx = np.abs(time_yearfrac - mb_yrfrac[1]).argmin()
+        if end_idx <= start_idx:
+            start_idx, end_idx = 0, len(time_daily)
+        self.mb_slice = slice(start_idx*24, end_idx*24)
+        self.mb_ndays = end_idx - start_idx
+
+        # Initial debris thicknesses
+        pending = list(np.where(self.hd < fit_min)[0])
+        for anchor in anchors:
+            pending.append(np.abs(self.hd - anchor).argmin())
+        self.pending = sorted(set(pending))
+        self.batch = []
+
+    def __iter__(self):
+        """ Indices of the debris thicknesses to simulate (the next batch is chosen once a batch is recorded) """
+        while len(self.pending) > 0:
+            self.batch = self.pending
+            self.pending = []
+            self.n_batches += 1
+            for n_thickness in self.batch:
+                yield n_thickness
+            self.pending = self.refine()
+
+    def record(self, n_thickness, output_slab):
+        """ Record the output of a simulated debris thickness """
+        self.slabs[n_thickness] = output_slab
+        self.melt_mb[n_thickness] = output_slab['melt'][self.mb_slice].sum()
+        self.ts_max[n_thickness] = output_slab['ts'][self.mb_slice].reshape(-1,24).max(axis=1).mean()
+
+    def simulated(self):
+        """ Indices of the simulated debris thicknesses """
+        return sorted(self.slabs.keys())
+
+    def residuals(self):
+        """ Residuals of each simulated debris thickness (>= fit_min) from the curves through its neighbors
+
+        Returns
+        -------
+        fit_idx : list
+            indices of the simulated debris thicknesses used to refine the curves, sorted by debris thickness
+        melt_residual, melt_residual_abs, ts_residual : np.array
+            relative and absolute [m w.e.] residual of the melt and residual of the surface temperature [K]
+            (zero for the first and last)
+        """
+        fit_idx = [x for x in self.simulated() if self.hd[x] >= self.fit_min]
+        fit_idx = [fit_idx[x] for x in np.argsort(self.hd[fit_idx], kind='stable')]
+        melt_residual = np.zeros(len(fit_idx))
+        melt_residual_abs = np.zeros(len(fit_idx))
+        ts_residual = np.zeros(len(fit_idx))
+        for n in range(1, len(fit_idx) - 1):
+            n_low, n_mid, n_high = fit_idx[n-1], fit_idx[n], fit_idx[n+1]
+            if self.hd[n_high] == self.hd[n_low]:
+                continue
+            melt_curve = melt_curve_interp(self.hd[n_mid], self.hd[n_low], self.hd[n_high], self.melt_mb[n_low],
+                                           self.melt_mb[n_high])
+            if self.melt_mb[n_mid] > 0:
+                melt_residual[n] = np.abs(melt_curve / self.melt_mb[n_mid] - 1)
+            melt_residual_abs[n] = np.abs(melt_curve - self.melt_mb[n_mid])
+            w = (self.hd[n_mid] - self.hd[n_low]) / (self.hd[n_high] - self.hd[n_low])
+            ts_residual[n] = np.abs((1-w) * self.ts_max[n_low] + w * self.ts_max[n_high] - self.ts_max[n_mid])
+        return fit_idx, melt_residual, melt_residual_abs, ts_residual
+
+    def refine(self):
+        """ Debris thicknesses to add where the residuals exceed the tolerances """
+        fit_idx, melt_residual, melt_residual_abs, ts_residual = self.residuals()
+        not_simulated = [x for x in range(self.hd.shape[0]) if x not in self.slabs]
+        refine_idx = []
+        clean_idx = [x for x in self.slabs if self.hd[x] == 0]
+        if len(clean_idx) > 0:
+            melt_clean = self.melt_mb[clean_idx[0]]
+        else:
+            melt_clean = max(self.melt_mb.values())
+        melt_exceeds = (melt_residual > self.tol_melt) & (melt_residual_abs > self.tol_melt_clean * melt_clean)
+        for n, exceeds in enumerate(melt_exceeds | (ts_residual > self.tol_ts)):
+            if not exceeds:
+                continue
+            # middle of the intervals with the neighboring simulated debris thicknesses
+            for n_neighbor in [n-1, n+1]:
+                hd_low, hd_high = np.sort([self.hd[fit_idx[n]], self.hd[fit_idx[n_neighbor]]])
+                interval_idx = [x for x in not_simulated if self.hd[x] > hd_low and self.hd[x] < hd_high]
+                if len(interval_idx) > 0:
+                    refine_idx.append(interval_idx[np.abs(self.hd[interval_idx] - (hd_low + hd_high) / 2).argmin()])
+        return sorted(set(refine_idx))
+
+    def output_slab(self, n_thickness):
+        """ Output of a debris thickness, interpolated from the simulated debris thicknesses if not simulated """
+        if n_thickness in self.slabs:
+            return self.slabs[n_thickness]
+        hd = self.hd[n_thickness]
+        simulated_idx = self.simulated()
+        # Neighboring simulated debris thicknesses
+        low_idx = [x for x in simulated_idx if self.hd[x] <= hd]
+        high_idx = [x for x in simulated_idx if self.hd[x] >= hd]
+        if len(low_idx) == 0:
+            low_idx = high_idx
+        elif len(high_idx) == 0:
+            high_idx = low_idx
+        n_low = low_idx[np.argmax(self.hd[low_idx])]
+        n_high = high_idx[np.argmin(self.hd[high_idx])]
+        hd_low, hd_high = self.hd[n_low], self.hd[n_high]
+        if hd_high > hd_low:
+            w = (hd - hd_low) / (hd_high - hd_low)
+        else:
+            w = 0
+
+        # Ratio of the melt curve to the linear interpolation of the melt over the mass balance period
+        melt_factor = 1
+        melt_linear = (1-w) * self.melt_mb[n_low] + w * self.melt_mb[n_high]
+        if hd_high > hd_low and melt_linear > 0:
+            melt_factor = (melt_curve_interp(hd, hd_low, hd_high, self.melt_mb[n_low], self.melt_mb[n_high]) /
+                           melt_linear)
+
+        output_slab = {}
+        for vn in self.slabs[n_low].keys():
+            output_slab[vn] = (1-w) * self.slabs[n_low][vn] + w * self.slabs[n_high][vn]
+            if vn.startswith('melt'):
+                output_slab[vn] = output_slab[vn] * melt_factor
+        return output_slab
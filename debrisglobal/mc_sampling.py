@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sampling designs of the debris properties of the Monte Carlo simulations
+
+The debris properties are uniform between the bounds of debris_properties_bounds (globaldebris_input.py). Besides
+independent random draws ('random'), the members can be spread more evenly over the parameter space:
+  - 'lhs': Latin hypercube, each parameter has exactly one member in each of mc_simulations equal intervals
+  - 'sobol': Sobol low-discrepancy sequence (Joe and Kuo, 2008 direction numbers) with a random digital shift, which
+    is best balanced when the number of members is a power of 2
+Any design can be paired antithetically (each member u is paired with 1 - u), so the errors of the two members of a
+pair partially cancel wherever melt is close to monotonic in the parameters.
+The number of members needed by each design is estimated with mc_convergence.py.
+"""
+
+# External libraries
+import numpy as np
+import pandas as pd
+
+
+mc_designs = ['random', 'lhs', 'sobol']
+# Sobol direction numbers of dimensions 2 and above (degree s, coefficients a and initial m; Joe and Kuo, 2008)
+sobol_direction_prms = [(1, 0, [1]),
+                        (2, 1, [1, 3]),
+                        (3, 1, [1, 3, 1]),
+                        (3, 2, [1, 1, 1]),
+                        (4, 1, [1, 1, 3, 3]),
+                        (4, 4, [1, 3, 5, 13]),
+                        (5, 2, [1, 1, 5, 5, 17]),
+                        (5, 4, [1, 1, 5, 5, 5])]
+sobol_nbits = 30
+
+
+def sobol_direction_numbers(ndim):
+    """ Direction numbers (dimensions, bits) of the Sobol sequence """
+    assert ndim <= len(sobol_direction_prms) + 1, 'Sobol direction numbers only for ' + str(ndim) + ' dimensions'
+    V = np.zeros((ndim, sobol_nbits), dtype=np.int64)
+    V[0] = 1 << np.arange(sobol_nbits-1, -1, -1)
+    for d in range(1, ndim):
+        s, a, m = sobol_direction_prms[d-1]
+        for k in range(sobol_nbits):
+            if k < s:
+                V[d,k] = m[k] << (sobol_nbits - 1 - k)
+            else:
+                V[d,k] = V[d,k-s] ^ (V[d,k-s] >> s)
+                for l in range(1, s):
+                    if (a >> (s - 1 - l)) & 1:
+                        V[d,k] ^= V[d,k-l]
+    return V
+
+
+def sobol(n, ndim, rng):
+    """ First n points of the Sobol sequence (Gray code order) with a random digital shift """
+    V = sobol_direction_numbers(ndim)
+    gray = np.arange(n, dtype=np.int64)
+    gray = gray ^ (gray >> 1)
+    points = np.zeros((n, ndim), dtype=np.int64)
+    for k in range(sobol_nbits):
+        bit_set = ((gray >> k) & 1).astype(bool)
+        points[bit_set] ^= V[:,k]
+    points ^= rng.randint(0, 2**sobol_nbits, size=ndim)
+    return points / 2**sobol_nbits
+
+
+def latin_hypercube(n, ndim, rng):
+    """ Latin hypercube: one point in each of n equal intervals of every dimension """
+    points = np.zeros((n, ndim))
+    for d in range(ndim):
+        points[:,d] = (rng.permutation(n) + rng.uniform(size=n)) / n
+    return points
+
+
+def unit_sample(n, ndim, design='random', antithetic=False, rng=np.random):
+    """
+    Sample of the unit hypercube
+
+    Parameters
+    ----------
+    n : int
+        number of points (even if antithetic)
+    ndim : int
+        number of dimensions
+    design : str
+        'random', 'lhs' or 'sobol'
+    antithetic : bool
+        pair the first half of the points (from the design) with their complements (1 - u)
+    rng : np.random.RandomState
+        random number generator (default is the global one, as used by np.random.uniform)
+
+    Returns
+    -------
+    points : np.array
+        points (rows) in [0, 1) of each dimension (columns)
+    """
+    assert design in mc_designs, 'mc_design must be one of ' + str(mc_designs)
+    if antithetic:
+        assert n % 2 == 0, 'antithetic sampling requires an even number of members'
+        points = unit_sample(int(n/2), ndim, design=design, rng=rng)
+        return np.concatenate((points, 1 - points), axis=0)
+    if design == 'lhs':
+        return latin_hypercube(n, ndim, rng)
+    elif design == 'sobol':
+        return sobol(n, ndim, rng)
+    return rng.uniform(size=(ndim, n)).T
+
+
+def sample_debris_properties(n, bounds, design='random', antithetic=False, seed=None):
+    """
+    Debris properties of the Monte Carlo members
+
+    Parameters
+    ----------
+    n : int
+        number of members
+    bounds : dict
+        lower and upper bound of the uniform distribution of each debris property
+    design : str
+        'random', 'lhs' or 'sobol'
+    antithetic : bool
+        pair the members antithetically
+    seed : int
+        seed of the random number generator (None uses the global one)
+
+    Returns
+    -------
+    debris_properties_df : pd.DataFrame
+        debris properties (columns) of each member (rows)
+    """
+    if seed is None:
+        rng = np.random
+    else:
+        rng = np.random.RandomState(seed)
+    points = unit_sample(n, len(bounds), design=design, antithetic=antithetic, rng=rng)
+    low = np.array([x[0] for x in bounds.values()])
+    high = np.array([x[1] for x in bounds.values()])
+    return pd.DataFrame(low + points * (high - low), columns=list(bounds.keys()))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming statistics of the Monte Carlo simulations
+
+The statistics of every timestep are updated as each Monte Carlo simulation finishes, so the simulations do not need
+to be stored as (nsteps x mc_simulations) arrays:
+  - mean and standard deviation use Welford's online algorithm
+  - median and median absolute deviation (MAD) either keep every simulation in a buffer (exact), or are estimated
+    with the P-square algorithm (Jain and Chlamtac, 1985), which only keeps 5 markers per timestep. The MAD sketch
+    uses the absolute deviation from the running estimate of the median, so it is an approximation.
+Only the statistics in stat_cns are computed, so without the median and MAD the memory does not depend on the number
+of Monte Carlo simulations.
+"""
+
+# External libraries
+import numpy as np
+from scipy.stats import median_absolute_deviation
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+# Scale factor of the median absolute deviation (consistent with scipy.stats.median_absolute_deviation)
+mad_scale = 1.4826
+
+
+class P2Median():
+    """ P-square estimate of the median of each timestep with 5 markers per timestep """
+    def __init__(self, nsteps):
+        self.q = np.zeros((5, nsteps))
+        self.n = np.tile(np.arange(1, 6, dtype=float)[:,np.newaxis], (1, nsteps))
+        self.n_desired = np.array([1, 2, 3, 4, 5], dtype=float)
+        self.dn = np.array([0, 0.25, 0.5, 0.75, 1])
+        self.count = 0
+
+    def update(self, x):
+        """ Add one simulation (x has one value per timestep) """
+        if self.count < 5:
+            self.q[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                self.q.sort(axis=0)
+            return
+        self.count += 1
+        q = self.q
+        n = self.n
+        # Cell of each new value (extreme markers are replaced by new extremes)
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        k = (x[np.newaxis,:] >= q[1:4]).sum(axis=0)
+        # Marker positions above the cell increase by one
+        n += (np.arange(5)[:,np.newaxis] > k[np.newaxis,:])
+        self.n_desired += self.dn
+        # Adjust the middle markers
+        for i in [1, 2, 3]:
+            d = self.n_desired[i] - n[i]
+            adjust = (((d >= 1) & (n[i+1] - n[i] > 1)) | ((d <= -1) & (n[i-1] - n[i] < -1)))
+            if not adjust.any():
+                continue
+            d = np.sign(d[adjust])
+            q_i, q_low, q_high = q[i,adjust], q[i-1,adjust], q[i+1,adjust]
+            n_i, n_low, n_high = n[i,adjust], n[i-1,adjust], n[i+1,adjust]
+            # Parabolic prediction
+            q_par = q_i + d / (n_high - n_low) * ((n_i - n_low + d) * (q_high - q_i) / (n_high - n_i) +
+                                                  (n_high - n_i - d) * (q_i - q_low) / (n_i - n_low))
+            # Linear prediction if parabolic prediction is not between the neighboring markers
+            q_lin = np.where(d > 0, q_i + (q_high - q_i) / (n_high - n_i), q_i - (q_low - q_i) / (n_low - n_i))
+            q[i,adjust] = np.where((q_low < q_par) & (q_par < q_high), q_par, q_lin)
+            n[i,adjust] = n_i + d
+
+    def median(self):
+        """ Median estimate (exact for 5 or fewer simulations) """
+        if self.count < 5:
+            return np.median(self.q[:self.count], axis=0)
+        return self.q[2].copy()
+
+
+class MCStats():
+    """ Statistics of the Monte Carlo simulations for each timestep, updated one simulation at a time
+
+    Parameters
+    ----------
+    nsteps : int
+        number of timesteps
+    stat_cns : list
+        statistics to compute ('mean', 'std', 'med', 'mad')
+    quantiles : str
+        'exact' keeps every simulation to compute the median and MAD, 'sketch' estimates them with bounded memory
+    mc_simulations : int
+        number of simulations (size of the buffer for exact quantiles)
+    """
+    def __init__(self, nsteps, stat_cns=debris_prms.mc_stat_cns, quantiles=debris_prms.mc_stat_quantiles,
+                 mc_simulations=debris_prms.mc_simulations):
+        self.stat_cns = stat_cns
+        self.quantiles = quantiles
+        self.count = 0
+        # Welford's algorithm
+        self._mean = np.zeros(nsteps)
+        self._m2 = np.zeros(nsteps)
+        # Median and MAD
+        self.buffer = None
+        self.med_sketch = None
+        self.mad_sketch = None
+        if 'med' in stat_cns or 'mad' in stat_cns:
+            if quantiles == 'exact':
+                self.buffer = np.zeros((nsteps, mc_simulations))
+            else:
+                self.med_sketch = P2Median(nsteps)
+                if 'mad' in stat_cns:
+                    self.mad_sketch = P2Median(nsteps)
+
+    def update(self, x):
+        """ Add simulations (one value per timestep, or one column per simulation) """
+        if x.ndim == 2:
+            for ncol in range(x.shape[1]):
+                self.update(x[:,ncol])
+            return
+        if self.buffer is not None:
+            if self.count == self.buffer.shape[1]:
+                self.buffer = np.concatenate((self.buffer, np.zeros(self.buffer.shape)), axis=1)
+            self.buffer[:,self.count] = x
+        if self.med_sketch is not None:
+            self.med_sketch.update(x)
+        if self.mad_sketch is not None:
+            self.mad_sketch.update(np.abs(x - self.med_sketch.median()))
+        self.count += 1
+        delta = x - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (x - self._mean)
+
+    def mean(self):
+        return self._mean.copy()
+
+    def std(self):
+        """ Standard deviation (population, consistent with np.std) """
+        return np.sqrt(self._m2 / self.count)
+
+    def med(self):
+        if self.buffer is not None:
+            return np.median(self.buffer[:,:self.count], axis=1)
+        return self.med_sketch.median()
+
+    def mad(self):
+        """ Median absolute deviation (scaled to be consistent with the standard deviation of a normal distribution) """
+        if self.buffer is not None:
+            return median_absolute_deviation(self.buffer[:,:self.count], axis=1)
+        return mad_scale * self.mad_sketch.median()
+
+    def stat(self, stat_cn):
+        """ Statistic by name ('mean', 'std', 'med' or 'mad') """
+        return getattr(self, stat_cn)()
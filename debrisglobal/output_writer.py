@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental writer of the meltmodel_global output
+
+The coordinates and attributes of the dataset from create_xrdataset are written when the file is opened, and the
+simulation variables are created as chunked netcdf4 variables with the encoding of the output profile (by default,
+one chunk covers one debris thickness, elevation and output_chunk_time timesteps). Each debris thickness is then
+written as soon as it completes, so the simulations do not need to be kept in memory until the end and a crash leaves
+the thicknesses that were completed. The file is written with a .part suffix that is removed once it is closed.
+
+The files of the blocks of debris thicknesses of a grid cell (experiment 4) are merged by merge_parts, which copies
+each debris thickness of each file into its index of the merged file, so the merge is one pass through the data.
+"""
+
+# Built-in libaries
+import os
+# External libraries
+import netCDF4
+import numpy as np
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.ts_solver as ts_solver
+
+
+class IncrementalWriter():
+    """ Write the output dataset one debris thickness at a time
+
+    Parameters
+    ----------
+    output_fullfn : str
+        filename of the output netcdf
+    output_ds_all : xarray Dataset
+        dataset from create_xrdataset, only used for the coordinates, variable names and attributes
+    encoding : dictionary
+        encoding from create_xrdataset
+    chunk_time : int
+        number of timesteps in each chunk
+    """
+    def __init__(self, output_fullfn, output_ds_all, encoding, chunk_time=debris_prms.output_chunk_time):
+        self.output_fullfn = output_fullfn
+        self.part_fullfn = output_fullfn + '.part'
+        sim_dims = ('hd_cm', 'time', 'elev')
+        self.vns = [vn for vn in output_ds_all.data_vars if output_ds_all[vn].dims == sim_dims]
+
+        # Coordinates, scalar variables and attributes
+        ds_coords = output_ds_all.drop_vars(self.vns)
+        ds_coords.to_netcdf(self.part_fullfn, encoding={vn: encoding[vn] for vn in encoding if vn in ds_coords.variables})
+
+        # Chunked variables that are filled in as the simulations complete
+        self.nc = netCDF4.Dataset(self.part_fullfn, 'a')
+        #  (dtype, packing and compression from the output profile in the encoding)
+        for vn in self.vns:
+            vn_encoding = encoding[vn]
+            chunksizes = vn_encoding.get('chunksizes', (1, min(chunk_time, output_ds_all['time'].shape[0]), 1))
+            var = self.nc.createVariable(vn, vn_encoding.get('dtype', output_ds_all[vn].dtype), sim_dims,
+                                         zlib=vn_encoding['zlib'], complevel=vn_encoding['complevel'],
+                                         shuffle=vn_encoding.get('shuffle', True), chunksizes=chunksizes,
+                                         fill_value=False)
+            var.setncatts(output_ds_all[vn].attrs)
+            # packed variables are scaled by netCDF4 when written
+            for attr_name in ['scale_factor', 'add_offset']:
+                if attr_name in vn_encoding.keys():
+                    var.setncattr(attr_name, vn_encoding[attr_name])
+        self.nc.setncattr('n_slabs_completed', 0)
+        self.n_slabs = 0
+
+    def write(self, vn, n_thickness, nelev, values):
+        """ Write the time series of one variable for a debris thickness and elevation """
+        self.nc[vn][n_thickness,:,nelev] = values
+
+    def slab_completed(self):
+        """ Flush the file after all variables of a debris thickness and elevation have been written """
+        self.n_slabs += 1
+        self.nc.setncattr('n_slabs_completed', self.n_slabs)
+        self.nc.sync()
+
+    def close(self, attrs={}):
+        """ Add attributes, close the file and remove the .part suffix """
+        for attr_name, attr_value in attrs.items():
+            self.nc.setncattr(attr_name, attr_value)
+        self.nc.close()
+        os.replace(self.part_fullfn, self.output_fullfn)
+
+
+def merge_parts(part_fullfns, output_fullfn, dim='hd_cm'):
+    """
+    Merge the files of the blocks of debris thicknesses of a grid cell along the debris thickness
+
+    The merged file is created with the dimensions, variables, encoding and attributes of the first file, with the
+    debris thicknesses of all files in increasing order. Each debris thickness of each file is then copied into its
+    index (the values are copied as stored, without unpacking), so only one debris thickness of one variable is held
+    in memory. The solver telemetry and the number of completed slabs are combined over the files. The file is written
+    with a .part suffix that is removed once it is complete.
+
+    Parameters
+    ----------
+    part_fullfns : list
+        filenames of the netcdf files of the blocks of debris thicknesses
+    output_fullfn : str
+        filename of the merged netcdf
+    dim : str
+        dimension along which the files are merged (coordinate variable of the same name)
+    """
+    ncs = [netCDF4.Dataset(x, 'r') for x in part_fullfns]
+    for nc in ncs:
+        nc.set_auto_maskandscale(False)
+    # Index of each debris thickness of each file in the merged file
+    part_values = [nc[dim][:] for nc in ncs]
+    merged_order = np.argsort(np.concatenate(part_values), kind='stable')
+    merged_idx = np.empty(merged_order.shape[0], dtype=int)
+    merged_idx[merged_order] = np.arange(merged_order.shape[0])
+    part_idx = np.split(merged_idx, np.cumsum([x.shape[0] for x in part_values])[:-1])
+
+    part_fullfn = output_fullfn + '.part'
+    nc0 = ncs[0]
+    nc_out = netCDF4.Dataset(part_fullfn, 'w', format=nc0.data_model)
+    for dim_name, dim_nc in nc0.dimensions.items():
+        if dim_name == dim:
+            dim_size = merged_order.shape[0]
+        elif dim_nc.isunlimited():
+            dim_size = None
+        else:
+            dim_size = len(dim_nc)
+        nc_out.createDimension(dim_name, dim_size)
+    for vn, var in nc0.variables.items():
+        filters = var.filters()
+        chunking = var.chunking()
+        attrs = {x: var.getncattr(x) for x in var.ncattrs()}
+        fill_value = attrs.pop('_FillValue', False)
+        var_out = nc_out.createVariable(vn, var.dtype, var.dimensions, zlib=filters['zlib'],
+                                        complevel=filters['complevel'], shuffle=filters['shuffle'],
+                                        fletcher32=filters['fletcher32'], contiguous=(chunking == 'contiguous'),
+                                        chunksizes=(None if chunking == 'contiguous' else chunking),
+                                        fill_value=fill_value)
+        var_out.setncatts(attrs)
+        var_out.set_auto_maskandscale(False)
+        if dim not in var.dimensions:
+            var_out[...] = var[...]
+    # Debris thicknesses copied one at a time
+    for vn, var_out in nc_out.variables.items():
+        if dim in var_out.dimensions:
+            axis = var_out.dimensions.index(dim)
+            for nc, idx in zip(ncs, part_idx):
+                for n_part, n_merged in enumerate(idx):
+                    var_out[(slice(None),)*axis + (n_merged,)] = nc[vn][(slice(None),)*axis + (n_part,)]
+
+    # Global attributes of the first file, with the solver telemetry and completed slabs of all files
+    attrs = {x: nc0.getncattr(x) for x in nc0.ncattrs()}
+    if 'ts_solver_iterations_hist' in attrs:
+        n_iter_hist = np.sum([np.atleast_1d(nc.getncattr('ts_solver_iterations_hist')) for nc in ncs], axis=0)
+        attrs.update(ts_solver.iteration_attrs(n_iter_hist))
+    if 'n_slabs_completed' in attrs:
+        attrs['n_slabs_completed'] = int(np.sum([nc.getncattr('n_slabs_completed') for nc in ncs]))
+    nc_out.setncatts(attrs)
+    nc_out.close()
+    for nc in ncs:
+        nc.close()
+    os.replace(part_fullfn, output_fullfn)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dynamic scheduling of the tasks of meltmodel_global.py, meltcurves.py and tscurves.py
+
+Instead of splitting the grid cells into one static list per core, the work is split into small tasks (a grid cell, or
+a block of debris thicknesses of a grid cell) that are issued one at a time to the pool of processes, so a process
+takes the next task as soon as it finishes one. The tasks are issued longest first using an estimate of their cost,
+so the slowest tasks do not start last and leave the other cores idle at the end. The runtime of each task is
+recorded and written to a csv file (timings_fp), together with the estimated cost.
+"""
+
+# Built-in libaries
+import multiprocessing
+import os
+import time
+# External libraries
+import numpy as np
+import pandas as pd
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+
+
+# Cost of a clean ice simulation relative to thick debris (the snow-free timesteps of clean ice are computed as whole
+#  arrays, so it is much cheaper)
+cost_cleanice = 0.1
+
+
+def n_blocks(n_cells, n_items, num_processes, tasks_per_process=debris_prms.scheduler_tasks_per_process):
+    """ Number of blocks into which the items (e.g., debris thicknesses) of each grid cell are split, so that there are
+    about tasks_per_process tasks for each process (and at most one item per block) """
+    return int(np.clip(np.ceil(tasks_per_process * num_processes / n_cells), 1, n_items))
+
+
+def hd_cost(debris_thickness):
+    """ Estimated cost of simulating a debris thickness relative to thick debris (the surface temperature of thin
+    debris needs more iterations, e.g., about 3 times as many for 2 cm) """
+    debris_thickness = np.array(debris_thickness, dtype=float)
+    return np.where(debris_thickness > 0, 1 + np.minimum(0.05 / np.maximum(debris_thickness, 1e-6), 2), 
+                    cost_cleanice)
+
+
+def meltmodel_cost(debris_thicknesses, n_elev=len(debris_prms.elev_cns)):
+    """ Estimated cost of simulating the debris thicknesses of a grid cell (relative to a thick debris simulation) """
+    return n_elev * hd_cost(debris_thicknesses).sum()
+
+
+def file_cost(fullfn):
+    """ Estimated cost of processing the output of a grid cell (size of the file, 0 if it does not exist) """
+    if os.path.exists(fullfn):
+        return os.path.getsize(fullfn)
+    return 0
+
+
+def _run_task(packed_task):
+    """ Run a task in a worker process and time it """
+    func, n_task, task, time_start_all = packed_task
+    time_start = time.time()
+    result = func(task)
+    return n_task, result, time_start - time_start_all, time.time() - time_start, os.getpid()
+
+
+def run_tasks(func, tasks, costs=None, num_processes=1, option_parallels=1, task_labels=None, timings_fn=None):
+    """
+    Run func for each task, longest first, on a pool of processes that take a new task as soon as they finish one
+
+    Parameters
+    ----------
+    func : function
+        function run for each task (must be picklable, e.g., defined at the top level of a module)
+    tasks : list
+        argument of func for each task
+    costs : list
+        estimated cost of each task, used to issue the tasks longest first (default is the order of the tasks)
+    num_processes : int
+        number of processes
+    option_parallels : int
+        switch to run the tasks in parallel (1) or one after another in this process (0)
+    task_labels : list
+        description of each task recorded with the timings (default is the task number)
+    timings_fn : str
+        filename of the csv file of the timings in timings_fp (default is not to write them)
+
+    Returns
+    -------
+    results : list
+        return value of func for each task (in the order of tasks)
+    df_timings : pd.DataFrame
+        estimated cost, start [s] relative to the start of the first task, runtime [s] and process of each task
+    """
+    if costs is None:
+        costs = np.arange(len(tasks))[::-1]
+    if task_labels is None:
+        task_labels = [str(x) for x in range(len(tasks))]
+    # Longest first (stable, so tasks of the same cost keep their order)
+    task_order = np.argsort(-np.array(costs, dtype=float), kind='stable')
+
+    time_start_all = time.time()
+    packed_tasks = [(func, n_task, tasks[n_task], time_start_all) for n_task in task_order]
+    if option_parallels != 0 and num_processes > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(num_processes, len(tasks))) as p:
+            # one task at a time, so each process takes the next task as soon as it is free
+            outputs = list(p.imap_unordered(_run_task, packed_tasks, chunksize=1))
+    else:
+        outputs = [_run_task(packed_task) for packed_task in packed_tasks]
+    time_wall = time.time() - time_start_all
+
+    results = [None] * len(tasks)
+    records = []
+    for n_task, result, task_start, task_runtime, pid in outputs:
+        results[n_task] = result
+        records.append([n_task, task_labels[n_task], costs[n_task], task_start, task_runtime, pid])
+    df_timings = pd.DataFrame(records, columns=['task', 'label', 'cost', 'start_s', 'runtime_s', 'pid'])
+    df_timings = df_timings.sort_values('task').reset_index(drop=True)
+
+    # Summary: fraction of the time the processes were busy
+    n_used = min(num_processes, len(tasks)) if option_parallels != 0 else 1
+    print('Scheduler:', len(tasks), 'tasks in', np.round(time_wall,1), 's on', n_used, 'processes, busy',
+          np.round(100 * df_timings['runtime_s'].sum() / max(time_wall * n_used, 1e-9),1), '% (longest task:',
+          np.round(df_timings['runtime_s'].max(),1), 's)')
+    if timings_fn is not None:
+        if os.path.exists(debris_prms.timings_fp) == False:
+            os.makedirs(debris_prms.timings_fp)
+        df_timings.to_csv(debris_prms.timings_fp + timings_fn, index=False)
+    return results, df_timings
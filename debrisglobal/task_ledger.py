@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ledger of the grid cells shared by the processes of all nodes (coordinator mode of the scripts on the supercomputer)
+
+Instead of splitting the grid cells into one batch per node, the ledger is a directory on the shared filesystem with
+one file per grid cell that moves from pending/ to claimed/ to done/ (or failed/). A process claims the next grid cell
+by renaming its file from pending/ to claimed/; the rename is atomic, so only one process gets each grid cell and the
+processes of a node that finishes early keep claiming grid cells until none are left. The pending grid cells are
+claimed in the order of their priority (longest first if the ledger is created with their costs, see
+spc_split_lists.py). A grid cell that raises an exception is moved to failed/ and its process claims the next one, so
+one grid cell does not stop the other processes; the failed grid cells are listed once the workers are done.
+
+The ledger is created once before the workers are started. Creating it again with the same grid cells keeps the
+completed ones and returns the claimed and failed ones to pending/ (e.g., those of a job that ran out of time), so no
+worker may be running at that time. The ledger can be tested on one machine by running several workers at once, e.g.,
+    python spc_split_lists.py -task_fp=tasks/
+    python meltmodel_global.py -task_fp=tasks/ -num_simultaneous_processes=2 -batchno=0 &
+    python meltmodel_global.py -task_fp=tasks/ -num_simultaneous_processes=2 -batchno=1 &
+"""
+
+# Built-in libaries
+import json
+import os
+import time
+import traceback
+# External libraries
+import numpy as np
+import pandas as pd
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.scheduler as scheduler
+
+
+class TaskLedger():
+    """ Grid cells pending, claimed, done and failed in a directory shared by the workers
+
+    Parameters
+    ----------
+    task_fp : str
+        directory of the ledger
+    """
+    states = ['pending', 'claimed', 'done', 'failed']
+
+    def __init__(self, task_fp):
+        self.task_fp = task_fp
+        self.manifest_fullfn = task_fp + 'tasks.json'
+        # filename of each task claimed by this process
+        self.claimed_fns = {}
+
+    def state_fp(self, state):
+        return self.task_fp + state + '/'
+
+    def task_fns(self, state):
+        """ Filenames of the tasks in a state (in the order of their priority) """
+        if os.path.exists(self.state_fp(state)) == False:
+            return []
+        return sorted([x for x in os.listdir(self.state_fp(state)) if x.endswith('.json')])
+
+    @staticmethod
+    def task_no(task_fn):
+        return int(task_fn.split('.')[0].split('-')[1])
+
+    def create(self, items, costs=None):
+        """
+        Create the ledger of the items (e.g., grid cells), keeping the completed items of a ledger of the same items
+
+        Parameters
+        ----------
+        items : list
+            items (e.g., latitude and longitude of each grid cell) that can be written to json
+        costs : list
+            estimated cost of each item, used to claim the items longest first (default is the order of items)
+        """
+        items_json = [list(x) if isinstance(x, tuple) else x for x in items]
+        manifest = None
+        if os.path.exists(self.manifest_fullfn):
+            with open(self.manifest_fullfn, 'r') as f:
+                manifest = json.load(f)
+        if manifest is not None and manifest['items'] == items_json:
+            # Claimed and failed tasks of a previous run are pending again
+            for state in ['claimed', 'failed']:
+                for task_fn in self.task_fns(state):
+                    os.replace(self.state_fp(state) + task_fn, self.state_fp('pending') + task_fn)
+        else:
+            for state in self.states:
+                for task_fn in self.task_fns(state):
+                    os.remove(self.state_fp(state) + task_fn)
+            for state in self.states:
+                if os.path.exists(self.state_fp(state)) == False:
+                    os.makedirs(self.state_fp(state))
+            with open(self.manifest_fullfn + '.tmp', 'w') as f:
+                json.dump({'items': items_json}, f)
+            os.replace(self.manifest_fullfn + '.tmp', self.manifest_fullfn)
+
+        # Pending tasks: priority (longest first) and number of each item that has no task yet
+        if costs is None:
+            task_order = np.arange(len(items))
+        else:
+            task_order = np.argsort(-np.array(costs, dtype=float), kind='stable')
+        task_nos_existing = set([self.task_no(x) for state in self.states for x in self.task_fns(state)])
+        for priority, n_task in enumerate(task_order):
+            if n_task not in task_nos_existing:
+                task_fn = str(priority).zfill(7) + '-' + str(n_task).zfill(7) + '.json'
+                with open(self.state_fp('pending') + task_fn + '.tmp', 'w') as f:
+                    json.dump({'task_no': int(n_task), 'item': items_json[n_task]}, f)
+                os.replace(self.state_fp('pending') + task_fn + '.tmp', self.state_fp('pending') + task_fn)
+        return self.counts()
+
+    def claim(self):
+        """ Claim the next pending task; returns the task number and item, or None if no task is pending """
+        for task_fn in self.task_fns('pending'):
+            try:
+                os.rename(self.state_fp('pending') + task_fn, self.state_fp('claimed') + task_fn)
+            except FileNotFoundError:
+                # claimed by another process
+                continue
+            with open(self.state_fp('claimed') + task_fn, 'r') as f:
+                task = json.load(f)
+            self.claimed_fns[task['task_no']] = task_fn
+            item = task['item']
+            if isinstance(item, list):
+                item = tuple(item)
+            return task['task_no'], item
+        return None
+
+    def complete(self, task_no):
+        """ Mark a task claimed by this process as done """
+        task_fn = self.claimed_fns.pop(task_no)
+        os.replace(self.state_fp('claimed') + task_fn, self.state_fp('done') + task_fn)
+
+    def fail(self, task_no):
+        """ Mark a task claimed by this process as failed (pending again when the ledger is created again) """
+        task_fn = self.claimed_fns.pop(task_no)
+        os.replace(self.state_fp('claimed') + task_fn, self.state_fp('failed') + task_fn)
+
+    def failed_items(self):
+        """ Items of the failed tasks """
+        items = []
+        for task_fn in self.task_fns('failed'):
+            with open(self.state_fp('failed') + task_fn, 'r') as f:
+                item = json.load(f)['item']
+            if isinstance(item, list):
+                item = tuple(item)
+            items.append(item)
+        return items
+
+    def counts(self):
+        """ Number of tasks in each state """
+        return {state: len(self.task_fns(state)) for state in self.states}
+
+
+def _run_worker(packed_vars):
+    """ Claim grid cells from the ledger and run func for each of them until none is pending; a grid cell that raises
+    an exception is marked as failed and the worker claims the next one (the other workers keep running) """
+    func, task_fp, func_args = packed_vars
+    ledger = TaskLedger(task_fp)
+    records = []
+    while True:
+        task = ledger.claim()
+        if task is None:
+            break
+        task_no, latlon = task
+        time_start = time.time()
+        try:
+            func([task_no, [latlon]] + func_args)
+        except Exception:
+            print('Task', task_no, latlon, 'failed:\n' + traceback.format_exc())
+            ledger.fail(task_no)
+            continue
+        ledger.complete(task_no)
+        records.append([task_no, latlon, time_start, time.time() - time_start, os.getpid()])
+    return records
+
+
+def run_workers(func, task_fp, func_args=[], cost=np.nan, num_processes=1, option_parallels=1, timings_fn=None):
+    """
+    Run func for the grid cells of the ledger on a pool of processes that claim them until none is pending
+
+    Parameters
+    ----------
+    func : function
+        function run for each grid cell with [task number, [latlon]] + func_args (e.g., main of the scripts)
+    task_fp : str
+        directory of the ledger
+    func_args : list
+        other arguments of func
+    cost : float
+        estimated cost of each grid cell recorded with the timings
+    num_processes : int
+        number of processes
+    option_parallels : int
+        switch to run the processes in parallel (1) or to run one process (0)
+    timings_fn : str
+        filename of the csv file of the timings in timings_fp (default is not to write them)
+
+    Returns
+    -------
+    latlon_list : list
+        latitude and longitude of the grid cells processed by these processes
+    df_timings : pd.DataFrame
+        timings of each grid cell as in scheduler.run_tasks
+    """
+    time_start_all = time.time()
+    worker_records, df_workers = scheduler.run_tasks(
+            _run_worker, [[func, task_fp, func_args] for x in range(num_processes)], num_processes=num_processes,
+            option_parallels=option_parallels)
+    records = [record for x in worker_records for record in x]
+    df_timings = pd.DataFrame([[x[0], str(x[1][0]) + '_' + str(x[1][1]), cost, x[2] - time_start_all, x[3], x[4]]
+                               for x in records], columns=['task', 'label', 'cost', 'start_s', 'runtime_s', 'pid'])
+    df_timings = df_timings.sort_values('task').reset_index(drop=True)
+    ledger = TaskLedger(task_fp)
+    print('Ledger:', len(records), 'grid cells processed;', ledger.counts())
+    # Failed grid cells (of all nodes) are pending again when the ledger is created again
+    failed_items = ledger.failed_items()
+    if len(failed_items) > 0:
+        print('Ledger:', len(failed_items), 'grid cells failed:', failed_items)
+    if timings_fn is not None:
+        if os.path.exists(debris_prms.timings_fp) == False:
+            os.makedirs(debris_prms.timings_fp)
+        df_timings.to_csv(debris_prms.timings_fp + timings_fn, index=False)
+    latlon_list = [x[1] for x in sorted(records)]
+    return latlon_list, df_timings
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Surface temperature solver for the debris-covered glacier energy balance model
+
+The surface temperature is the root of the net surface energy flux F(Ts), which decreases with surface temperature.
+Each evaluation of F requires the debris temperature profile (Crank-Nicholson scheme) and the surface energy fluxes,
+so the solver aims to minimize the number of evaluations:
+  - warm_start extrapolates the surface temperature from the previous timesteps
+  - continuation_start uses the surface temperature of a neighboring debris thickness that was already simulated with
+    the same forcing: its hourly change is added to the previous surface temperature, which follows the diurnal cycle
+    more closely than the previous timestep alone
+  - newton_bracketed takes Newton steps, keeps track of the interval that brackets the root, and falls back to
+    bisection whenever a Newton step leaves the bracket (safeguarded Newton, i.e., rtsafe in Numerical Recipes).
+    The analytical derivative neglects the response of the debris temperature profile to the surface temperature,
+    which for thin debris overestimates the slope several fold and makes Newton converge slowly; therefore, after
+    the first iteration the slope is estimated from the last two evaluations (secant method).
+    Until the root is bracketed, the step size is limited like the reference iteration, but the limit doubles every
+    iteration so large changes in surface temperature do not require many 1 degree steps
+  - iteration_histogram and the helpers below record the number of iterations of each timestep, so the output can
+    report the iterations per timestep and how many timesteps did not converge (reached n_iter_max)
+"""
+
+# External libraries
+import numpy as np
+
+
+def warm_start(Ts, i, Tair_i, max_change=2):
+    """ Initial guess of the surface temperature for timestep i
+
+    Parameters
+    ----------
+    Ts : np.array
+        surface temperature [K] of the previous timesteps (only values before i are used)
+    i : int
+        step number
+    Tair_i : float
+        air temperature [K] used as the initial guess for the first timestep
+    max_change : float
+        maximum change [K] from the previous surface temperature
+
+    Returns
+    -------
+    Ts_guess : float
+        initial guess of the surface temperature [K]
+    """
+    if i == 0:
+        return Tair_i
+    elif i == 1:
+        return Ts[0]
+    # Linear extrapolation from the previous two timesteps
+    Ts_change = Ts[i-1] - Ts[i-2]
+    if Ts_change > max_change:
+        Ts_change = max_change
+    elif Ts_change < -max_change:
+        Ts_change = -max_change
+    return Ts[i-1] + Ts_change
+
+
+def continuation_start(Ts, Ts_neighbor, i):
+    """ Initial guess of the surface temperature for timestep i from a neighboring debris thickness
+
+    Parameters
+    ----------
+    Ts : np.array
+        surface temperature [K] of the previous timesteps (only values before i are used)
+    Ts_neighbor : np.array
+        surface temperature [K] of every timestep simulated for the neighboring debris thickness (rows are timesteps,
+        so the columns of an ensemble are supported)
+    i : int
+        step number
+
+    Returns
+    -------
+    Ts_guess : float or np.array
+        initial guess of the surface temperature [K]
+    """
+    if i == 0:
+        return Ts_neighbor[0]
+    return Ts[i-1] + Ts_neighbor[i] - Ts_neighbor[i-1]
+
+
+def newton_bracketed(eval_func, Ts0, tol=0.01, n_iter_max=100, step_max=1, F0=None, dF0=None):
+    """ Safeguarded Newton method to solve for the surface temperature
+
+    Parameters
+    ----------
+    eval_func : function
+        function of the surface temperature [K] that returns the net surface energy flux and its derivative; the
+        function may update the model state (e.g., debris temperature), so the last evaluation is always at the
+        returned surface temperature
+    Ts0 : float
+        initial guess of the surface temperature [K]
+    tol : float
+        tolerance [K] on the change in surface temperature (not on the residual, so the root can be further away
+        when the slope is steep or estimated poorly)
+    n_iter_max : int
+        maximum number of iterations
+    step_max : float
+        maximum Newton step [K] for the first iteration, which doubles every iteration until the root is bracketed
+    F0, dF0 : float
+        net surface energy flux and its derivative at Ts0 if already evaluated
+
+    Returns
+    -------
+    Ts : float
+        surface temperature [K]
+    n_iterations : int
+        number of iterations (evaluations after the initial guess)
+    converged : bool
+        whether the tolerance was met before n_iter_max
+    """
+    Ts = Ts0
+    if F0 is None:
+        F, dF = eval_func(Ts)
+    else:
+        F, dF = F0, dF0
+    # Bracket: F > 0 below the root (surface warms) and F < 0 above the root (surface cools)
+    Ts_low = -np.inf
+    Ts_high = np.inf
+    step_limit = step_max
+    Ts_prev, F_prev = None, None
+    n_iterations = 0
+    converged = False
+    while n_iterations < n_iter_max:
+        if F > 0:
+            Ts_low = Ts
+        elif F < 0:
+            Ts_high = Ts
+        else:
+            converged = True
+            break
+
+        # Newton step using the secant slope once available (max step size until root is bracketed)
+        if Ts_prev is not None and Ts != Ts_prev and (F - F_prev) / (Ts - Ts_prev) < 0:
+            Ts_new = Ts - F * (Ts - Ts_prev) / (F - F_prev)
+        elif dF != 0:
+            Ts_new = Ts - F / dF
+        else:
+            Ts_new = np.nan
+        bracketed = np.isfinite(Ts_low) and np.isfinite(Ts_high)
+        if not bracketed:
+            if not np.isfinite(Ts_new) or Ts_new - Ts > step_limit:
+                Ts_new = Ts + step_limit
+            elif Ts_new - Ts < -step_limit:
+                Ts_new = Ts - step_limit
+            # expand the max step size until the root is bracketed
+            step_limit = step_limit * 2
+        # Bisection if the Newton step leaves the bracket
+        elif not np.isfinite(Ts_new) or Ts_new <= Ts_low or Ts_new >= Ts_high:
+            Ts_new = (Ts_low + Ts_high) / 2
+
+        n_iterations += 1
+        Ts_change = Ts_new - Ts
+        Ts_prev, F_prev = Ts, F
+        Ts = Ts_new
+        F, dF = eval_func(Ts)
+        if abs(Ts_change) <= tol or (bracketed and Ts_high - Ts_low <= tol):
+            converged = True
+            break
+
+    # If not converged, use the middle of the bracket (evaluated so the model state is consistent)
+    if not converged and np.isfinite(Ts_low) and np.isfinite(Ts_high):
+        Ts = (Ts_low + Ts_high) / 2
+        eval_func(Ts)
+
+    return Ts, n_iterations, converged
+
+
+def iteration_histogram(n_iter_max):
+    """ Empty histogram of the number of iterations per timestep (bins 0 to n_iter_max) """
+    return np.zeros(int(n_iter_max) + 1, dtype=np.int64)
+
+
+def update_iteration_histogram(n_iter_hist, n_iterations, rows=None):
+    """ Add the number of iterations of each timestep to the histogram (values above the last bin are clipped)
+
+    Parameters
+    ----------
+    n_iter_hist : np.array
+        histogram (bins 0 to n_iter_max), or histograms (rows, bins) if rows is given, updated in place
+    n_iterations : np.array
+        number of iterations of each timestep (or column)
+    rows : np.array
+        row of n_iter_hist of each value of n_iterations (e.g., the debris thickness of each column; optional)
+    """
+    n_iterations = np.clip(np.asarray(n_iterations, dtype=int).ravel(), 0, n_iter_hist.shape[-1] - 1)
+    if rows is None:
+        np.add.at(n_iter_hist, n_iterations, 1)
+    else:
+        np.add.at(n_iter_hist, (np.asarray(rows, dtype=int).ravel(), n_iterations), 1)
+    return n_iter_hist
+
+
+def iteration_attrs(n_iter_hist):
+    """ Attributes describing the solver telemetry that are added to the output dataset
+
+    Parameters
+    ----------
+    n_iter_hist : np.array
+        number of timesteps for each number of iterations (bins 0 to n_iter_max); timesteps in the last bin reached
+        the maximum number of iterations and are counted as not converged
+
+    Returns
+    -------
+    attrs : dict
+        dictionary of attributes
+    """
+    n_steps = n_iter_hist.sum()
+    if n_steps > 0:
+        n_iter_mean = (n_iter_hist * np.arange(n_iter_hist.shape[0])).sum() / n_steps
+    else:
+        n_iter_mean = 0
+    return {'ts_solver_iterations_hist': n_iter_hist.astype(np.int32),
+            'ts_solver_iterations_mean': float(n_iter_mean),
+            'ts_solver_nonconverged_steps': int(n_iter_hist[-1]),
+            'ts_solver_steps': int(n_steps)}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Accuracy of the adaptive layers and conduction time step (option_layers_adaptive, see debrisglobal/debris_layers.py)
+relative to the reference configuration (10 layers and the debris coupled to the surface every timestep)
+
+The melt and surface temperature of a grid cell are simulated with both configurations for each debris thickness
+and the Monte Carlo members of globaldebris_input. The report gives the layers and conduction step of each debris
+thickness, the error of the melt summed over the period and of the hourly surface temperature, and the runtime of
+each configuration.
+"""
+
+# Built-in libraries
+import argparse
+import os
+import time
+
+# External libraries
+import numpy as np
+import pandas as pd
+
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.ebmodel_vectorized as ebmodel_vectorized
+import debrisglobal.debris_layers as debris_layers
+from meltmodel_global import forcing_precompute, load_metdata, solar_calcs_NOAA
+
+
+#%% ===== FUNCTIONS =====
+def getparser():
+    """
+    Use argparse to add arguments from the command line
+
+    Parameters
+    ----------
+    lat, lon (optional) : float
+        latitude and longitude of the grid cell (default is the first of latlon_list)
+    hd (optional) : float
+        debris thicknesses [m]
+    end_date (optional) : str
+        last day of the simulations (default is end_date)
+    ndays (optional) : int
+        number of days simulated
+    n_members (optional) : int
+        number of Monte Carlo members (default is all of them)
+    debug (optional) : int
+        Switch for turning debug printing on or off (default = 0 (off))
+
+    Returns
+    -------
+    Object containing arguments and their respective values.
+    """
+    parser = argparse.ArgumentParser(description="accuracy of the adaptive layers and conduction time step")
+    # add arguments
+    parser.add_argument('-lat', action='store', type=float, default=debris_prms.latlon_list[0][0],
+                        help='Latitude of the grid cell')
+    parser.add_argument('-lon', action='store', type=float, default=debris_prms.latlon_list[0][1],
+                        help='Longitude of the grid cell')
+    parser.add_argument('-hd', action='store', type=float, nargs='+',
+                        default=[0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 3.0], help='Debris thicknesses [m]')
+    parser.add_argument('-end_date', action='store', type=str, default=debris_prms.end_date,
+                        help='Last day of the simulations (YYYY-MM-DD)')
+    parser.add_argument('-ndays', action='store', type=int, default=365,
+                        help='Number of days simulated')
+    parser.add_argument('-n_members', action='store', type=int, default=None,
+                        help='Number of Monte Carlo members (default is mc_simulations)')
+    parser.add_argument('-debug', action='store', type=int, default=0,
+                        help='Boolean for debugging to turn it on or off (default 0 is off')
+    return parser
+
+
+def main(args):
+    """
+    Errors of the adaptive configuration relative to the reference configuration
+
+    Returns
+    -------
+    df : pd.DataFrame
+        layers and conduction step (range over the members), melt of the reference configuration [m w.e.], relative
+        error of the melt summed over the period (all members and worst member), root mean square and maximum error of
+        the hourly surface temperature [K], and runtime [s] of each configuration for each debris thickness
+    """
+    # Forcing
+    time_pd = pd.date_range(end=pd.Timestamp(args.end_date) + pd.Timedelta(hours=23), periods=args.ndays*24,
+                            freq='H')
+    Tair_AWS, RH_AWS, u_AWS_raw, Rain_AWS, Sin_AWS, Lin_AWS, Elev_AWS, lapserate, dc_zmean = (
+            load_metdata(args.lat, args.lon, time_pd))
+    P, Tair, Rain, snow, eZ, density_air = forcing_precompute(Tair_AWS, RH_AWS, Rain_AWS, lapserate,
+                                                              int(np.round(dc_zmean,0)), Elev_AWS)
+    zenith_angle_rad, azimuth_angle_rad, rm_r2 = solar_calcs_NOAA(
+            np.array(time_pd.year), np.array(time_pd.dayofyear), np.array(time_pd.hour + time_pd.minute / 60),
+            args.lon, args.lat, len(time_pd))
+    # slope and aspect are 0 degrees, so the illumination angle is the zenith angle
+    forcing = (Tair, eZ, u_AWS_raw, Sin_AWS, Lin_AWS, Rain, snow, P, density_air, zenith_angle_rad)
+
+    if args.n_members is None:
+        mc_idx = np.arange(debris_prms.mc_simulations)
+    else:
+        mc_idx = np.arange(args.n_members)
+    debris_properties = (debris_prms.albedo_random[mc_idx], debris_prms.z0_random[mc_idx],
+                         debris_prms.k_random[mc_idx], debris_prms.z0_random_snow[mc_idx],
+                         debris_prms.sin_factor_random[mc_idx])
+
+    records = []
+    for debris_thickness in args.hd:
+        output = {}
+        runtime = {}
+        for option_adaptive in [0, 1]:
+            time_start = time.time()
+            output[option_adaptive] = ebmodel_vectorized.debris_eb_ensemble(
+                    *forcing, debris_thickness, *debris_properties, option_layers_adaptive=option_adaptive)
+            runtime[option_adaptive] = time.time() - time_start
+        melt_ref = output[0][0].sum(axis=0) * debris_prms.density_ice / debris_prms.density_water
+        melt = output[1][0].sum(axis=0) * debris_prms.density_ice / debris_prms.density_water
+        ts_dif = output[1][2] - output[0][2]
+        N, h, C, n_sub = debris_layers.debris_layers(np.zeros(len(mc_idx)) + debris_thickness,
+                                                     debris_prms.k_random[mc_idx], option_adaptive=1)
+        records.append([debris_thickness, N.min(), N.max(), n_sub.min(), n_sub.max(), melt_ref.mean(),
+                        np.abs(melt - melt_ref).sum() / melt_ref.sum(), np.max(np.abs(melt / melt_ref - 1)),
+                        (ts_dif**2).mean()**0.5, np.abs(ts_dif).max(), runtime[0], runtime[1]])
+        if debug:
+            print('hd [m]:', debris_thickness, ' runtime [s]:', np.round(runtime[0],1), '(reference)',
+                  np.round(runtime[1],1), '(adaptive)')
+    df = pd.DataFrame(records, columns=['hd_m', 'N_min', 'N_max', 'n_sub_min', 'n_sub_max', 'melt_ref_mwe',
+                                        'melt_relerr', 'melt_relerr_max', 'ts_rmse_K', 'ts_maxerr_K',
+                                        'runtime_ref_s', 'runtime_adaptive_s'])
+    return df
+
+
+#%%
+if __name__ == '__main__':
+    time_start = time.time()
+    parser = getparser()
+    args = parser.parse_args()
+
+    if args.debug == 1:
+        debug = True
+    else:
+        debug = False
+
+    df = main(args)
+    print('\nAdaptive layers and conduction time step relative to the reference configuration:')
+    print(df.round(4).to_string(index=False))
+
+    output_fp = debris_prms.output_fp + 'layers_accuracy/'
+    if os.path.exists(output_fp) == False:
+        os.makedirs(output_fp)
+    if args.lat < 0:
+        lat_str = 'S-'
+    else:
+        lat_str = 'N-'
+    latlon_str = str(int(abs(args.lat)*100)) + lat_str + str(int(args.lon*100)) + 'E-'
+    df.to_csv(output_fp + debris_prms.roi + '-' + latlon_str + 'layers_accuracy.csv', index=False)
+
+    print('\nProcessing time of :',time.time()-time_start, 's')
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Convergence of the Monte Carlo simulations for each sampling design of the debris properties (see mc_sampling.py)
+
+The melt summed over the period is simulated for a grid cell and a few debris thicknesses for independent replicates
+of each design, number of members and antithetic pairing. The mean and standard deviation of the members are compared
+to those of a large Sobol reference ensemble. The target accuracy is the error of the current setup, i.e., random
+sampling with mc_simulations members, and the report gives the smallest number of members of each design that is as
+accurate for both the mean and the standard deviation. Only debris-covered ice is evaluated (the clean ice properties
+are sampled with the same design).
+"""
+
+# Built-in libraries
+import argparse
+import os
+import time
+
+# External libraries
+import numpy as np
+import pandas as pd
+
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.ebmodel_vectorized as ebmodel_vectorized
+import debrisglobal.mc_sampling as mc_sampling
+from meltmodel_global import forcing_precompute, load_metdata, solar_calcs_NOAA
+
+
+#%% ===== FUNCTIONS =====
+def getparser():
+    """
+    Use argparse to add arguments from the command line
+
+    Parameters
+    ----------
+    lat, lon (optional) : float
+        latitude and longitude of the grid cell (default is the first of latlon_list)
+    hd (optional) : float
+        debris thicknesses [m]
+    end_date (optional) : str
+        last day of the simulations (default is end_date)
+    ndays (optional) : int
+        number of days simulated
+    n_members (optional) : int
+        numbers of members of each design
+    n_replicates (optional) : int
+        number of independent replicates of each design and number of members
+    n_reference (optional) : int
+        number of members of the reference ensemble
+    debug (optional) : int
+        Switch for turning debug printing on or off (default = 0 (off))
+
+    Returns
+    -------
+    Object containing arguments and their respective values.
+    """
+    parser = argparse.ArgumentParser(description="convergence of the Monte Carlo sampling designs")
+    # add arguments
+    parser.add_argument('-lat', action='store', type=float, default=debris_prms.latlon_list[0][0],
+                        help='Latitude of the grid cell')
+    parser.add_argument('-lon', action='store', type=float, default=debris_prms.latlon_list[0][1],
+                        help='Longitude of the grid cell')
+    parser.add_argument('-hd', action='store', type=float, nargs='+', default=[0.05, 0.2, 1.0],
+                        help='Debris thicknesses [m]')
+    parser.add_argument('-end_date', action='store', type=str, default=debris_prms.end_date,
+                        help='Last day of the simulations (YYYY-MM-DD)')
+    parser.add_argument('-ndays', action='store', type=int, default=365,
+                        help='Number of days simulated')
+    parser.add_argument('-n_members', action='store', type=int, nargs='+', default=[8, 16, 32, 64, 128],
+                        help='Numbers of members of each design')
+    parser.add_argument('-n_replicates', action='store', type=int, default=10,
+                        help='Number of independent replicates of each design and number of members')
+    parser.add_argument('-n_reference', action='store', type=int, default=4096,
+                        help='Number of members of the reference ensemble (Sobol)')
+    parser.add_argument('-debug', action='store', type=int, default=0,
+                        help='Boolean for debugging to turn it on or off (default 0 is off')
+    return parser
+
+
+def period_melt(forcing, debris_thickness, debris_properties_df, ncols_max=512):
+    """
+    Melt [m w.e.] summed over the period of each member
+
+    Parameters
+    ----------
+    forcing : tuple
+        forcing passed to debris_eb_ensemble (Tair, eZ, u_AWS_raw, Sin, Lin_AWS, Rain, snow, P, density_air and
+        ill_angle_rad)
+    debris_thickness : float
+        debris thickness [m]
+    debris_properties_df : pd.DataFrame
+        debris properties of each member (see mc_sampling.sample_debris_properties)
+    ncols_max : int
+        maximum number of members simulated together (limits the memory of the hourly output)
+    """
+    melt = np.zeros(debris_properties_df.shape[0])
+    for n_start in range(0, debris_properties_df.shape[0], ncols_max):
+        df_chunk = debris_properties_df.iloc[n_start:n_start+ncols_max]
+        Melt_all, dsnow_all, Ts_all = ebmodel_vectorized.debris_eb_ensemble(
+                *forcing, debris_thickness, df_chunk['albedo'].values, df_chunk['z0'].values, df_chunk['k'].values,
+                df_chunk['z0_ice'].values, df_chunk['Sin_factor'].values)
+        melt[n_start:n_start+ncols_max] = Melt_all.sum(axis=0) * debris_prms.density_ice / debris_prms.density_water
+    return melt
+
+
+def main(args):
+    """
+    Errors of the mean and standard deviation of the melt of each design
+
+    Returns
+    -------
+    df : pd.DataFrame
+        root mean square error of the mean and standard deviation of the melt, relative to the mean melt of the
+        reference ensemble, for each design, antithetic pairing, number of members and debris thickness
+    df_summary : pd.DataFrame
+        smallest number of members of each design that is as accurate as the current setup for all debris thicknesses
+    """
+    assert debris_prms.experiment_no == 4, 'Monte Carlo simulations are only used in experiment 4'
+    # Forcing
+    time_pd = pd.date_range(end=pd.Timestamp(args.end_date) + pd.Timedelta(hours=23), periods=args.ndays*24,
+                            freq='H')
+    Tair_AWS, RH_AWS, u_AWS_raw, Rain_AWS, Sin_AWS, Lin_AWS, Elev_AWS, lapserate, dc_zmean = (
+            load_metdata(args.lat, args.lon, time_pd))
+    P, Tair, Rain, snow, eZ, density_air = forcing_precompute(Tair_AWS, RH_AWS, Rain_AWS, lapserate,
+                                                              int(np.round(dc_zmean,0)), Elev_AWS)
+    zenith_angle_rad, azimuth_angle_rad, rm_r2 = solar_calcs_NOAA(
+            np.array(time_pd.year), np.array(time_pd.dayofyear), np.array(time_pd.hour + time_pd.minute / 60),
+            args.lon, args.lat, len(time_pd))
+    # slope and aspect are 0 degrees, so the illumination angle is the zenith angle
+    forcing = (Tair, eZ, u_AWS_raw, Sin_AWS, Lin_AWS, Rain, snow, P, density_air, zenith_angle_rad)
+
+    # Ensembles: reference, current setup and each design
+    rng = np.random.RandomState(0)
+    ensembles = [('reference', 0, args.n_reference, 0)]
+    ensembles.extend([('current', 0, debris_prms.mc_simulations, x) for x in range(args.n_replicates)])
+    for design in mc_sampling.mc_designs:
+        for antithetic in [0, 1]:
+            for n_members in args.n_members:
+                ensembles.extend([(design, antithetic, n_members, x) for x in range(args.n_replicates)])
+    df_list = []
+    for design, antithetic, n_members, replicate in ensembles:
+        df_list.append(mc_sampling.sample_debris_properties(
+                n_members, debris_prms.debris_properties_bounds, design={'reference':'sobol',
+                                                                         'current':'random'}.get(design, design),
+                antithetic=(antithetic == 1), seed=rng.randint(2**31)))
+    ensemble_idx = np.cumsum([0] + [x.shape[0] for x in df_list])
+
+    records = []
+    for debris_thickness in args.hd:
+        time_start = time.time()
+        melt = period_melt(forcing, debris_thickness, pd.concat(df_list, ignore_index=True))
+        if debug:
+            print('hd [m]:', debris_thickness, ' simulated', len(melt), 'members in',
+                  np.round(time.time() - time_start,1), 's')
+        melt_mean_ref = melt[ensemble_idx[0]:ensemble_idx[1]].mean()
+        melt_std_ref = melt[ensemble_idx[0]:ensemble_idx[1]].std()
+        for n_ens, (design, antithetic, n_members, replicate) in enumerate(ensembles[1:], start=1):
+            melt_ens = melt[ensemble_idx[n_ens]:ensemble_idx[n_ens+1]]
+            records.append([design, antithetic, n_members, debris_thickness,
+                            (melt_ens.mean() - melt_mean_ref) / melt_mean_ref,
+                            (melt_ens.std() - melt_std_ref) / melt_mean_ref])
+    df_replicates = pd.DataFrame(records, columns=['design', 'antithetic', 'n_members', 'hd_m', 'mean_error',
+                                                   'std_error'])
+    df = (df_replicates.groupby(['design', 'antithetic', 'n_members', 'hd_m'])[['mean_error', 'std_error']]
+          .apply(lambda x: (x**2).mean()**0.5).rename(columns={'mean_error':'mean_rmse', 'std_error':'std_rmse'}))
+
+    # Smallest number of members as accurate as the current setup
+    df_target = df.loc[('current', 0, debris_prms.mc_simulations)]
+    summary = []
+    for (design, antithetic), df_design in df.drop('current', level='design').groupby(level=[0,1]):
+        n_members_ok = [n_members for n_members, df_n in df_design.groupby(level='n_members')
+                        if ((df_n['mean_rmse'].values <= df_target['mean_rmse'].values) &
+                            (df_n['std_rmse'].values <= df_target['std_rmse'].values)).all()]
+        summary.append([design, antithetic, np.min(n_members_ok) if len(n_members_ok) > 0 else np.nan])
+    df_summary = pd.DataFrame(summary, columns=['design', 'antithetic', 'n_members_required'])
+    return df, df_summary
+
+
+#%%
+if __name__ == '__main__':
+    time_start = time.time()
+    parser = getparser()
+    args = parser.parse_args()
+
+    if args.debug == 1:
+        debug = True
+    else:
+        debug = False
+
+    df, df_summary = main(args)
+    print('\nRoot mean square error of the mean and standard deviation of the melt (relative to the mean melt):')
+    print(df.round(4).to_string())
+    print('\nMembers required to be as accurate as', debris_prms.mc_simulations, 'random members:')
+    print(df_summary.to_string(index=False))
+
+    output_fp = debris_prms.output_fp + 'mc_convergence/'
+    if os.path.exists(output_fp) == False:
+        os.makedirs(output_fp)
+    if args.lat < 0:
+        lat_str = 'S-'
+    else:
+        lat_str = 'N-'
+    latlon_str = str(int(abs(args.lat)*100)) + lat_str + str(int(args.lon*100)) + 'E-'
+    df.to_csv(output_fp + debris_prms.roi + '-' + latlon_str + 'mc_convergence.csv')
+    df_summary.to_csv(output_fp + debris_prms.roi + '-' + latlon_str + 'mc_convergence_summary.csv', index=False)
+
+    print('\nProcessing time of :',time.time()-time_start, 's')
@@ -7,8 +7,6 @@ Created on Sat Aug 11 10:17:13 2018
 
 # Built-in libraries
 import argparse
-import collections
-import multiprocessing
 import os
 import pickle
 import time
@@ -24,7 +22,9 @@ import xarray as xr
 
 # Local libraries
 import debrisglobal.globaldebris_input as debris_prms
-from spc_split_lists import split_list
+import debrisglobal.daily_melt as daily_melt
+import debrisglobal.scheduler as scheduler
+import debrisglobal.task_ledger as task_ledger
 
 #%% ===== FUNCTIONS =====
 def getparser():
@@ -37,6 +37,9 @@ def getparser():
         batch number used to differentiate output on supercomputer
     batches (optional) : int
         total number of batches based on supercomputer
+    task_fp (optional) : str
+        directory of the task ledger shared by the nodes (the processes claim the grid cells from it instead of 
+        latlon_fn, see debrisglobal/task_ledger.py)
     num_simultaneous_processes (optional) : int
         number of cores to use in parallels
     option_parallels (optional) : int
@@ -56,6 +59,8 @@ def getparser():
                         help='Total number of batches (nodes) for supercomputer')
     parser.add_argument('-latlon_fn', action='store', type=str, default=None,
                         help='Filename containing list of lat/lon tuples for running batches on spc')
+    parser.add_argument('-task_fp', action='store', type=str, default=None,
+                        help='Directory of the task ledger from which the processes claim the grid cells')
     parser.add_argument('-num_simultaneous_processes', action='store', type=int, default=4,
                         help='number of simultaneous processes (cores) to use')
     parser.add_argument('-option_parallels', action='store', type=int, default=1,
@@ -112,60 +117,12 @@ def export_ds_daily_melt(ds):
     time_daily = pd.to_datetime(ds.time.values[0::24])
     
     # Melt daily
-    ds_shape = ds.melt.values.shape
-    melt_daily = ds.melt.values.reshape((ds_shape[0], int(ds_shape[1] / 24), 24, ds_shape[2])).sum(axis=2)
+    melt_daily = daily_melt.daily_sum(ds.melt.values, axis=1)
     if 'melt_std' in list(ds.keys()):
-        melt_daily_std = ds.melt_std.values.reshape((ds_shape[0], int(ds_shape[1] / 24), 24, ds_shape[2])).sum(axis=2)
-    # Variable coordinates dictionary
-    output_coords_dict = collections.OrderedDict()
-    output_coords_dict['melt'] = collections.OrderedDict([('hd_cm', ds.hd_cm.values), ('time', time_daily), 
-                                                          ('elev', ds.elev.values)])
-    if 'melt_std' in list(ds.keys()):
-        output_coords_dict['melt_std'] = collections.OrderedDict([('hd_cm', ds.hd_cm.values), ('time', time_daily), 
-                                                                  ('elev', ds.elev.values)])
-    # Attributes dictionary
-    output_attrs_dict = {
-            'latitude': {'long_name': 'latitude',
-                         'units': 'degrees north'},
-            'longitude': {'long_name': 'longitude',
-                          'units': 'degrees_east'},
-            'roi': {'long_name': 'region of interest'},
-            'time': {'long_name': 'time'},
-            'hd_cm': {'long_name': 'debris thickness',
-                      'units:': 'cm'},
-            'elev': {'long_name': 'elevation',
-                     'units': 'm a.s.l.'},
-            'melt': {'long_name': 'glacier melt, in water equivalent',
-                     'units': 'm'},
-            'melt_std': {'long_name': 'glacier melt, in water equivalant, standard deviation',
-                         'units': 'm'}
-            }
-
-    # Add variables to empty dataset and merge together
-    count_vn = 0
-    encoding = {}
-    for vn in output_coords_dict.keys():
-        count_vn += 1
-        empty_holder = np.zeros([len(output_coords_dict[vn][i]) for i in list(output_coords_dict[vn].keys())])
-        output_ds = xr.Dataset({vn: (list(output_coords_dict[vn].keys()), empty_holder)},
-                               coords=output_coords_dict[vn])
-        # Merge datasets of stats into one output
-        if count_vn == 1:
-            output_ds_all = output_ds
-        else:
-            output_ds_all = xr.merge((output_ds_all, output_ds))
-            
-    # Add attributes
-    for vn in output_ds_all.variables:
-        try:
-            output_ds_all[vn].attrs = output_attrs_dict[vn]
-        except:
-            pass
-        # Encoding (specify _FillValue, offsets, etc.)
-        encoding[vn] = {'_FillValue': False,
-                        'zlib':True,
-                        'complevel':9
-                        }
+        melt_daily_std = daily_melt.daily_sum(ds.melt_std.values, axis=1)
+    
+    output_ds_all, encoding = daily_melt.create_xrdataset_daily_melt(ds.hd_cm.values, time_daily, ds.elev.values,
+                                                                     option_std=('melt_std' in list(ds.keys())))
             
     # Add values    
     output_ds_all['melt'].values = melt_daily
@@ -224,13 +181,8 @@ def main(list_packed_vars):
         else:
             lat_str = 'N-'
         latlon_str = str(int(abs(lat_deg*100))) + lat_str + str(int(lon_deg*100)) + 'E-'
-        if debris_prms.experiment_no == 3:
-            mc_str = ''
-        else:
-            mc_str = str(int(debris_prms.mc_simulations)) + 'MC_'
         # Raw meltmodel output filename
-#        ds_meltmodel_fn = debris_prms.fn_prefix + latlon_str + debris_prms.date_start + '.nc'
-        ds_meltmodel_fn = debris_prms.fn_prefix + latlon_str + mc_str + debris_prms.date_start + '.nc'
+        ds_meltmodel_fn = daily_melt.meltmodel_fn(latlon)
         
 #        print(debris_prms.eb_fp)
 #        print(ds_meltmodel_fn)
@@ -283,27 +235,29 @@ if __name__ == '__main__':
     else:
         num_cores = 1
 
-    # Glacier number lists to pass for parallel processing
-    latlon_lsts = split_list(latlon_list, n=num_cores, option_ordered=args.option_ordered)
-
-    # Pack variables for multiprocessing
+    # Pack variables for multiprocessing: one task for each grid cell, issued largest melt model output first to the 
+    #  processes as they become free
     list_packed_vars = []
-    for count, latlon_lst in enumerate(latlon_lsts):
-        list_packed_vars.append([count, latlon_lst])
+    for count, latlon in enumerate(latlon_list):
+        list_packed_vars.append([count, [latlon]])
+    task_costs = [scheduler.file_cost(debris_prms.eb_fp + daily_melt.meltmodel_fn(latlon)) 
+                  for latlon in latlon_list]
+    task_labels = [str(latlon[0]) + '_' + str(latlon[1]) for latlon in latlon_list]
 
-    # Parallel processing
     if args.option_parallels != 0:
         print('Processing in parallel with ' + str(args.num_simultaneous_processes) + ' cores...')
-        with multiprocessing.Pool(args.num_simultaneous_processes) as p:
-            p.map(main,list_packed_vars)
-    # If not in parallel, then only should be one loop
+    if args.task_fp is not None:
+        # Coordinator mode: the processes of every node claim the grid cells from the ledger until none are left
+        latlon_list, df_timings = task_ledger.run_workers(
+                main, args.task_fp, num_processes=num_cores, option_parallels=args.option_parallels,
+                timings_fn='meltcurves_batch' + str(args.batchno) + '_timings.csv')
     else:
-        # Loop through the chunks and export bias adjustments
-        for n in range(len(list_packed_vars)):
-            if debug and num_cores == 1:
-                ds_ostrem = main(list_packed_vars[n])
-            else:
-                main(list_packed_vars[n])
+        results, df_timings = scheduler.run_tasks(
+                main, list_packed_vars, costs=task_costs, num_processes=num_cores, 
+                option_parallels=args.option_parallels, task_labels=task_labels, 
+                timings_fn='meltcurves_batch' + str(args.batchno) + '_timings.csv')
+    if debug and num_cores == 1 and args.task_fp is None:
+        ds_ostrem = results[-1]
                 
     print('\nProcessing time of :',time.time()-time_start, 's')
     
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Train the surrogate emulator of meltmodel_global (see debrisglobal/emulator.py) from the hourly output of the
+simulated grid cells, or validate it on a held out fraction of the grid cells
+
+The emulator is used by meltmodel_global.py with option_emulator = 1 for the grid cells whose forcing is within the
+training data.
+"""
+
+# Built-in libraries
+import argparse
+import os
+import pickle
+import time
+
+# External libraries
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Local libraries
+import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.daily_melt as daily_melt
+import debrisglobal.emulator as emulator
+from meltmodel_global import forcing_precompute, load_metdata
+
+
+#%% ===== FUNCTIONS =====
+def getparser():
+    """
+    Use argparse to add arguments from the command line
+
+    Parameters
+    ----------
+    latlon_fn (optional) : str
+        filename containing list of lat/lon tuples used to train the emulator
+    option_validate (optional) : int
+        switch to validate the emulator on held out grid cells instead of training it on all grid cells
+    debug (optional) : int
+        Switch for turning debug printing on or off (default = 0 (off))
+
+    Returns
+    -------
+    Object containing arguments and their respective values.
+    """
+    parser = argparse.ArgumentParser(description="train the emulator of the melt model from the simulated grid cells")
+    # add arguments
+    parser.add_argument('-latlon_fn', action='store', type=str, default=None,
+                        help='Filename containing list of lat/lon tuples used to train the emulator')
+    parser.add_argument('-option_validate', action='store', type=int, default=0,
+                        help='Switch to validate on held out grid cells (1) or train on all grid cells (0)')
+    parser.add_argument('-seed', action='store', type=int, default=0,
+                        help='Random seed used to choose the held out grid cells')
+    parser.add_argument('-debug', action='store', type=int, default=0,
+                        help='Boolean for debugging to turn it on or off (default 0 is off')
+    return parser
+
+
+def unpack_values(da):
+    """ Values of a variable opened with mask_and_scale=False, unpacked if packed by the output profile """
+    return da.values * da.attrs.get('scale_factor', 1) + da.attrs.get('add_offset', 0)
+
+
+def load_output(lat_deg, lon_deg):
+    """
+    Daily melt and mean surface temperature from the hourly output of meltmodel_global
+
+    Returns
+    -------
+    time_pd : pd.DatetimeIndex
+        hourly timesteps of the output
+    hd : np.array
+        debris thicknesses [m]
+    elev_values : np.array
+        elevations [m a.s.l.]
+    melt_daily, ts_daily : np.array
+        daily melt [m w.e.] and mean surface temperature [K] (debris thickness, day, elevation)
+    """
+    # not masked, as the output is written without a fill value (_FillValue False), so zeros are valid values
+    output_fullfn = debris_prms.eb_fp + daily_melt.meltmodel_fn((lat_deg, lon_deg))
+    with xr.open_dataset(output_fullfn, mask_and_scale=False) as ds:
+        time_pd = pd.to_datetime(ds.time.values)
+        hd = ds.hd_cm.values / 100
+        elev_values = ds.elev.values
+        nhd, nsteps, nelev = ds.melt.shape
+        melt_daily = unpack_values(ds.melt).reshape(nhd, int(nsteps/24), 24, nelev).sum(axis=2)
+        ts_daily = unpack_values(ds.ts).reshape(nhd, int(nsteps/24), 24, nelev).mean(axis=2)
+    return time_pd, hd, elev_values, melt_daily, ts_daily
+
+
+def load_features(lat_deg, lon_deg, time_pd, elev_values):
+    """
+    Daily features of the emulator at each elevation, from the meteorological data processed as in meltmodel_global
+
+    Parameters
+    ----------
+    lat_deg, lon_deg : float
+        latitude and longitude of the grid cell
+    time_pd : pd.DatetimeIndex
+        hourly timesteps of the output
+    elev_values : np.array
+        elevations [m a.s.l.]
+
+    Returns
+    -------
+    features_elev : list
+        daily features (see emulator.daily_features) of each elevation
+    """
+    Tair_AWS, RH_AWS, u_AWS_raw, Rain_AWS, Sin_AWS, Lin_AWS, Elev_AWS, lapserate, dc_zmean = (
+            load_metdata(lat_deg, lon_deg, time_pd))
+    features_elev = []
+    for elev in elev_values:
+        P, Tair, Rain, snow, eZ, density_air = (
+                forcing_precompute(Tair_AWS, RH_AWS, Rain_AWS, lapserate, elev, Elev_AWS, Snow_AWS=None,
+                                   option_snow_fromAWS=debris_prms.option_snow_fromAWS))
+        features_elev.append(emulator.daily_features(Tair, RH_AWS, u_AWS_raw, Sin_AWS, Lin_AWS, Rain, snow, elev))
+    return features_elev
+
+
+def validation_stats(emulator_model, latlon_list):
+    """
+    Errors of the emulator on grid cells that were not used to train it
+
+    Returns
+    -------
+    df : pd.DataFrame
+        root mean square error and bias of the daily melt [mm w.e. d-1], relative error of the melt summed over the
+        period [-] and root mean square error of the daily mean surface temperature [K] of each debris thickness
+    """
+    stats = {}
+    for latlon in latlon_list:
+        time_pd, hd, elev_values, melt_daily, ts_daily = load_output(latlon[0], latlon[1])
+        features_elev = load_features(latlon[0], latlon[1], time_pd, elev_values)
+        for nelev, features in enumerate(features_elev):
+            melt_emulated, ts_emulated = emulator_model.predict(features, hd)
+            for nhd, hd_value in enumerate(hd):
+                if hd_value not in stats:
+                    stats[hd_value] = {'melt_dif': [], 'melt_sum': [], 'melt_sum_emulated': [], 'ts_dif': []}
+                stats[hd_value]['melt_dif'].append(melt_emulated[nhd] - melt_daily[nhd,:,nelev])
+                stats[hd_value]['melt_sum'].append(melt_daily[nhd,:,nelev].sum())
+                stats[hd_value]['melt_sum_emulated'].append(melt_emulated[nhd].sum())
+                stats[hd_value]['ts_dif'].append(ts_emulated[nhd] - ts_daily[nhd,:,nelev])
+
+    df = pd.DataFrame(index=sorted(stats.keys()), columns=['melt_rmse_mmwed', 'melt_bias_mmwed', 'melt_relerr',
+                                                           'ts_rmse_K'], dtype=float)
+    df.index.name = 'hd_m'
+    for hd_value in df.index:
+        melt_dif = np.concatenate(stats[hd_value]['melt_dif']) * 1000
+        melt_sum = np.array(stats[hd_value]['melt_sum'])
+        melt_sum_emulated = np.array(stats[hd_value]['melt_sum_emulated'])
+        df.loc[hd_value, 'melt_rmse_mmwed'] = (melt_dif**2).mean()**0.5
+        df.loc[hd_value, 'melt_bias_mmwed'] = melt_dif.mean()
+        df.loc[hd_value, 'melt_relerr'] = np.abs(melt_sum_emulated - melt_sum).sum() / melt_sum.sum()
+        if hd_value > 0:
+            df.loc[hd_value, 'ts_rmse_K'] = (np.concatenate(stats[hd_value]['ts_dif'])**2).mean()**0.5
+    return df
+
+
+def main(latlon_list):
+    """
+    Train the emulator on the grid cells
+
+    Parameters
+    ----------
+    latlon_list : list
+        latitude and longitude of the grid cells used for training
+
+    Returns
+    -------
+    emulator_model : emulator.Emulator
+        trained emulator
+    """
+    # Features of all grid cells for the scaling (small compared to the output, so they are kept for the training)
+    features_all = {}
+    for latlon in latlon_list:
+        time_pd, hd, elev_values, melt_daily, ts_daily = load_output(latlon[0], latlon[1])
+        features_all[tuple(latlon)] = load_features(latlon[0], latlon[1], time_pd, elev_values)
+    emulator_model = emulator.Emulator(ridge=debris_prms.emulator_ridge)
+    emulator_model.set_scaling(np.concatenate([x for y in features_all.values() for x in y]))
+
+    # Normal equations accumulated one grid cell at a time
+    for latlon in latlon_list:
+        if debug:
+            print('training:', latlon)
+        time_pd, hd, elev_values, melt_daily, ts_daily = load_output(latlon[0], latlon[1])
+        for nelev, features in enumerate(features_all[tuple(latlon)]):
+            emulator_model.accumulate(features, hd, melt_daily[:,:,nelev], ts_daily[:,:,nelev])
+    emulator_model.solve()
+    return emulator_model
+
+
+#%%
+if __name__ == '__main__':
+    time_start = time.time()
+    parser = getparser()
+    args = parser.parse_args()
+
+    if args.debug == 1:
+        debug = True
+    else:
+        debug = False
+
+    if args.latlon_fn is not None:
+        with open(args.latlon_fn, 'rb') as f:
+            latlon_list = pickle.load(f)
+    else:
+        latlon_list = debris_prms.latlon_list
+    # Grid cells that have been simulated
+    latlon_list = [x for x in latlon_list if os.path.exists(debris_prms.eb_fp + daily_melt.meltmodel_fn(x))]
+
+    if os.path.exists(debris_prms.emulator_fp) == False:
+        os.makedirs(debris_prms.emulator_fp)
+
+    if args.option_validate == 1:
+        # Hold out a fraction of the grid cells
+        rng = np.random.RandomState(args.seed)
+        latlon_idx = rng.permutation(len(latlon_list))
+        n_holdout = int(np.ceil(debris_prms.emulator_holdout_frac * len(latlon_list)))
+        latlon_holdout = [latlon_list[x] for x in latlon_idx[:n_holdout]]
+        latlon_train = [latlon_list[x] for x in latlon_idx[n_holdout:]]
+        emulator_model = main(latlon_train)
+        df = validation_stats(emulator_model, latlon_holdout)
+        print('\nEmulator validation on', len(latlon_holdout), 'held out grid cells (trained on', len(latlon_train),
+              'grid cells):')
+        print(df.round(3).to_string())
+        df.to_csv(debris_prms.emulator_fp + debris_prms.emulator_fn.replace('.npz', '_validation.csv'))
+    else:
+        emulator_model = main(latlon_list)
+        emulator_model.save(debris_prms.emulator_fp + debris_prms.emulator_fn)
+        print('\nEmulator trained on', len(latlon_list), 'grid cells:',
+              debris_prms.emulator_fp + debris_prms.emulator_fn)
+
+    print('\nProcessing time of :',time.time()-time_start, 's')
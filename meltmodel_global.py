@@ -56,7 +56,6 @@ Monte Carlo simulation allows uncertainty to be incorporated into model performa
 import argparse
 import collections
 #import datetime
-import multiprocessing
 import os
 import pickle
 import time
@@ -64,10 +63,20 @@ import time
 #import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.stats import median_absolute_deviation
 import xarray as xr
 # Local libraries
 import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.ebmodel_vectorized as ebmodel_vectorized
+import debrisglobal.mc_stats as mc_stats
+import debrisglobal.daily_melt as daily_melt
+import debrisglobal.emulator as emulator
+import debrisglobal.hd_adaptive as hd_adaptive
+import debrisglobal.ts_solver as ts_solver
+import debrisglobal.debris_layers as debris_layers
+import debrisglobal.scheduler as scheduler
+import debrisglobal.task_ledger as task_ledger
+from debrisglobal.output_writer import IncrementalWriter, merge_parts
+from debrisglobal.checkpoint import Checkpoint, checkpoint_config
 #import globaldebris_input as input
 from spc_split_lists import split_list
 
@@ -87,6 +96,34 @@ def getparser():
         number of cores to use in parallels
     option_parallels (optional) : int
         switch to use parallels or not
+    task_fp (optional) : str
+        directory of the task ledger shared by the nodes (the processes claim the grid cells from it instead of 
+        latlon_fn, see debrisglobal/task_ledger.py)
+    option_vectorized (optional) : int
+        switch to run all Monte Carlo members together as one vector (1) or one at a time (0); the vector pays off 
+        for large ensembles only (2.7 times faster with 30 members, but 4 times slower with 3 members on a synthetic 
+        grid cell), so use one at a time for small values of mc_simulations
+    option_hd_lockstep (optional) : int
+        switch to simulate all debris thicknesses together in one pass through the forcing (1) or one at a time (0)
+    option_elev_lockstep (optional) : int
+        switch to simulate all elevations together (1) or one at a time (0), used with option_hd_lockstep or
+        option_vectorized
+    option_numba (optional) : int
+        switch to run each simulation with the compiled (Numba) energy balance model (1) or in Python (0)
+    option_ts_solver (optional) : int
+        switch to solve for the surface temperature with the warm-started, bracketed Newton method (1) or the
+        Newton-Raphson method with a max step size of 1 degree (0); only for the energy balance model in Python that
+        runs one MC simulation at a time (option_numba, option_vectorized and option_hd_lockstep of 0). Both solvers
+        stop on the change in surface temperature (0.01 K) rather than on the residual, so they stop at different
+        distances from the root: the hourly surface temperature differs by up to a few K (3.6 K on a synthetic 40-day
+        grid cell; 0.84 K, mean 0.01 K and 0.4% of the melt for 7 debris thicknesses of the same cell)
+    option_ts_continuation (optional) : int
+        switch to start the surface temperature solver from the surface temperature of the previously simulated debris
+        thickness (1) or from the previous timestep (0), used when the debris thicknesses are simulated one at a time;
+        the solvers stop on the change in surface temperature rather than on the residual, so a different start 
+        changes the hourly surface temperature by up to a few K (2.6 K and 0.03% of the melt on a synthetic grid cell)
+        and the output depends on the order of the debris thicknesses. Not used with blocks of debris thicknesses or 
+        checkpoints, and recorded in the ts_continuation attribute of the output
     debug (optional) : int
         Switch for turning debug printing on or off (default = 0 (off))
 
@@ -102,6 +139,8 @@ def getparser():
                         help='Total number of batches (nodes) for supercomputer')
     parser.add_argument('-latlon_fn', action='store', type=str, default=None,
                         help='Filename containing list of lat/lon tuples for running batches on spc')
+    parser.add_argument('-task_fp', action='store', type=str, default=None,
+                        help='Directory of the task ledger from which the processes claim the grid cells')
     parser.add_argument('-num_simultaneous_processes', action='store', type=int, default=4,
                         help='number of simultaneous processes (cores) to use')
     parser.add_argument('-option_parallels', action='store', type=int, default=1,
@@ -110,6 +149,20 @@ def getparser():
                         help='switch to keep lists ordered or not')
 #    parser.add_argument('-option_split_debris', action='store', type=int, default=1,
 #                        help='switch to split the debris thicknesses into separate lists for parallel MC simulations')
+    parser.add_argument('-option_vectorized', action='store', type=int, default=0,
+                        help=('Switch to run all MC simulations together as one vector (1) or one at a time (0); '
+                              'slower than (0) for small ensembles (4 times with 3 MC simulations)'))
+    parser.add_argument('-option_hd_lockstep', action='store', type=int, default=0,
+                        help='Switch to simulate all debris thicknesses together (1) or one at a time (0)')
+    parser.add_argument('-option_elev_lockstep', action='store', type=int, default=0,
+                        help='Switch to simulate all elevations together (1) or one at a time (0)')
+    parser.add_argument('-option_numba', action='store', type=int, default=0,
+                        help='Switch to use the compiled (Numba) energy balance model (1) or Python (0)')
+    parser.add_argument('-option_ts_solver', action='store', type=int, default=0,
+                        help=('Switch to use the warm-started, bracketed Newton solver for surface temperature (1); '
+                              'hourly surface temperatures differ from (0) by up to a few K'))
+    parser.add_argument('-option_ts_continuation', action='store', type=int, default=0,
+                        help='Switch to start the surface temperature from the previous debris thickness (1)')
     parser.add_argument('-debug', action='store', type=int, default=0,
                         help='Boolean for debugging to turn it on or off (default 0 is off')
     return parser 
@@ -132,10 +185,32 @@ def pickle_data(fn, data):
     """
     with open(fn, 'wb') as f:
         pickle.dump(data, f)
+
+
+# Output profiles: netcdf encoding of the simulation variables
+#  'default' applies to every variable unless the variable is listed; 'chunk_time' is the number of timesteps per chunk
+#  - archive: float64 with maximum compression (lossless)
+#  - fast: float32 with light compression for quick writes
+#  - analysis: surface temperature as int16 with 0.01 K resolution, other variables as float32, chunked in time
+ts_int16 = {'dtype': 'int16', 'scale_factor': 0.01, 'add_offset': 273.15, 'zlib': True, 'complevel': 4, 
+            'shuffle': True, 'chunk_time': debris_prms.output_chunk_time}
+ts_spread_int16 = {'dtype': 'int16', 'scale_factor': 0.01, 'add_offset': 0, 'zlib': True, 'complevel': 4,
+                   'shuffle': True, 'chunk_time': debris_prms.output_chunk_time}
+output_profiles = {
+        'archive': {'default': {'zlib': True, 'complevel': 9}},
+        'fast': {'default': {'dtype': 'float32', 'zlib': True, 'complevel': 1, 'shuffle': True}},
+        'analysis': {'default': {'dtype': 'float32', 'zlib': True, 'complevel': 4, 'shuffle': True, 
+                                 'chunk_time': debris_prms.output_chunk_time},
+                     'ts': ts_int16,
+                     'ts_med': ts_int16,
+                     'ts_std': ts_spread_int16,
+                     'ts_mad': ts_spread_int16}
+        }
+
         
 def create_xrdataset(debris_thickness_all=debris_prms.debris_thickness_all, time_values=None, 
                      elev_values=None, stat_cns=debris_prms.mc_stat_cns, 
-                     lat_deg=None, lon_deg=None, roi=debris_prms.roi):
+                     lat_deg=None, lon_deg=None, roi=debris_prms.roi, output_profile=debris_prms.output_profile):
     """
     Create empty xarray dataset that will be used to record simulation runs.
 
@@ -151,6 +226,8 @@ def create_xrdataset(debris_thickness_all=debris_prms.debris_thickness_all, time
         list of strings containing statistics that will be used on simulations
     record_stats : int
         Switch to change from recording simulations to statistics
+    output_profile : str
+        name of the output profile (see output_profiles) used for the encoding of the simulation variables
 
     Returns
     -------
@@ -258,6 +335,16 @@ def create_xrdataset(debris_thickness_all=debris_prms.debris_thickness_all, time
                             'zlib':True,
                             'complevel':9
                             }
+        # Simulation variables use the encoding of the output profile
+        if vn in output_coords_dict.keys():
+            profile = output_profiles[output_profile]
+            if vn in profile.keys():
+                encoding[vn] = profile[vn].copy()
+            else:
+                encoding[vn] = profile['default'].copy()
+            encoding[vn]['_FillValue'] = False
+            if 'chunk_time' in encoding[vn].keys():
+                encoding[vn]['chunksizes'] = (1, min(encoding[vn].pop('chunk_time'), len(time_values)), 1)
             
     # Add values    
     output_ds_all['latitude'] = lat_deg
@@ -440,15 +527,243 @@ def solar_calcs_NOAA(year, julian_day_of_year, time_frac, longitude_deg, latitud
     return SolarZenithAngleCorr_rad, SolarAzimuthAngle_rad, rm_r2
 
 
-def CrankNicholson(Td, Tair, i, debris_thickness, N, h, C, a_Crank, b_Crank, c_Crank, d_Crank, A_Crank, S_Crank):
+def solar_calcs_cached(year, julian_day_of_year, time_frac, longitude_deg, latitude_deg, nsteps, 
+                       start_date=debris_prms.start_date, end_date=debris_prms.end_date, 
+                       ephemeris_fp=debris_prms.ephemeris_fp):
+    """ Solar position and distance to sun from the ephemeris cache, computed with solar_calcs_NOAA if not cached
+
+    The cache is keyed by the grid cell (latitude, longitude) and the simulation period, so reruns and other 
+    experiments over the same period reuse the solar geometry.
+
+    Parameters
+    ----------
+    year, julian_day_of_year, time_frac, longitude_deg, latitude_deg, nsteps
+        see solar_calcs_NOAA
+    start_date, end_date : str
+        start and end date of the simulation period (YYYY-MM-DD)
+    ephemeris_fp : str
+        filepath of the ephemeris cache (None to not use the cache)
+
+    Returns
+    -------
+    SolarZenithAngleCorr_rad, SolarAzimuthAngle_rad, rm_r2 : np.array
+        see solar_calcs_NOAA
+    """
+    if ephemeris_fp is not None:
+        if latitude_deg < 0:
+            lat_str = 'S-'
+        else:
+            lat_str = 'N-'
+        ephemeris_fn = (str(int(np.abs(latitude_deg)*100)) + lat_str + str(int(longitude_deg*100)) + 'E-' + 
+                        start_date + '_' + end_date + '-ephemeris.npz')
+        if os.path.exists(ephemeris_fp + ephemeris_fn):
+            with np.load(ephemeris_fp + ephemeris_fn) as ephemeris:
+                if ephemeris['zenith_rad'].shape[0] == nsteps:
+                    return ephemeris['zenith_rad'], ephemeris['azimuth_rad'], ephemeris['rm_r2']
+
+    SolarZenithAngleCorr_rad, SolarAzimuthAngle_rad, rm_r2 = (
+            solar_calcs_NOAA(year, julian_day_of_year, time_frac, longitude_deg, latitude_deg, nsteps))
+
+    if ephemeris_fp is not None:
+        if not os.path.exists(ephemeris_fp):
+            os.makedirs(ephemeris_fp, exist_ok=True)
+        # write to a temporary file first, so parallel processes never read a partially written file
+        ephemeris_fn_tmp = ephemeris_fn.replace('.npz', '-' + str(os.getpid()) + '.tmp.npz')
+        np.savez(ephemeris_fp + ephemeris_fn_tmp, zenith_rad=SolarZenithAngleCorr_rad, 
+                 azimuth_rad=SolarAzimuthAngle_rad, rm_r2=rm_r2)
+        os.replace(ephemeris_fp + ephemeris_fn_tmp, ephemeris_fp + ephemeris_fn)
+
+    return SolarZenithAngleCorr_rad, SolarAzimuthAngle_rad, rm_r2
+
+
+def sim_windows_idx(time_pd, lat_deg, lon_deg, mb_yrfrac=debris_prms.mb_yrfrac_dict[debris_prms.roi], 
+                    ts_info_fullfn=debris_prms.ts_fp + debris_prms.roi + '_debris_tsinfo.nc',
+                    ts_days=debris_prms.sim_windows_ts_days, spinup_days=debris_prms.sim_windows_spinup_days):
+    """ Timesteps of the simulation period needed for the melt curves and surface temperature curves
+
+    The windows are the mass balance period (mb_yrfrac_dict, used to sum the melt of the "ostrem" curves) and the days
+    around the surface temperature acquisition (used by tscurves.py), each preceded by the spin-up. The windows are
+    whole days and are clipped to the simulation period. The timesteps between the windows are not simulated, so the
+    model state at the end of one window is the initial state of the next window's spin-up.
+
+    Parameters
+    ----------
+    time_pd : pd.DatetimeIndex
+        hourly timesteps of the simulation period (whole days)
+    lat_deg, lon_deg : float
+        latitude and longitude of the grid cell
+    mb_yrfrac : list
+        start and end of the mass balance period [year fraction]
+    ts_info_fullfn : str
+        filename of the surface temperature information (year, day of year, hour); the window is skipped if the
+        file does not exist or the grid cell has no surface temperature
+    ts_days : int
+        days before and after the surface temperature acquisition
+    spinup_days : int
+        spin-up [days] before each window
+
+    Returns
+    -------
+    sim_idx : np.array
+        indices of the timesteps to simulate
+    """
+    time_daily = time_pd[0::24].normalize()
+    sim_days = np.zeros(len(time_daily), dtype=bool)
+    windows = []
+    
+    # Mass balance period (nearest day consistent with the year fractions used with the "ostrem" curves)
+    time_daysperyear = np.array([366 if x%4 == 0 else 365 for x in time_daily.year])
+    time_yearfrac = time_daily.year + (time_daily.dayofyear-1) / time_daysperyear
+    windows.append([np.abs(time_yearfrac - mb_yrfrac[0]).argmin(), np.abs(time_yearfrac - mb_yrfrac[1]).argmin()])
+    
+    # Surface temperature acquisition (see tscurves.py)
+    if os.path.exists(ts_info_fullfn):
+        ds_ts_info = xr.open_dataset(ts_info_fullfn, decode_times=False)
+        lat_idx = np.abs(lat_deg - ds_ts_info['latitude'][:].values).argmin(axis=0)
+        lon_idx = np.abs(lon_deg - ds_ts_info['longitude'][:].values).argmin(axis=0)
+        ts_year = np.round(ds_ts_info['year_mean'][lat_idx,lon_idx].values,0)
+        ts_doy = np.round(ds_ts_info['doy_med'][lat_idx,lon_idx].values,0)
+        ds_ts_info.close()
+        if ts_year > 0 and ts_doy > 0:
+            ts_date = pd.to_datetime(str(int(ts_year)) + '-' + str(int(ts_doy)), format='%Y-%j')
+            ts_idx = (ts_date - time_daily[0]).days
+            # surface temperature is interpolated between hours, so one extra day after the window
+            windows.append([ts_idx - ts_days, ts_idx + ts_days + 1])
+    
+    for window in windows:
+        start_idx = np.max([window[0] - spinup_days, 0])
+        end_idx = np.min([window[1] + 1, len(time_daily)])
+        if start_idx < end_idx:
+            sim_days[start_idx:end_idx] = True
+            
+    return np.where(np.repeat(sim_days, 24))[0]
+
+
+def forcing_precompute(Tair_AWS, RH_AWS, Rain_AWS, lapserate, Elevation_pixel, Elev_AWS, Snow_AWS=None,
+                       option_snow_fromAWS=debris_prms.option_snow_fromAWS):
+    """ Forcing at the pixel elevation, which is the same for all debris thicknesses and Monte Carlo simulations
+
+    Parameters
+    ----------
+    Tair_AWS, RH_AWS, Rain_AWS : np.array
+        air temperature [K], relative humidity [-] and total precipitation [m] at the AWS for each timestep
+    lapserate : np.array
+        lapse rate [K m-1] for each timestep
+    Elevation_pixel, Elev_AWS : float
+        elevation of the pixel and the AWS [m]
+    Snow_AWS : np.array
+        snow depth from the AWS (only used if option_snow_fromAWS == 1)
+    option_snow_fromAWS : int
+        switch to use snow depth (1) instead of snow fall (0)
+
+    Returns
+    -------
+    P : float
+        pressure [Pa]
+    Tair : np.array
+        air temperature [K] at the pixel elevation
+    Rain : np.array
+        rain [m]
+    snow : np.array
+        snow fall [m w.e.] (or snow depth from AWS)
+    eZ : np.array
+        vapor pressure of the air [Pa]
+    density_air : np.array
+        density of air [kg m-3] based on pressure (elevation) and air temperature
+    """
+    # Pressure (barometric pressure formula)
+    P = debris_prms.P0*np.exp(-0.0289644*9.81*Elevation_pixel/(8.31447*288.15))
+    # Air temperature
+    Tair = Tair_AWS + lapserate*(Elevation_pixel-Elev_AWS)
+    # Snow [m]
+    Rain = Rain_AWS.copy()
+    if option_snow_fromAWS == 1:
+        if Snow_AWS is None:
+            print('\n\nNO SNOW DEPTH FROM AWS\n\n')
+            snow = np.zeros(Tair.shape)
+        else:
+            snow = Snow_AWS.copy()    
+    else:
+        snow = Rain_AWS.copy()
+        snow[Tair > debris_prms.Tsnow_threshold] = 0
+        snow[snow < debris_prms.snow_min] = 0
+        Rain[Tair <= debris_prms.Tsnow_threshold] = 0
+        Rain[Rain < debris_prms.rain_min] = 0
+    # Vapor pressure (e, Pa) computed using Clasius-Clapeyron Equation and Relative Humidity
+    #  611 is the vapor pressure of ice and liquid water at melting temperature (273.15 K)
+    eZ_Saturated = 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Tair - 1 / 273.15))
+    eZ = RH_AWS * eZ_Saturated
+    # Density of air (dry) based on pressure (elevation) and temperature
+    #  used in snow calculations, which has different parameterization of turbulent fluxes compared to the debris
+    density_air = P / (287.058 * Tair)
+    return P, Tair, Rain, snow, eZ, density_air
+
+
+def load_metdata(lat_deg, lon_deg, time_pd):
+    """ Meteorological data of a grid cell for the timesteps of time_pd, processed as in main (used by the scripts that
+    evaluate the model outside of main, e.g., meltmodel_emulator.py and mc_convergence.py)
+
+    Returns
+    -------
+    Tair_AWS, RH_AWS, u_AWS_raw, Rain_AWS, Sin_AWS, Lin_AWS : np.array
+        air temperature [K], relative humidity [-], wind speed [m s-1], total precipitation [m] and incoming 
+        shortwave and longwave radiation [W m-2] for each timestep
+    Elev_AWS : float
+        elevation of the meteorological data [m]
+    lapserate : np.array
+        lapse rate [K m-1] for each timestep
+    dc_zmean : float
+        mean elevation of the debris cover [m]
+    """
+    if lat_deg < 0:
+        lat_str = 'S-'
+    else:
+        lat_str = 'N-' 
+    metdata_fn = debris_prms.metdata_fn_sample.replace('XXXX', str(int(np.abs(lat_deg)*100)) + lat_str + 
+                                                         str(int(lon_deg*100)) + 'E-')
+    with xr.open_dataset(debris_prms.metdata_fp + metdata_fn) as ds:
+        time_idx = np.where(np.isin(pd.to_datetime(ds.time.values), time_pd))[0]
+        assert len(time_idx) == len(time_pd), 'meteorological data does not cover the timesteps'
+        Tair_AWS = ds['t2m'].values[time_idx]
+        RH_AWS = ds['rh'].values[time_idx] / 100
+        RH_AWS[RH_AWS<0] = 0
+        RH_AWS[RH_AWS>1] = 1
+        u_AWS_raw = (ds['u10'].values[time_idx]**2 + ds['v10'].values[time_idx]**2)**0.5
+        Rain_AWS = ds['tp'].values[time_idx]
+        Sin_AWS = ds['ssrd'].values[time_idx] / 3600
+        Sin_AWS[Sin_AWS < 0.1] = 0 
+        Lin_AWS = ds['strd'].values[time_idx] / 3600
+        Elev_AWS = ds['z'].values
+        dc_zmean = ds['dc_zmean'].values
+    
+    # Lapse rate (monthly)
+    if debris_prms.option_lr_fromdata == 1:
+        with xr.open_dataset(debris_prms.metdata_lr_fullfn) as ds_lr:
+            lat_idx = np.abs(lat_deg - ds_lr['latitude'].values).argmin()
+            lon_idx = np.abs(lon_deg - ds_lr['longitude'].values).argmin()
+            lr_time_pd = pd.to_datetime(ds_lr.time.values)
+            lr_monthly_dict = dict(zip(zip(lr_time_pd.year, lr_time_pd.month), 
+                                       ds_lr['lapserate'][:,lat_idx,lon_idx].values))
+        lapserate = np.array([lr_monthly_dict[x] for x in zip(time_pd.year, time_pd.month)])
+    else:
+        lapserate = np.zeros(Tair_AWS.shape) + debris_prms.lapserate
+    lapserate[lapserate < -0.009] = -0.009
+    lapserate[lapserate > -0.003] = -0.003
+    return Tair_AWS, RH_AWS, u_AWS_raw, Rain_AWS, Sin_AWS, Lin_AWS, Elev_AWS, lapserate, dc_zmean
+
+
+def CrankNicholson(Td, Td_past, i, debris_thickness, N, h, C, A_Crank, S_Crank):
     """ Run Crank-Nicholson scheme to obtain debris temperature
 
+    Only the current and previous debris temperature profiles are needed, so the tridiagonal system is solved in place
+    (Thomas algorithm) using work arrays of length N that are reused every timestep.
+
     Parameters
     ----------
     Td : np.array
-        debris temperature [k] (rows = internal layers, columns = timestep)
-    Tair : np.array
-        air temperature [K]
+        debris temperature [K] for timestep i (rows = internal layers); surface and base must already be set
+    Td_past : np.array
+        debris temperature [K] for timestep i-1 (rows = internal layers)
     i : int
         step number
     debris_thickness : float
@@ -459,61 +774,336 @@ def CrankNicholson(Td, Tair, i, debris_thickness, N, h, C, a_Crank, b_Crank, c_C
         height of debris layers [m]
     C : float
         constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme
-    a_Crank,
+    A_Crank, S_Crank : np.array
+        work arrays of length N for the forward sweep (overwritten)
 
     Returns
     -------
     Td : np.array
-        updated debris temperature [k] (rows = internal layers, columns = timestep)
+        updated debris temperature [K] for timestep i (rows = internal layers)
     """
     # Calculate temperature profile in the debris
     # For t = 0, which is i = 1, assume initial condition of linear temperature profile in the debris
     if i == 0:
-        Td_gradient = (Td[0,0] - Td[N-1,0])/debris_thickness
+        Td_gradient = (Td[0] - Td[N-1])/debris_thickness
 
         # CODE IMPROVEMENT HERE: TD CALCULATION SKIPPED ONE
         for j in np.arange(1,N-1):
-            Td[j,0] = Td[0,0] - (j*h)*Td_gradient
+            Td[j] = Td[0] - (j*h)*Td_gradient
 
     else:
+        # Equations A8 in Reid and Brock (2010)
+        a_Crank = C
+        b_Crank = 2*C+1
+        c_Crank = C
+        
         # Perform Crank-Nicholson Scheme
         for j in np.arange(1,N-1):
-            # Equations A8 in Reid and Brock (2010)
-            a_Crank[j,i] = C
-            b_Crank[j,i] = 2*C+1
-            c_Crank[j,i] = C
-
             # Equations A9 in Reid and Brock (2010)
             if j == 1:
-                d_Crank[j,i] = C*Td[0,i] + C*Td[0,i-1] + (1-2*C)*Td[j,i-1] + C*Td[j+1,i-1]
+                d_Crank = C*Td[0] + C*Td_past[0] + (1-2*C)*Td_past[j] + C*Td_past[j+1]
             elif j < (N-2):
-                d_Crank[j,i] = C*Td[j-1,i-1] + (1-2*C)*Td[j,i-1] + C*Td[j+1,i-1]
+                d_Crank = C*Td_past[j-1] + (1-2*C)*Td_past[j] + C*Td_past[j+1]
             elif j == (N-2):
-                d_Crank[j,i] = 2*C*Td[N-1,i] + C*Td[N-3,i-1] + (1-2*C)*Td[N-2,i-1]
+                d_Crank = 2*C*Td[N-1] + C*Td_past[N-3] + (1-2*C)*Td_past[N-2]
             # note notation:
-            #  "i-1" refers to the past
+            #  "past" refers to timestep i-1
             #  "j-1" refers to the cell above it
             #  "j+1" refers to the cell below it
 
-
             # Equations A10 and A11 in Reid and Brock (2010)
             if j == 1:
-                A_Crank[j,i] = b_Crank[j,i]
-                S_Crank[j,i] = d_Crank[j,i]
+                A_Crank[j] = b_Crank
+                S_Crank[j] = d_Crank
             else:
-                A_Crank[j,i] = b_Crank[j,i] - a_Crank[j,i] / A_Crank[j-1,i] * c_Crank[j-1,i]
-                S_Crank[j,i] = d_Crank[j,i] + a_Crank[j,i] / A_Crank[j-1,i] * S_Crank[j-1,i]
+                A_Crank[j] = b_Crank - a_Crank / A_Crank[j-1] * c_Crank
+                S_Crank[j] = d_Crank + a_Crank / A_Crank[j-1] * S_Crank[j-1]
 
         # Equations A12 in Reid and Brock (2010)
         for j in np.arange(N-2,0,-1):
             if j == (N-2):
-                Td[j,i] = S_Crank[j,i] / A_Crank[j,i]
+                Td[j] = S_Crank[j] / A_Crank[j]
             else:
-                Td[j,i] = 1 / A_Crank[j,i] * (S_Crank[j,i] + c_Crank[j,i] * Td[j+1,i])
+                Td[j] = 1 / A_Crank[j] * (S_Crank[j] + c_Crank * Td[j+1])
     return Td
 
 
-def calc_surface_fluxes(Td_i, Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, P, Albedo, k,
+def ConductionStep(Td, Td_past, Ts_mean, debris_thickness, N, h, C_step, k, A_Crank, S_Crank):
+    """ Conduction step of the debris decoupled from the surface (see debris_layers.py)
+
+    The debris below the surface is updated from Td_past with the mean surface temperature of the step (Ts_mean) and
+    a diffusion number of the length of the step (C_step); the surface temperature of Td is not changed.
+
+    Returns
+    -------
+    Td : np.array
+        updated debris temperature [K] at the end of the step (rows = internal layers)
+    Qc_ice : float
+        mean conductive heat flux into the ice over the step [W m-2] (trapezoid of the start and end of the step)
+    """
+    Qc_ice_start = max(k * (Td_past[N-2] - Td_past[N-1]) / h, 0)
+    Ts_i = Td[0]
+    Td[0] = Ts_mean
+    Td_past[0] = Ts_mean
+    Td = CrankNicholson(Td, Td_past, 1, debris_thickness, N, h, C_step, A_Crank, S_Crank)
+    Td[0] = Ts_i
+    Qc_ice = (Qc_ice_start + max(k * (Td[N-2] - Td[N-1]) / h, 0)) / 2
+    return Td, Qc_ice
+
+
+def calc_snowpack(Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, density_air_i, Albedo, k, dsnow_t0,
+                  tsnow_t0, snow_tau_t0, ill_angle_rad_i, a_neutral_snow, debris_thickness):
+    """ Snowpack fluxes and properties of timestep i that do not depend on the debris temperature
+
+    Snow model of calc_surface_fluxes (snow depth based on snow fall). Computed once per timestep, since only the
+    heat flux between the debris and the snow changes with the surface temperature (see calc_surface_fluxes_snow).
+
+    Parameters
+    ----------
+    see calc_surface_fluxes
+
+    Returns
+    -------
+    snowpack : tuple
+        snow depth [mwe], temperature and non-dimensional age before melt, thermal conductivity at the debris/snow
+        interface, net energy from the atmosphere [W m-2], snow sublimation [mwe], cold content of the snow [W m-2] 
+        and max energy spent cooling the snowpack [W m-2]
+    """
+    # Snow depth [m w.e.]
+    dsnow_i = dsnow_t0 + snow_i
+    snow_tau_i = snow_tau_t0
+    tsnow_i = (dsnow_t0 * tsnow_t0 + snow_i * Tair_i) / dsnow_i
+
+    # Thermal conductivity at debris/snow interface assuming conductance resistance is additive
+    #  estimating the heat transfer through dsnow_eff layer of snow and h_eff layer of debris
+    # Tarboten and Luce (1996) use effective soil depth of 0.4 m for computing the ground heat transfer
+    if debris_thickness < 0.4:
+        h_eff = debris_thickness
+    else:
+        h_eff = 0.4
+    if dsnow_i < 0.4:
+        dsnow_eff = dsnow_i
+    else:
+        dsnow_eff = 0.4
+    k_snow_interface = (h_eff + dsnow_eff) / (dsnow_eff/debris_prms.k_snow + h_eff/k)
+    # Previously estimating it based on equal parts
+    #k_snow_interface = h / ((0.5 * h) / debris_prms.k_snow + (0.5*h) / k)
+
+    # Albedo
+    # parameters representing grain growth due to vapor diffusion (r1), additional effect near
+    #  and at freezing point due to melt and refreeze (r2), and the effect of dirt and soot (r3)
+    snow_r1 = np.exp(5000 * (1 / 273.16 - 1 / tsnow_i))
+    snow_r2 = min(snow_r1**10, 1)
+    snow_r3 = 0.03 # change to 0.01 if in Antarctica
+    # change in non-dimensional snow surface age
+    snow_tau_i += (snow_r1 + snow_r2 + snow_r3) / debris_prms.snow_tau_0 * debris_prms.delta_t
+    # new snow affect on snow age
+    if snow_i > 0.01:
+        snow_tau_i = 0
+    elif snow_i > 0:
+        snow_tau_i = snow_tau_i * (1 - 100 * snow_i)
+    # snow age
+    snow_age = snow_tau_i / (1 + snow_tau_i)
+    # albedo as a function of snow age and band
+    albedo_vd = (1 - debris_prms.snow_c_v * snow_age) * debris_prms.albedo_vo
+    albedo_ird = (1 - debris_prms.snow_c_ir * snow_age) * debris_prms.albedo_iro
+    # increase in albedo based on illumination angle
+    #  illumination angle measured relative to the surface normal
+    if np.cos(ill_angle_rad_i) < 0.5:
+        b_ill = 2
+        f_psi = 1/b_ill * ((1 + b_ill) / (1 + 2 * b_ill * np.cos(ill_angle_rad_i)) - 1)
+    else:
+        f_psi = 0
+    albedo_v = albedo_vd + 0.4 * f_psi * (1 - albedo_vd)
+    albedo_ir = albedo_ird + 0.4 * f_psi * (1 - albedo_ird)
+    albedo_snow = (albedo_v + albedo_ir) / 2
+    # Adjustments to albedo
+    # ensure albedo is within bounds
+    if albedo_snow > 0.9:
+        albedo_snow = 0.9
+    elif albedo_snow < 0:
+        albedo_snow = 0
+    # if snow less than 0.1 m, then underlying debris influences albedo
+    if dsnow_i < 0.1:
+        r_adj = (1 - dsnow_i/0.1)*np.exp(dsnow_i / (2*0.1))
+        albedo_snow = r_adj * Albedo + (1 - r_adj) * albedo_snow
+
+    # Snow Energy Balance
+    Rn_snow = (Sin_i * (1 - albedo_snow) + debris_prms.emissivity_snow * (Lin_AWS_i -
+               (debris_prms.stefan_boltzmann * tsnow_i**4)))
+    H_snow = a_neutral_snow * density_air_i * debris_prms.cA * u_AWS_i * (Tair_i - tsnow_i)
+    # Vapor pressure above snow assumed to be saturated
+    eZ = eZ_i
+    # Vapor pressure of snow based on temperature (Colbeck, 1990)
+    e_snow = debris_prms.eS_snow * np.exp(2838 * (tsnow_i - 273.15) / (0.4619 * tsnow_i * 273.15))
+    if e_snow > debris_prms.eS_snow:
+        e_snow = debris_prms.eS_snow
+    LE_snow = 0.622 * debris_prms.Ls / (debris_prms.Rd * Tair_i) * a_neutral_snow * u_AWS_i * (eZ - e_snow)
+    Pflux_snow = (Rain_AWS_i * (debris_prms.Lf * debris_prms.density_water + debris_prms.cW * 
+                                debris_prms.density_water *
+                                (max(273.15, Tair_i) - 273.15)) / debris_prms.delta_t)
+
+    # Net energy available for snow from the atmosphere depends on latent heat flux
+    # if Positive LE: Air > snow vapor pressure (condensation/resublimation)
+    #  energy released and available to melt the snow (include LE in net energy)
+    if LE_snow > 0:
+        Fnet_snow_air = Rn_snow + H_snow + LE_snow + Pflux_snow
+        snow_sublimation = 0
+    # if Negative LE: Air < snow vapor pressure (sublimation/evaporation)
+    #  energy consumed and snow sublimates (do not include LE in net energy)
+    else:
+        Fnet_snow_air = Rn_snow + H_snow + Pflux_snow
+        # Snow sublimation [m w.e.]
+        snow_sublimation = -1 * LE_snow / (debris_prms.density_water * debris_prms.Lv) * debris_prms.delta_t
+
+    # Cold content of snow [W m2]
+    Qcc_snow = debris_prms.cSnow * debris_prms.density_water * dsnow_i * (273.15 - tsnow_i) / debris_prms.delta_t
+
+    # Max energy spent cooling snowpack based on 1 degree temperature change
+    Qcc_snow_neg1 = -1 * debris_prms.cSnow * debris_prms.density_water * dsnow_i / debris_prms.delta_t
+
+    return (dsnow_i, tsnow_i, snow_tau_i, k_snow_interface, Fnet_snow_air, snow_sublimation, Qcc_snow,
+            Qcc_snow_neg1)
+
+
+def calc_surface_fluxes_snow(Td_i, snowpack, k, h):
+    """ Calculate surface energy fluxes for timestep i when the debris is covered by snow
+
+    Parameters
+    ----------
+    Td_i : np.array
+        debris temperature
+    snowpack : tuple
+        snowpack fluxes and properties of the timestep from calc_snowpack
+    k : float
+        debris thermal conductivity
+    h : float
+        debris layer height [m]
+
+    Returns
+    -------
+    see calc_surface_fluxes
+    """
+    (dsnow_i, tsnow_i, snow_tau_i, k_snow_interface, Fnet_snow_air, snow_sublimation, Qcc_snow,
+     Qcc_snow_neg1) = snowpack
+    Qc_snow_debris = k_snow_interface * (Td_i[0] - tsnow_i)/h
+    Fnet_snow = Fnet_snow_air + Qc_snow_debris
+
+    # If Fnet_snow is positive and greater than cold content, then energy is going to warm the
+    # snowpack to melting point and begin melting the snow.
+    if Fnet_snow > Qcc_snow:
+        # Snow warmed up to melting temperature
+        tsnow_i = 273.15
+        Fnet_snow -= Qcc_snow
+        Fnet_snow2debris = 0
+        
+    elif Fnet_snow < Qcc_snow_neg1:
+        # Otherwise only changes the temperature in the snowpack and the debris
+        # limit the change in snow temperature
+        tsnow_i -= 1
+        # Remaining energy goes to cool down the debris
+        Fnet_snow2debris = Fnet_snow - Qcc_snow_neg1
+        Fnet_snow = 0   
+        
+        # Set maximum energy to cool debris top layer by 1 degree
+        #  otherwise, this can become very unstable since the turbulent heat fluxes are set by the snow surfaces
+        Fnet_snow2debris_max = -1* debris_prms.c_d * debris_prms.row_d * h / debris_prms.delta_t
+        if Fnet_snow2debris < Fnet_snow2debris_max:
+            Fnet_snow2debris = Fnet_snow2debris_max
+
+    else:
+        # Otherwise only changes the temperature
+        tsnow_i += Fnet_snow / (debris_prms.cSnow * debris_prms.density_water * dsnow_i) * debris_prms.delta_t
+        Fnet_snow = 0
+        Fnet_snow2debris = 0
+
+    # Snow melt [m snow] with remaining energy, if any
+    snow_melt_energy = Fnet_snow / (debris_prms.density_water * debris_prms.Lf) * debris_prms.delta_t
+
+    # Total snow melt
+    snow_melt = snow_melt_energy + snow_sublimation
+
+    # Snow depth [m w.e.]
+    dsnow_i -= snow_melt
+    if dsnow_i < 0:
+        dsnow_i = 0
+    if dsnow_i == 0:
+        snow_tau_i = 0
+
+    # Solve for temperature in debris        
+    #  Rn, LE, H, and P equal 0
+    Rn_i = 0
+    LE_i = 0
+    H_i = 0
+    Qc_i = k * (Td_i[1] - Td_i[0]) / h
+    P_flux_i = 0
+    Qc_snow_i = -Qc_snow_debris
+    
+    F_Ts_i = Rn_i + LE_i + H_i + Qc_i + P_flux_i + Qc_snow_i  + Fnet_snow2debris
+
+    dRn_i = 0
+    dLE_i = 0
+    dH_i = 0
+    dQc_i = -k/h
+    dP_flux_i = 0
+    dQc_snow_i = -k_snow_interface/h
+    dF_Ts_i = dRn_i + dLE_i + dH_i + dQc_i + dP_flux_i + dQc_snow_i
+
+    return (F_Ts_i, Rn_i, LE_i, H_i, P_flux_i, Qc_i, dF_Ts_i, dRn_i, dLE_i, dH_i, dP_flux_i, dQc_i,
+            dsnow_i, tsnow_i, snow_tau_i)
+
+
+def calc_surface_fluxes_debris(Td_i, Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, P, Albedo, k,
+                               a_neutral_debris, h):
+    """ Calculate surface energy fluxes for timestep i when the debris is not covered by snow
+
+    Parameters
+    ----------
+    see calc_surface_fluxes
+
+    Returns
+    -------
+    F_Ts_i, Rn_i, LE_i, H_i, P_flux_i, Qc_i : floats
+        Energy fluxes [W m-2]
+    dF_Ts_i, dRn_i, dLE_i, dH_i, dP_flux_i, dQc_i : floats
+        Derivatives of energy fluxes
+    """
+
+    if Rain_AWS_i > 0:
+        # Vapor pressure (e, Pa) computed using Clasius-Clapeyron Equation and Relative Humidity
+        #  611 is the vapor pressure of ice and liquid water at melting temperature (273.15 K)
+        # if raining, assume the surface is saturated
+        eS_Saturated = 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Td_i[0] - 1 / 273.15))
+        eS = eS_Saturated
+        eZ = eZ_i
+        LE_i = (0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * a_neutral_debris * u_AWS_i
+                * (eZ -eS))
+    else:
+        LE_i = 0
+    Rn_i = Sin_i * (1 - Albedo) + debris_prms.emissivity * (Lin_AWS_i - (5.67e-8 * Td_i[0]**4))
+    H_i = (debris_prms.density_air_0 * (P / debris_prms.P0) * debris_prms.cA * a_neutral_debris * u_AWS_i *
+           (Tair_i - Td_i[0]))
+    P_flux_i = debris_prms.density_water * debris_prms.cW * Rain_AWS_i / debris_prms.delta_t * (Tair_i - Td_i[0])
+    Qc_i = k * (Td_i[1] - Td_i[0]) / h
+    F_Ts_i = Rn_i + LE_i + H_i + Qc_i + P_flux_i
+
+    # Derivatives
+    if Rain_AWS_i > 0:
+        dLE_i = (-0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * a_neutral_debris *
+                 u_AWS_i * 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Td_i[0] - 1 / 273.15))
+                 * (debris_prms.Lv / debris_prms.R_const * Td_i[0]**-2))
+    else:
+        dLE_i = 0
+    dRn_i = -4 * debris_prms.emissivity * 5.67e-8 * Td_i[0]**3
+    dH_i = -1 * debris_prms.density_air_0 * P / debris_prms.P0 * debris_prms.cA * a_neutral_debris * u_AWS_i
+    dP_flux_i = -debris_prms.density_water * debris_prms.cW * Rain_AWS_i/ debris_prms.delta_t
+    dQc_i = -k / h
+    dF_Ts_i = dRn_i + dLE_i + dH_i + dQc_i + dP_flux_i
+
+    return F_Ts_i, Rn_i, LE_i, H_i, P_flux_i, Qc_i, dF_Ts_i, dRn_i, dLE_i, dH_i, dP_flux_i, dQc_i
+
+
+def calc_surface_fluxes(Td_i, Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, P, density_air_i, Albedo, k,
                         a_neutral_debris, h, dsnow_t0, tsnow_t0, snow_tau_t0, ill_angle_rad_i, a_neutral_snow,
                         debris_thickness,
                         option_snow=0, option_snow_fromAWS=0, i_step=None):
@@ -550,10 +1140,14 @@ def calc_surface_fluxes(Td_i, Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_
     ----------
     Td_i : np.array
         debris temperature
-    Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i : floats
+    Tair_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i : floats
         meteorological data
+    eZ_i : float
+        vapor pressure of the air [Pa] (see forcing_precompute)
     P : float
         pressure [Pa]
+    density_air_i : float
+        density of air [kg m-3] based on pressure and air temperature (see forcing_precompute)
     Albedo, k, a_neutral_debris : floats
         debris albedo, thermal conductivity, and turbulent heat flux transfer coefficient (from surface roughness)
     h : float
@@ -589,164 +1183,11 @@ def calc_surface_fluxes(Td_i, Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_
 
     # First option: Snow depth is based on snow fall, so need to melt snow
     if dsnow_i > 0 and option_snow==1 and option_snow_fromAWS == 0:
-        tsnow_i = (dsnow_t0 * tsnow_t0 + snow_i * Tair_i) / dsnow_i
-
-        # Thermal conductivity at debris/snow interface assuming conductance resistance is additive
-        #  estimating the heat transfer through dsnow_eff layer of snow and h_eff layer of debris
-        # Tarboten and Luce (1996) use effective soil depth of 0.4 m for computing the ground heat transfer
-        if debris_thickness < 0.4:
-            h_eff = debris_thickness
-        else:
-            h_eff = 0.4
-        if dsnow_i < 0.4:
-            dsnow_eff = dsnow_i
-        else:
-            dsnow_eff = 0.4
-        k_snow_interface = (h_eff + dsnow_eff) / (dsnow_eff/debris_prms.k_snow + h_eff/k)
-        # Previously estimating it based on equal parts
-        #k_snow_interface = h / ((0.5 * h) / debris_prms.k_snow + (0.5*h) / k)
-
-        # Density of air (dry) based on pressure (elevation) and temperature
-        #  used in snow calculations, which has different parameterization of turbulent fluxes
-        #  compared to the debris
-        density_air = P / (287.058 * Tair_i)
-
-        # Albedo
-        # parameters representing grain growth due to vapor diffusion (r1), additional effect near
-        #  and at freezing point due to melt and refreeze (r2), and the effect of dirt and soot (r3)
-        snow_r1 = np.exp(5000 * (1 / 273.16 - 1 / tsnow_i))
-        snow_r2 = np.min([snow_r1**10, 1])
-        snow_r3 = 0.03 # change to 0.01 if in Antarctica
-        # change in non-dimensional snow surface age
-        snow_tau_i += (snow_r1 + snow_r2 + snow_r3) / debris_prms.snow_tau_0 * debris_prms.delta_t
-        # new snow affect on snow age
-        if snow_i > 0.01:
-            snow_tau_i = 0
-        elif snow_i > 0:
-            snow_tau_i = snow_tau_i * (1 - 100 * snow_i)
-        # snow age
-        snow_age = snow_tau_i / (1 + snow_tau_i)
-        # albedo as a function of snow age and band
-        albedo_vd = (1 - debris_prms.snow_c_v * snow_age) * debris_prms.albedo_vo
-        albedo_ird = (1 - debris_prms.snow_c_ir * snow_age) * debris_prms.albedo_iro
-        # increase in albedo based on illumination angle
-        #  illumination angle measured relative to the surface normal
-        if np.cos(ill_angle_rad_i) < 0.5:
-            b_ill = 2
-            f_psi = 1/b_ill * ((1 + b_ill) / (1 + 2 * b_ill * np.cos(ill_angle_rad_i)) - 1)
-        else:
-            f_psi = 0
-        albedo_v = albedo_vd + 0.4 * f_psi * (1 - albedo_vd)
-        albedo_ir = albedo_ird + 0.4 * f_psi * (1 - albedo_ird)
-        albedo_snow = np.mean([albedo_v, albedo_ir])
-        # Adjustments to albedo
-        # ensure albedo is within bounds
-        if albedo_snow > 0.9:
-            albedo_snow = 0.9
-        elif albedo_snow < 0:
-            albedo_snow = 0
-        # if snow less than 0.1 m, then underlying debris influences albedo
-        if dsnow_i < 0.1:
-            r_adj = (1 - dsnow_i/0.1)*np.exp(dsnow_i / (2*0.1))
-            albedo_snow = r_adj * Albedo + (1 - r_adj) * albedo_snow
-
-        # Snow Energy Balance
-        Rn_snow = (Sin_i * (1 - albedo_snow) + debris_prms.emissivity_snow * (Lin_AWS_i -
-                   (debris_prms.stefan_boltzmann * tsnow_i**4)))
-        H_snow = a_neutral_snow * density_air * debris_prms.cA * u_AWS_i * (Tair_i - tsnow_i)
-        # Vapor pressure above snow assumed to be saturated
-        # Vapor pressure (e, Pa) computed using Clasius-Clapeyron Equation and Relative Humidity
-        #  611 is the vapor pressure of ice and liquid water at melting temperature (273.15 K)
-        eZ_Saturated = 611 * np.exp(debris_prms.Lv / debris_prms.R_const * (1 / 273.15 - 1 / Tair_i))
-        eZ = RH_AWS_i * eZ_Saturated
-        # Vapor pressure of snow based on temperature (Colbeck, 1990)
-        e_snow = debris_prms.eS_snow * np.exp(2838 * (tsnow_i - 273.15) / (0.4619 * tsnow_i * 273.15))
-        if e_snow > debris_prms.eS_snow:
-            e_snow = debris_prms.eS_snow
-        LE_snow = 0.622 * debris_prms.Ls / (debris_prms.Rd * Tair_i) * a_neutral_snow * u_AWS_i * (eZ - e_snow)
-        Pflux_snow = (Rain_AWS_i * (debris_prms.Lf * debris_prms.density_water + debris_prms.cW * 
-                                    debris_prms.density_water *
-                                    (np.max([273.15, Tair_i]) - 273.15)) / debris_prms.delta_t)
-        Qc_snow_debris = k_snow_interface * (Td_i[0] - tsnow_i)/h
-
-        # Net energy available for snow depends on latent heat flux
-        # if Positive LE: Air > snow vapor pressure (condensation/resublimation)
-        #  energy released and available to melt the snow (include LE in net energy)
-        if LE_snow > 0:
-            Fnet_snow = Rn_snow + H_snow + LE_snow + Pflux_snow + Qc_snow_debris
-            snow_sublimation = 0
-        # if Negative LE: Air < snow vapor pressure (sublimation/evaporation)
-        #  energy consumed and snow sublimates (do not include LE in net energy)
-        else:
-            Fnet_snow = Rn_snow + H_snow + Pflux_snow + Qc_snow_debris
-            # Snow sublimation [m w.e.]
-            snow_sublimation = -1 * LE_snow / (debris_prms.density_water * debris_prms.Lv) * debris_prms.delta_t
-
-        # Cold content of snow [W m2]
-        Qcc_snow = debris_prms.cSnow * debris_prms.density_water * dsnow_i * (273.15 - tsnow_i) / debris_prms.delta_t
-
-        # Max energy spent cooling snowpack based on 1 degree temperature change
-        Qcc_snow_neg1 = -1 * debris_prms.cSnow * debris_prms.density_water * dsnow_i / debris_prms.delta_t
-
-        # If Fnet_snow is positive and greater than cold content, then energy is going to warm the
-        # snowpack to melting point and begin melting the snow.
-        if Fnet_snow > Qcc_snow:
-            # Snow warmed up to melting temperature
-            tsnow_i = 273.15
-            Fnet_snow -= Qcc_snow
-            Fnet_snow2debris = 0
-            
-        elif Fnet_snow < Qcc_snow_neg1:
-            # Otherwise only changes the temperature in the snowpack and the debris
-            # limit the change in snow temperature
-            tsnow_i -= 1
-            # Remaining energy goes to cool down the debris
-            Fnet_snow2debris = Fnet_snow - Qcc_snow_neg1
-            Fnet_snow = 0   
-            
-            # Set maximum energy to cool debris top layer by 1 degree
-            #  otherwise, this can become very unstable since the turbulent heat fluxes are set by the snow surfaces
-            Fnet_snow2debris_max = -1* debris_prms.c_d * debris_prms.row_d * h / debris_prms.delta_t
-            if Fnet_snow2debris < Fnet_snow2debris_max:
-                Fnet_snow2debris = Fnet_snow2debris_max
-
-        else:
-            # Otherwise only changes the temperature
-            tsnow_i += Fnet_snow / (debris_prms.cSnow * debris_prms.density_water * dsnow_i) * debris_prms.delta_t
-            Fnet_snow = 0
-            Fnet_snow2debris = 0
-
-        # Snow melt [m snow] with remaining energy, if any
-        snow_melt_energy = Fnet_snow / (debris_prms.density_water * debris_prms.Lf) * debris_prms.delta_t
+        snowpack = calc_snowpack(Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, density_air_i, Albedo, k,
+                                 dsnow_t0, tsnow_t0, snow_tau_t0, ill_angle_rad_i, a_neutral_snow, debris_thickness)
+        (F_Ts_i, Rn_i, LE_i, H_i, P_flux_i, Qc_i, dF_Ts_i, dRn_i, dLE_i, dH_i, dP_flux_i, dQc_i,
+         dsnow_i, tsnow_i, snow_tau_i) = calc_surface_fluxes_snow(Td_i, snowpack, k, h)
 
-        # Total snow melt
-        snow_melt = snow_melt_energy + snow_sublimation
-
-        # Snow depth [m w.e.]
-        dsnow_i -= snow_melt
-        if dsnow_i < 0:
-            dsnow_i = 0
-        if dsnow_i == 0:
-            snow_tau_i = 0
-
-        # Solve for temperature in debris        
-        #  Rn, LE, H, and P equal 0
-        Rn_i = 0
-        LE_i = 0
-        H_i = 0
-        Qc_i = k * (Td_i[1] - Td_i[0]) / h
-        P_flux_i = 0
-        Qc_snow_i = -Qc_snow_debris
-        
-        F_Ts_i = Rn_i + LE_i + H_i + Qc_i + P_flux_i + Qc_snow_i  + Fnet_snow2debris
-
-        dRn_i = 0
-        dLE_i = 0
-        dH_i = 0
-        dQc_i = -k/h
-        dP_flux_i = 0
-        dQc_snow_i = -k_snow_interface/h
-        dF_Ts_i = dRn_i + dLE_i + dH_i + dQc_i + dP_flux_i + dQc_snow_i
 
     # Second option: Snow depth is prescribed from AWS, so don't need to melt snow
     elif dsnow_i > 0 and option_snow==1 and option_snow_fromAWS == 1:
@@ -791,43 +1232,16 @@ def calc_surface_fluxes(Td_i, Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_
 
     else:
         # Debris-covered glacier Energy Balance (no snow)
-        if Rain_AWS_i > 0:
-            # Vapor pressure (e, Pa) computed using Clasius-Clapeyron Equation and Relative Humidity
-            #  611 is the vapor pressure of ice and liquid water at melting temperature (273.15 K)
-            # if raining, assume the surface is saturated
-            eS_Saturated = 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Td_i[0] - 1 / 273.15))
-            eS = eS_Saturated
-            eZ_Saturated = 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Tair_i - 1 / 273.15))
-            eZ = RH_AWS_i * eZ_Saturated
-            LE_i = (0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * a_neutral_debris * u_AWS_i
-                    * (eZ -eS))
-        else:
-            LE_i = 0
-        Rn_i = Sin_i * (1 - Albedo) + debris_prms.emissivity * (Lin_AWS_i - (5.67e-8 * Td_i[0]**4))
-        H_i = (debris_prms.density_air_0 * (P / debris_prms.P0) * debris_prms.cA * a_neutral_debris * u_AWS_i *
-               (Tair_i - Td_i[0]))
-        P_flux_i = debris_prms.density_water * debris_prms.cW * Rain_AWS_i / debris_prms.delta_t * (Tair_i - Td_i[0])
-        Qc_i = k * (Td_i[1] - Td_i[0]) / h
-        F_Ts_i = Rn_i + LE_i + H_i + Qc_i + P_flux_i
+        (F_Ts_i, Rn_i, LE_i, H_i, P_flux_i, Qc_i, dF_Ts_i, dRn_i, dLE_i, dH_i, dP_flux_i, dQc_i) = (
+                calc_surface_fluxes_debris(Td_i, Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, P, Albedo, k,
+                                           a_neutral_debris, h))
 
-        # Derivatives
-        if Rain_AWS_i > 0:
-            dLE_i = (-0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * a_neutral_debris *
-                     u_AWS_i * 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Td_i[0] - 1 / 273.15))
-                     * (debris_prms.Lv / debris_prms.R_const * Td_i[0]**-2))
-        else:
-            dLE_i = 0
-        dRn_i = -4 * debris_prms.emissivity * 5.67e-8 * Td_i[0]**3
-        dH_i = -1 * debris_prms.density_air_0 * P / debris_prms.P0 * debris_prms.cA * a_neutral_debris * u_AWS_i
-        dP_flux_i = -debris_prms.density_water * debris_prms.cW * Rain_AWS_i/ debris_prms.delta_t
-        dQc_i = -k / h
-        dF_Ts_i = dRn_i + dLE_i + dH_i + dQc_i + dP_flux_i
 
     return (F_Ts_i, Rn_i, LE_i, H_i, P_flux_i, Qc_i, dF_Ts_i, dRn_i, dLE_i, dH_i, dP_flux_i, dQc_i,
             dsnow_i, tsnow_i, snow_tau_i)
     
 
-def calc_surface_fluxes_cleanice(Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, P, Albedo,
+def calc_surface_fluxes_cleanice(Tair_i, eZ_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i, P, density_air_i, Albedo,
                                  a_neutral_ice, dsnow_t0, tsnow_t0, snow_tau_t0, ill_angle_rad_i, a_neutral_snow,
                                  option_snow=0, option_snow_fromAWS=0, i_step=None):
     """ Calculate surface energy fluxes for timestep i
@@ -861,10 +1275,14 @@ def calc_surface_fluxes_cleanice(Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Ra
 
     Parameters
     ----------
-    Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i : floats
+    Tair_i, u_AWS_i, Sin_i, Lin_AWS_i, Rain_AWS_i, snow_i : floats
         meteorological data
+    eZ_i : float
+        vapor pressure of the air [Pa] (see forcing_precompute)
     P : float
-        pressure [Pa] used for snow turbulent heat calculations
+        pressure [Pa]
+    density_air_i : float
+        density of air [kg m-3] used for snow turbulent heat calculations (see forcing_precompute)
     Albedo, a_neutral_ice : floats
         albedo and turbulent heat flux transfer coefficient (from surface roughness)
     dsnow_t0, tsnow_t0, snow_tau_t0
@@ -900,16 +1318,11 @@ def calc_surface_fluxes_cleanice(Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Ra
     if dsnow_i > 0 and option_snow==1 and option_snow_fromAWS == 0:        
         tsnow_i = (dsnow_t0 * tsnow_t0 + snow_i * Tair_i) / dsnow_i
 
-        # Density of air (dry) based on pressure (elevation) and temperature
-        #  used in snow calculations, which has different parameterization of turbulent fluxes
-        #  compared to the debris
-        density_air = P / (287.058 * Tair_i)
-
         # Albedo
         # parameters representing grain growth due to vapor diffusion (r1), additional effect near
         #  and at freezing point due to melt and refreeze (r2), and the effect of dirt and soot (r3)
         snow_r1 = np.exp(5000 * (1 / 273.16 - 1 / tsnow_i))
-        snow_r2 = np.min([snow_r1**10, 1])
+        snow_r2 = min(snow_r1**10, 1)
         snow_r3 = 0.03 # change to 0.01 if in Antarctica
         # change in non-dimensional snow surface age
         snow_tau_i += (snow_r1 + snow_r2 + snow_r3) / debris_prms.snow_tau_0 * debris_prms.delta_t
@@ -932,7 +1345,7 @@ def calc_surface_fluxes_cleanice(Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Ra
             f_psi = 0
         albedo_v = albedo_vd + 0.4 * f_psi * (1 - albedo_vd)
         albedo_ir = albedo_ird + 0.4 * f_psi * (1 - albedo_ird)
-        albedo_snow = np.mean([albedo_v, albedo_ir])
+        albedo_snow = (albedo_v + albedo_ir) / 2
         
         # Adjustments to albedo
         # ensure albedo is within bounds (Hock and Holmgren, 2005)
@@ -948,19 +1361,16 @@ def calc_surface_fluxes_cleanice(Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Ra
         # Snow Energy Balance
         Rn_snow = (Sin_i * (1 - albedo_snow) + debris_prms.emissivity_snow * (Lin_AWS_i -
                    (debris_prms.stefan_boltzmann * tsnow_i**4)))
-        H_snow = a_neutral_snow * density_air * debris_prms.cA * u_AWS_i * (Tair_i - tsnow_i)
+        H_snow = a_neutral_snow * density_air_i * debris_prms.cA * u_AWS_i * (Tair_i - tsnow_i)
         # Vapor pressure above snow assumed to be saturated
-        # Vapor pressure (e, Pa) computed using Clasius-Clapeyron Equation and Relative Humidity
-        #  611 is the vapor pressure of ice and liquid water at melting temperature (273.15 K)
-        eZ_Saturated = 611 * np.exp(debris_prms.Lv / debris_prms.R_const * (1 / 273.15 - 1 / Tair_i))
-        eZ = RH_AWS_i * eZ_Saturated
+        eZ = eZ_i
         # Vapor pressure of snow based on temperature (Colbeck, 1990)
         e_snow = debris_prms.eS_snow * np.exp(2838 * (tsnow_i - 273.15) / (0.4619 * tsnow_i * 273.15))
         if e_snow > debris_prms.eS_snow:
             e_snow = debris_prms.eS_snow
         LE_snow = 0.622 * debris_prms.Ls / (debris_prms.Rd * Tair_i) * a_neutral_snow * u_AWS_i * (eZ - e_snow)
         Pflux_snow = (Rain_AWS_i * (debris_prms.Lf * debris_prms.density_water + debris_prms.cW * 
-                                    debris_prms.density_water * (np.max([273.15, Tair_i]) - 273.15)) / 
+                                    debris_prms.density_water * (max(273.15, Tair_i) - 273.15)) / 
                       debris_prms.delta_t)
         # Assume no flux between the snow and ice (Huss and Holmgren 2005)
         Qc_snow_ice = 0
@@ -1050,8 +1460,7 @@ def calc_surface_fluxes_cleanice(Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Ra
         #  611 is the vapor pressure of ice and liquid water at melting temperature (273.15 K)
         eS_Saturated = 611
         eS = eS_Saturated
-        eZ_Saturated = 611 * np.exp(-debris_prms.Lv / debris_prms.R_const * (1 / Tair_i - 1 / 273.15))
-        eZ = RH_AWS_i * eZ_Saturated
+        eZ = eZ_i
         LE_i = (0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * a_neutral_ice * u_AWS_i
                 * (eZ -eS))
 
@@ -1064,6 +1473,115 @@ def calc_surface_fluxes_cleanice(Tair_i, RH_AWS_i, u_AWS_i, Sin_i, Lin_AWS_i, Ra
         F_Ts_i = Rn_i + LE_i + H_i + Qc_i + P_flux_i
 
     return F_Ts_i, Rn_i, LE_i, H_i, P_flux_i, Qc_i, dsnow_i, tsnow_i, snow_tau_i
+
+
+def calc_surface_fluxes_cleanice_snowfree(Tair, eZ, u_AWS, Sin, Lin_AWS, Rain_AWS, P, Albedo, a_neutral_ice):
+    """ Calculate surface energy fluxes of clean ice without snow for all timesteps at once
+
+    Same equations as the snow-free branch of calc_surface_fluxes_cleanice, but applied to the whole time series,
+    since without snow the fluxes do not depend on the state of the previous timestep.
+
+    Parameters
+    ----------
+    Tair, eZ, u_AWS, Sin, Lin_AWS, Rain_AWS : np.array
+        meteorological data (see calc_surface_fluxes_cleanice)
+    P : float
+        pressure [Pa]
+    Albedo, a_neutral_ice : floats
+        albedo and turbulent heat flux transfer coefficient (from surface roughness)
+
+    Returns
+    -------
+    F_Ts, Rn, LE, H, P_flux : np.array
+        Energy fluxes [W m-2]
+    """
+    # Vapor pressure of ice and liquid water at melting temperature (273.15 K)
+    eS_Saturated = 611
+    eS = eS_Saturated
+    LE = (0.622 * debris_prms.density_air_0 / debris_prms.P0 * debris_prms.Lv * a_neutral_ice * u_AWS
+          * (eZ -eS))
+    Rn = Sin * (1 - Albedo) + debris_prms.emissivity * (Lin_AWS - (5.67e-8 * 273.15**4))
+    H = (debris_prms.density_air_0 * (P / debris_prms.P0) * debris_prms.cA * a_neutral_ice * u_AWS *
+         (Tair - 273.15))
+    P_flux = debris_prms.density_water * debris_prms.cW * Rain_AWS / debris_prms.delta_t * (Tair - 273.15)
+    # Ground heat flux
+    Qc = 0
+    F_Ts = Rn + LE + H + Qc + P_flux
+    return F_Ts, Rn, LE, H, P_flux
+
+
+def cleanice_eb(Tair, eZ, u_AWS, Sin, Lin_AWS, Rain_AWS, snow, P, density_air, Albedo, a_neutral_ice, ill_angle_rad,
+                a_neutral_snow, option_snow=0, option_snow_fromAWS=0):
+    """ Clean ice energy balance model with evolving snowpack for all timesteps
+
+    The fluxes of the snow-free timesteps are computed as whole arrays (calc_surface_fluxes_cleanice_snowfree).
+    The snowpack is only stepped through (calc_surface_fluxes_cleanice) from a timestep with snow fall until the
+    snowpack has disappeared again, so the results are identical to stepping through every timestep.
+
+    Parameters
+    ----------
+    Tair, eZ, u_AWS, Sin, Lin_AWS, Rain_AWS, snow, density_air, ill_angle_rad : np.array
+        meteorological data and illumination angle of every timestep (see calc_surface_fluxes_cleanice)
+    P : float
+        pressure [Pa]
+    Albedo, a_neutral_ice, a_neutral_snow : floats
+        albedo and turbulent heat flux transfer coefficients of ice and snow (from surface roughness)
+    option_snow : int
+        switch to use snow model (1) or not (0)
+    option_snow_fromAWS : int
+        switch to use snow depth (1) instead of snow fall (0)
+
+    Returns
+    -------
+    F_Ts, Rn, LE, H_flux, P_flux, Qc : np.array
+        Energy fluxes [W m-2]
+    dsnow, tsnow, snow_tau : np.array
+        Snow depth [mwe], snow temperature and non-dimensional snow age at the end of each timestep
+    """
+    nsteps = Tair.shape[0]
+    # Snow-free fluxes of every timestep
+    F_Ts, Rn, LE, H_flux, P_flux = (
+            calc_surface_fluxes_cleanice_snowfree(Tair, eZ, u_AWS, Sin, Lin_AWS, Rain_AWS, P, Albedo, a_neutral_ice))
+    Qc = np.zeros((nsteps))
+    dsnow = np.zeros((nsteps))
+    tsnow = np.zeros((nsteps))
+    snow_tau = np.zeros((nsteps))
+
+    # Without the snow model, snow only accumulates and does not affect the fluxes
+    if option_snow != 1:
+        dsnow = np.cumsum(snow)
+        return F_Ts, Rn, LE, H_flux, P_flux, Qc, dsnow, tsnow, snow_tau
+
+    # Step through the snowpack only where there is snow
+    snow_idx = np.flatnonzero(snow != 0)
+    dsnow_t0 = 0
+    tsnow_t0 = 273.15
+    snow_tau_t0 = 0
+    i = 0
+    while i < nsteps:
+        if dsnow_t0 == 0 and snow[i] == 0:
+            # Snow-free until the next snow fall (fluxes computed above, snow state does not change)
+            n_snow = np.searchsorted(snow_idx, i)
+            if n_snow < snow_idx.shape[0]:
+                i_next = snow_idx[n_snow]
+            else:
+                i_next = nsteps
+            snow_tau[i:i_next] = snow_tau_t0
+            tsnow_t0 = 0
+            i = i_next
+            continue
+
+        F_Ts[i], Rn[i], LE[i], H_flux[i], P_flux[i], Qc[i], dsnow[i], tsnow[i], snow_tau[i] = (
+                calc_surface_fluxes_cleanice(Tair[i], eZ[i], u_AWS[i], Sin[i], Lin_AWS[i], Rain_AWS[i], snow[i], P,
+                                             density_air[i], Albedo, a_neutral_ice, dsnow_t0, tsnow_t0, snow_tau_t0,
+                                             ill_angle_rad[i], a_neutral_snow, option_snow=option_snow,
+                                             option_snow_fromAWS=option_snow_fromAWS, i_step=i))
+        dsnow_t0 = dsnow[i]
+        tsnow_t0 = tsnow[i]
+        snow_tau_t0 = snow_tau[i]
+        i += 1
+
+    return F_Ts, Rn, LE, H_flux, P_flux, Qc, dsnow, tsnow, snow_tau
     
     
 def main(list_packed_vars):
@@ -1087,6 +1605,24 @@ def main(list_packed_vars):
     if debug:
         print(count, latlon_list)
     
+    # Compiled energy balance model (Numba is an optional dependency)
+    if args.option_numba == 1:
+        import debrisglobal.ebmodel_numba as ebmodel_numba
+        
+    # Emulator trained with meltmodel_emulator.py
+    emulator_model = None
+    if debris_prms.option_emulator == 1:
+        emulator_fullfn = debris_prms.emulator_fp + debris_prms.emulator_fn
+        if os.path.exists(emulator_fullfn):
+            emulator_model = emulator.Emulator.load(emulator_fullfn)
+        else:
+            print('No emulator found (train with meltmodel_emulator.py), simulating:', emulator_fullfn)
+    
+    # Variables returned for debugging: None unless computed for the last grid cell (the energy fluxes are only 
+    #  computed by the energy balance model in Python that runs one MC simulation at a time)
+    (time_pd, Tair_AWS, RH_AWS, u_AWS, Rain, snow, Sin_AWS, Lin_AWS, Elev_AWS, Snow_AWS, Td, n_iterations, LE, Rn, 
+     H_flux, Qc, P_flux, F_Ts, Qc_ice, Melt, dsnow, tsnow, snow_tau, output_ds_all) = [None] * 24
+    
     for nlatlon, latlon in enumerate(latlon_list):
         if debug:
             print(nlatlon, latlon)
@@ -1124,6 +1660,17 @@ def main(list_packed_vars):
         end_idx = time_yymmdd_all.index(debris_prms.end_date) + 23
         # Subsets
         time_pd = time_pd_all[start_idx:end_idx+1]
+        # Option to only simulate the windows needed for the melt and surface temperature curves
+        #  (year to minute remain the full period for the solar calculations)
+        if debris_prms.option_sim_windows == 1:
+            sim_idx = sim_windows_idx(time_pd, lat_deg, lon_deg, 
+                                      mb_yrfrac=debris_prms.mb_yrfrac_dict[debris_prms.roi],
+                                      ts_info_fullfn=debris_prms.ts_fp + debris_prms.roi + '_debris_tsinfo.nc',
+                                      ts_days=debris_prms.sim_windows_ts_days,
+                                      spinup_days=debris_prms.sim_windows_spinup_days)
+        else:
+            sim_idx = np.arange(len(time_pd))
+        time_pd = time_pd[sim_idx]
         year = year_all[start_idx:end_idx+1]
         month = month_all[start_idx:end_idx+1]
         day = day_all[start_idx:end_idx+1]
@@ -1143,26 +1690,51 @@ def main(list_packed_vars):
         
         # Create output file
         output_ds_all, encoding = create_xrdataset(debris_thickness_all=debris_thickness_all, lat_deg=lat_deg, 
-                                                   lon_deg=lon_deg, time_values=time_pd, elev_values=elev_list)
-            
+                                                   lon_deg=lon_deg, time_values=time_pd, elev_values=elev_list,
+                                                   output_profile=debris_prms.output_profile)
+        output_fp = debris_prms.output_fp + 'exp' + str(debris_prms.experiment_no) + '/' + debris_prms.roi + '/'
+        if os.path.exists(output_fp) == False:
+            os.makedirs(output_fp)
+        # add MC string and count string
+        if debris_prms.experiment_no == 3:
+            mc_str = ''
+            count_str = ''
+        else:
+            mc_str = str(int(debris_prms.mc_simulations)) + 'MC_'
+            count_str = '--' + str(count)
+        # Latitude string
+        if lat_deg < 0:
+            lat_str = 'S-'
+        else:
+            lat_str = 'N-'
+        output_ds_fn = (debris_prms.fn_prefix + str(int(abs(lat_deg)*100)) + lat_str + str(int(lon_deg*100)) + 'E-'
+                        + mc_str + debris_prms.date_start + count_str + '.nc')
+        # Option to resume from the debris thicknesses and elevations completed by a previous run
+        checkpoint = None
+        if debris_prms.option_checkpoint == 1:
+            checkpoint = Checkpoint(debris_prms.checkpoint_fp + output_ds_fn.replace('.nc', '/'),
+                                    checkpoint_config(debris_thickness_all, time_pd, elev_list, args))
+            if checkpoint.cell_completed():
+                print(lat_deg, lon_deg, 'completed by a previous run (see', checkpoint.checkpoint_fp + '), skipping')
+                continue
         # Load meteorological data
         # Air temperature
-        Tair_AWS = ds['t2m'][start_idx:end_idx+1].values
+        Tair_AWS = ds['t2m'][start_idx:end_idx+1].values[sim_idx]
         # Relative humidity
-        RH_AWS = ds['rh'][start_idx:end_idx+1].values / 100
+        RH_AWS = ds['rh'][start_idx:end_idx+1].values[sim_idx] / 100
         RH_AWS[RH_AWS<0] = 0
         RH_AWS[RH_AWS>1] = 1
         # Wind speed
-        u_AWS_x = ds['u10'][start_idx:end_idx+1].values
-        u_AWS_y = ds['v10'][start_idx:end_idx+1].values
+        u_AWS_x = ds['u10'][start_idx:end_idx+1].values[sim_idx]
+        u_AWS_y = ds['v10'][start_idx:end_idx+1].values[sim_idx]
         u_AWS_raw = (u_AWS_x**2 + u_AWS_y**2)**0.5
         # Total Precipitation        
-        Rain_AWS = ds['tp'][start_idx:end_idx+1].values
+        Rain_AWS = ds['tp'][start_idx:end_idx+1].values[sim_idx]
         # Incoming shortwave radiation
-        Sin_AWS = ds['ssrd'][start_idx:end_idx+1].values / 3600
+        Sin_AWS = ds['ssrd'][start_idx:end_idx+1].values[sim_idx] / 3600
         Sin_AWS[Sin_AWS < 0.1] = 0 
         # Incoming longwave radiation
-        Lin_AWS = ds['strd'][start_idx:end_idx+1].values / 3600
+        Lin_AWS = ds['strd'][start_idx:end_idx+1].values[sim_idx] / 3600
         # Elevation
         Elev_AWS = ds['z'].values
         
@@ -1184,7 +1756,7 @@ def main(list_packed_vars):
                                 for x in np.arange(0,len(lr_time_pd_all))]
             lr_monthly_dict = dict(zip(lr_time_yymm_all, lr_monthly_all))
             yearmonth_str = [str(year[x]) + '-' + str(month[x]).zfill(2) for x in np.arange(0,len(year))]
-            lapserate = np.array([lr_monthly_dict[x] for x in yearmonth_str])
+            lapserate = np.array([lr_monthly_dict[x] for x in yearmonth_str])[sim_idx]
         else:
             lapserate = np.zeros(Tair_AWS.shape) + debris_prms.lapserate
         # bounds for lapse rates
@@ -1205,8 +1777,143 @@ def main(list_packed_vars):
         julian_day_of_year = np.array([int(x) for x in df_datetime.dt.strftime('%j').tolist()])
         nsteps = len(Tair_AWS)
         
+        # Histogram of surface temperature iterations per timestep (solver telemetry), summed over the debris 
+        #  thicknesses and elevations of the output (simulated or restored from the checkpoint)
+        n_iter_hist = ts_solver.iteration_histogram(debris_prms.n_iter_max)
+        
+        # Solar information (same for all elevations, debris thicknesses and MC simulations)
+        lon_deg_pixel = lon_deg
+        lat_deg_pixel = lat_deg
+        slope_rad = 0
+        aspect_rad = 0
+        if debris_prms.option_ephemeris_cache == 1:
+            ephemeris_fp = debris_prms.ephemeris_fp
+        else:
+            ephemeris_fp = None
+        zenith_angle_rad, azimuth_angle_rad, rm_r2 = (
+                solar_calcs_cached(year, julian_day_of_year, time_frac, lon_deg_pixel, lat_deg_pixel, len(year),
+                                   start_date=debris_prms.start_date, end_date=debris_prms.end_date,
+                                   ephemeris_fp=ephemeris_fp))
+        zenith_angle_rad = zenith_angle_rad[sim_idx]
+        azimuth_angle_rad = azimuth_angle_rad[sim_idx]
+        rm_r2 = rm_r2[sim_idx]
+        # Illumination angle / angle of Incidence b/w normal to grid slope at AWS and solar beam
+        #  if slope & aspect are 0 degrees, then this is equal to the zenith angle
+        ill_angle_rad = (np.arccos(np.cos(slope_rad) * np.cos(zenith_angle_rad) + np.sin(slope_rad) *
+                         np.sin(zenith_angle_rad) * np.cos(azimuth_angle_rad - aspect_rad)))
+        
+        # Option to estimate the daily melt and surface temperature with the emulator (only if the forcing of all
+        #  elevations is within its training data, otherwise the debris thicknesses are simulated)
+        emulated = False
+        if emulator_model is not None:
+            features_elev = []
+            for elev in elev_list:
+                P, Tair, Rain, snow, eZ, density_air = (
+                        forcing_precompute(Tair_AWS, RH_AWS, Rain_AWS, lapserate, elev, Elev_AWS, 
+                                           Snow_AWS=Snow_AWS, option_snow_fromAWS=debris_prms.option_snow_fromAWS))
+                features_elev.append(emulator.daily_features(Tair, RH_AWS, u_AWS_raw, Sin_timeseries, Lin_AWS, Rain, 
+                                                             snow, elev))
+            emulated = all([emulator_model.in_envelope(features, debris_thickness_all, 
+                                                       margin=debris_prms.emulator_envelope_margin,
+                                                       max_frac=debris_prms.emulator_envelope_max_frac)
+                            for features in features_elev])
+            if not emulated:
+                print(lat_deg, lon_deg, 'forcing outside of the emulator training data, simulating')
+        
+        # Option to write each debris thickness as it completes
+        if (debris_prms.option_output_hourly == 1 and debris_prms.option_output_incremental == 1 and 
+                not emulated):
+            output_writer = IncrementalWriter(output_fp + output_ds_fn, output_ds_all, encoding)
+        # Daily melt ("ostrem" file) summed from the simulations (always exported by the emulator)
+        if debris_prms.option_output_daily == 1 or emulated:
+            ostrem_fp = debris_prms.ostrem_fp
+            if debris_prms.experiment_no == 4:
+                ostrem_fp = debris_prms.ostrem_fp + 'exp' + str(debris_prms.experiment_no) + '/'
+            if os.path.exists(ostrem_fp) == False:
+                os.makedirs(ostrem_fp)
+            latlon_str = str(int(abs(lat_deg)*100)) + lat_str + str(int(lon_deg*100)) + 'E-'
+            ds_ostrem_fn = debris_prms.ostrem_fn_sample.replace('XXXX', latlon_str).replace('.nc', count_str + '.nc')
+            ds_ostrem, encoding_ostrem = daily_melt.create_xrdataset_daily_melt(
+                    output_ds_all.hd_cm.values, time_pd[0::24], elev_list, 
+                    option_std=('std' in debris_prms.mc_stat_cns), option_ts=emulated)
+            ds_ostrem['latitude'] = output_ds_all['latitude']
+            ds_ostrem['longitude'] = output_ds_all['longitude']
+            
+        def record_output(n_thickness, nelev, output_slab):
+            """ Record the statistics of a debris thickness and elevation in the hourly and daily output """
+            if debris_prms.option_output_hourly == 1:
+                for vn in output_slab.keys():
+                    if debris_prms.option_output_incremental == 1:
+                        output_writer.write(vn, n_thickness, nelev, output_slab[vn])
+                    else:
+                        output_ds_all[vn].values[n_thickness,:,nelev] = output_slab[vn]
+                if debris_prms.option_output_incremental == 1:
+                    output_writer.slab_completed()
+            if debris_prms.option_output_daily == 1:
+                for vn in ds_ostrem.data_vars:
+                    if vn in output_slab.keys():
+                        ds_ostrem[vn].values[n_thickness,:,nelev] = daily_melt.daily_sum(output_slab[vn])
+            
+        if emulated:
+            for nelev, features in enumerate(features_elev):
+                melt_daily, ts_daily = emulator_model.predict(features, debris_thickness_all)
+                ds_ostrem['melt'].values[:,:,nelev] = melt_daily
+                ds_ostrem['ts'].values[:,:,nelev] = ts_daily
+                # the spread of the MC simulations is not emulated
+                if 'melt_std' in ds_ostrem.data_vars:
+                    ds_ostrem['melt_std'].values[:,:,nelev] = np.nan
+            output_ds_all.attrs['emulator'] = debris_prms.emulator_fn
+            
+        # Option to simulate all elevations together (columns of each elevation use the forcing of the elevation)
+        if args.option_elev_lockstep == 1:
+            forcing_elev = [forcing_precompute(Tair_AWS, RH_AWS, Rain_AWS, lapserate, elev, Elev_AWS, 
+                                               Snow_AWS=Snow_AWS, option_snow_fromAWS=debris_prms.option_snow_fromAWS)
+                            for elev in elev_list]
+            elev_lockstep_output = {}
+            
+        def elev_lockstep(nelev, hd_idx, mc_lsts):
+            """ Melt, snow depth and surface temperature (timestep, debris thickness, MC simulation of mc_lsts) of an 
+            elevation and solver telemetry (debris thickness, bins); debris thicknesses that were not simulated with a 
+            previous elevation are simulated together with the following elevations, whose output is kept (for each 
+            elevation and debris thickness) until used """
+            # output of the previous elevations that was not used (e.g., other adaptive or completed debris thicknesses)
+            for key in [x for x in elev_lockstep_output if x[0] < nelev]:
+                del elev_lockstep_output[key]
+            hd_idx_new = [x for x in hd_idx if (nelev, x) not in elev_lockstep_output]
+            if len(hd_idx_new) > 0:
+                # as many of the following elevations as fit in lockstep_max_cols columns
+                n_elev_max = max(1, debris_prms.lockstep_max_cols // 
+                                    (len(hd_idx_new) * max([len(x) for x in mc_lsts])))
+                elev_idx = list(range(nelev, min(len(elev_list), nelev + n_elev_max)))
+                P_elev, Tair_elev, Rain_elev, snow_elev, eZ_elev, density_air_elev = (
+                        [np.stack(x, axis=-1) for x in zip(*[forcing_elev[x] for x in elev_idx])])
+                output_elev = np.zeros((3, nsteps, len(elev_idx), len(hd_idx_new), 
+                                        np.sum([len(x) for x in mc_lsts])))
+                n_iter_hist_elev = np.zeros((len(elev_idx) * len(hd_idx_new), debris_prms.n_iter_max + 1), 
+                                            dtype=np.int64)
+                n_mc = 0
+                for mc_lst in mc_lsts:
+                    output_elev[:,:,:,:,n_mc:n_mc+len(mc_lst)] = np.array(
+                            ebmodel_vectorized.debris_eb_lockstep_elev(
+                                    Tair_elev, eZ_elev, u_AWS_raw, Sin_timeseries, Lin_AWS, Rain_elev, snow_elev, 
+                                    P_elev, density_air_elev, ill_angle_rad, debris_thickness_all[hd_idx_new], 
+                                    debris_prms.albedo_random[mc_lst], debris_prms.z0_random[mc_lst], 
+                                    debris_prms.k_random[mc_lst], debris_prms.z0_random_snow[mc_lst], 
+                                    debris_prms.sin_factor_random[mc_lst], latlon=latlon, 
+                                    n_iter_hist=n_iter_hist_elev))
+                    n_mc += len(mc_lst)
+                for n, nelev_lockstep in enumerate(elev_idx):
+                    for nhd, n_thickness in enumerate(hd_idx_new):
+                        elev_lockstep_output[(nelev_lockstep, n_thickness)] = (
+                                output_elev[:,:,n,nhd], n_iter_hist_elev[n * len(hd_idx_new) + nhd])
+            # the output of an elevation is only used once
+            output_lockstep, n_iter_hist_lockstep = zip(*[elev_lockstep_output.pop((nelev, x)) for x in hd_idx])
+            return np.stack(output_lockstep, axis=2), np.stack(n_iter_hist_lockstep)
+            
         for nelev, elev in enumerate(elev_list):
             Elevation_pixel = elev
+            if emulated:
+                continue
 #            if elev_cn == 'zmean':
 #                Elevation_pixel = int(np.round(ds['dc_zmean'].values,0))
 #            elif elev_cn == 'zstdlow':
@@ -1215,203 +1922,405 @@ def main(list_packed_vars):
 #                Elevation_pixel = int(np.round(ds['dc_zmean'].values + ds['dc_zstd'].values,0))
             
             output_ds_all['elev'].values[nelev] = Elevation_pixel
-            Sin = Sin_timeseries
-            lon_deg_pixel = lon_deg
-            lat_deg_pixel = lat_deg
-            slope_rad = 0
-            aspect_rad = 0
             if debug:
                 print('Elevation pixel:', np.round(Elevation_pixel, 0), 'm')
+                
+            # Forcing is the same for all debris thicknesses and MC simulations
+            #  (pressure, air temperature, rain/snow partitioning, vapor pressure and density of air)
+            P, Tair, Rain, snow, eZ, density_air = (
+                    forcing_precompute(Tair_AWS, RH_AWS, Rain_AWS, lapserate, Elevation_pixel, Elev_AWS, 
+                                       Snow_AWS=Snow_AWS, option_snow_fromAWS=debris_prms.option_snow_fromAWS))
+
+            # ===== VECTORIZED SIMULATIONS =====
+            if args.option_vectorized == 1 or args.option_hd_lockstep == 1:
+                mc_idx = np.arange(debris_prms.mc_simulations)
+                # MC simulations of a pass through the forcing (at most lockstep_max_cols columns)
+                mc_idx_lsts = np.array_split(mc_idx, int(np.ceil(len(mc_idx) / debris_prms.lockstep_max_cols)))
+                
+            # Option to simulate a subset of the debris thicknesses chosen from the fit of the melt and surface 
+            #  temperature curves (the others are interpolated once all batches are simulated)
+            if debris_prms.option_hd_adaptive == 1:
+                hd_sampler = hd_adaptive.AdaptiveThicknesses(
+                        debris_thickness_all, time_pd, mb_yrfrac=debris_prms.mb_yrfrac_dict[debris_prms.roi],
+                        anchors=debris_prms.hd_adaptive_anchors, fit_min=debris_prms.hd_adaptive_fit_min,
+                        tol_melt=debris_prms.hd_adaptive_tol_melt,
+                        tol_melt_clean=debris_prms.hd_adaptive_tol_melt_clean, tol_ts=debris_prms.hd_adaptive_tol_ts)
+            else:
+                hd_sampler = range(debris_thickness_all.shape[0])
+            hd_idx_lockstep = []
+            # Surface temperature (timestep, MC simulation) of the previously simulated debris thickness
+            Ts_continuation = None
 
             # ===== LOOP THROUGH RELEVANT DEBRIS THICKNESS AND/OR MC SIMULATIONS =====
-            for n_thickness in range(debris_thickness_all.shape[0]):
+            for n_thickness in hd_sampler:
                 debris_thickness = debris_thickness_all[n_thickness]
-
+                
+                # Debris thicknesses completed by a previous run
+                if checkpoint is not None and checkpoint.completed(nelev, n_thickness):
+                    output_slab = checkpoint.load(nelev, n_thickness)
+                    if checkpoint.iteration_histogram(nelev, n_thickness) is not None:
+                        n_iter_hist += checkpoint.iteration_histogram(nelev, n_thickness)
+                    # the surface temperature of each MC simulation is not checkpointed
+                    Ts_continuation = None
+                    if debris_prms.option_hd_adaptive == 1:
+                        hd_sampler.record(n_thickness, output_slab)
+                    else:
+                        record_output(n_thickness, nelev, output_slab)
+                    continue
+                
+                # Option to simulate all debris thicknesses (of the batch) together in one pass through the forcing
+                if args.option_hd_lockstep == 1 and debris_thickness > 0 and n_thickness not in hd_idx_lockstep:
+                    if debris_prms.option_hd_adaptive == 1:
+                        hd_idx_batch = hd_sampler.batch
+                    else:
+                        hd_idx_batch = hd_sampler
+                    hd_idx_pending = [x for x in hd_idx_batch if debris_thickness_all[x] > 0 and 
+                                      (checkpoint is None or not checkpoint.completed(nelev, x))]
+                    # all MC simulations at once, or one MC simulation at a time
+                    if args.option_vectorized == 1:
+                        mc_lsts = mc_idx_lsts
+                    else:
+                        mc_lsts = [[MC] for MC in mc_idx]
+                    # debris thicknesses of a pass: the memory of a pass grows with the number of columns (debris 
+                    #  thicknesses x MC simulations x elevations), which is capped by lockstep_max_cols
+                    if args.option_elev_lockstep == 1:
+                        n_elev_lockstep = len(elev_list)
+                    else:
+                        n_elev_lockstep = 1
+                    n_hd_max = max(1, debris_prms.lockstep_max_cols // (len(mc_lsts[0]) * n_elev_lockstep))
+                    hd_idx_lockstep = hd_idx_pending[hd_idx_pending.index(n_thickness):][:n_hd_max]
+                    if args.option_elev_lockstep == 1:
+                        (Melt_lockstep, dsnow_lockstep, Ts_lockstep), n_iter_hist_lockstep = (
+                                elev_lockstep(nelev, hd_idx_lockstep, mc_lsts))
+                    else:
+                        n_iter_hist_lockstep = np.zeros((len(hd_idx_lockstep), debris_prms.n_iter_max + 1), 
+                                                        dtype=np.int64)
+                        Melt_lockstep = np.zeros((nsteps, len(hd_idx_lockstep), debris_prms.mc_simulations))
+                        dsnow_lockstep = np.zeros((nsteps, len(hd_idx_lockstep), debris_prms.mc_simulations))
+                        Ts_lockstep = np.zeros((nsteps, len(hd_idx_lockstep), debris_prms.mc_simulations))
+                        for mc_lst in mc_lsts:
+                            (Melt_lockstep[:,:,mc_lst], dsnow_lockstep[:,:,mc_lst], Ts_lockstep[:,:,mc_lst]) = (
+                                    ebmodel_vectorized.debris_eb_lockstep(
+                                            Tair, eZ, u_AWS_raw, Sin_timeseries, Lin_AWS, Rain, snow, P, density_air,
+                                            ill_angle_rad, debris_thickness_all[hd_idx_lockstep], 
+                                            debris_prms.albedo_random[mc_lst], debris_prms.z0_random[mc_lst], 
+                                            debris_prms.k_random[mc_lst], debris_prms.z0_random_snow[mc_lst], 
+                                            debris_prms.sin_factor_random[mc_lst], latlon=latlon, 
+                                            n_iter_hist=n_iter_hist_lockstep))
+
+                # Solver telemetry of the debris thickness
+                n_iter_hist_slab = ts_solver.iteration_histogram(debris_prms.n_iter_max)
                 if debris_thickness > 0:
-                    # Height of each internal layer
-                    h = debris_thickness / 10
-                    # Number of internal calculation layers + 1 to include the surface layer
-                    N = int(debris_thickness/h + 1)
                     if debug:
                         print('\nDebris thickness [m]:', debris_thickness)
             
-                    Melt_all = np.zeros((Tair_AWS.shape[0],debris_prms.mc_simulations))
-                    dsnow_all = np.zeros((Tair_AWS.shape[0],debris_prms.mc_simulations))
-                    Ts_all = np.zeros((Tair_AWS.shape[0],debris_prms.mc_simulations))
-                    for MC in range(debris_prms.mc_simulations):
+                    # Statistics of the MC simulations (updated as each simulation finishes)
+                    melt_stats = mc_stats.MCStats(nsteps)
+                    dsnow_stats = mc_stats.MCStats(nsteps)
+                    ts_stats = mc_stats.MCStats(nsteps)
+                    
+                    # Debris thicknesses already simulated together
+                    if args.option_hd_lockstep == 1:
+                        nhd_lockstep = hd_idx_lockstep.index(n_thickness)
+                        Melt_all = Melt_lockstep[:,nhd_lockstep,:]
+                        dsnow_all = dsnow_lockstep[:,nhd_lockstep,:]
+                        Ts_all = Ts_lockstep[:,nhd_lockstep,:]
+                        n_iter_hist_slab += n_iter_hist_lockstep[nhd_lockstep]
+                        melt_stats.update(Melt_all)
+                        dsnow_stats.update(dsnow_all)
+                        ts_stats.update(Ts_all)
+                        
                         if debug:
-                            print('  properties iteration ', MC)
-            
-                        # Debris properties (Albedo, Surface roughness [m], Thermal Conductivity [W m-1 K-1])
-                        albedo = debris_prms.albedo_random[MC]
-                        albedo_AWS = np.repeat(albedo,nsteps) 
-                        z0 = debris_prms.z0_random[MC]
-                        k = debris_prms.k_random[MC]
-                        z0_snow = debris_prms.z0_random_snow[MC]
-                        Sin = Sin * debris_prms.sin_factor_random[MC]
+                            print(lat_deg, lon_deg, 'hd [m]:', debris_thickness, 
+                                  '  Melt[m ice/yr]:', np.round(np.sum(Melt_all, axis=0) / (nsteps / 24 / 365),3))
+                    
+                    # Option to run all MC simulations together as one vector
+                    elif args.option_vectorized == 1 and args.option_elev_lockstep == 1:
+                        output_lockstep, n_iter_hist_lockstep = elev_lockstep(nelev, [n_thickness], mc_idx_lsts)
+                        Melt_all, dsnow_all, Ts_all = output_lockstep[:,:,0,:]
+                        n_iter_hist_slab += n_iter_hist_lockstep[0]
+                        melt_stats.update(Melt_all)
+                        dsnow_stats.update(dsnow_all)
+                        ts_stats.update(Ts_all)
+                    elif args.option_vectorized == 1:
+                        Melt_all, dsnow_all, Ts_all = ebmodel_vectorized.debris_eb_ensemble(
+                                Tair, eZ, u_AWS_raw, Sin_timeseries, Lin_AWS, Rain, snow, P, density_air, ill_angle_rad,
+                                debris_thickness, debris_prms.albedo_random[mc_idx], debris_prms.z0_random[mc_idx],
+                                debris_prms.k_random[mc_idx], debris_prms.z0_random_snow[mc_idx],
+                                debris_prms.sin_factor_random[mc_idx], latlon=latlon, n_iter_hist=n_iter_hist_slab,
+                                Ts_neighbor=Ts_continuation)
+                        if args.option_ts_continuation == 1:
+                            Ts_continuation = Ts_all
+                        melt_stats.update(Melt_all)
+                        dsnow_stats.update(dsnow_all)
+                        ts_stats.update(Ts_all)
                         
                         if debug:
-                            print('  MC:', MC, albedo, z0, k, debris_prms.sin_factor_random[MC])
-                            
-                        # Additional properties
-                        # Turbulent heat flux transfer coefficient (neutral conditions)
-                        a_neutral_debris = debris_prms.Kvk**2/(np.log(debris_prms.za/z0))**2
-                        # Turbulent heat flux transfer coefficient (neutral condition)
-                        a_neutral_snow = debris_prms.Kvk**2/(np.log(debris_prms.za/z0_snow))**2
-                        # Adjust wind speed from sensor height to 2 m accounting for surface roughness
-                        u_AWS = u_AWS_raw*(np.log(2/z0)/(np.log(debris_prms.zw/z0)))
-                        # Pressure (barometric pressure formula)
-                        P = debris_prms.P0*np.exp(-0.0289644*9.81*Elevation_pixel/(8.31447*288.15))
+                            print(lat_deg, lon_deg, 'hd [m]:', debris_thickness, 
+                                  '  Melt[m ice/yr]:', np.round(np.sum(Melt_all, axis=0) / (nsteps / 24 / 365),3))
+                    
+                    else:
+                        if args.option_ts_continuation == 1:
+                            Ts_hd = np.zeros((nsteps, debris_prms.mc_simulations))
+                        for MC in range(debris_prms.mc_simulations):
+                            if debug:
+                                print('  properties iteration ', MC)
             
-                        # Air temperature
-                        Tair = Tair_AWS + lapserate*(Elevation_pixel-Elev_AWS)
-                        # Snow [m]
-                        if debris_prms.option_snow_fromAWS == 1:
-                            if Snow_AWS == None:
-                                print('\n\nNO SNOW DEPTH FROM AWS\n\n')
+                            # Debris properties (Albedo, Surface roughness [m], Thermal Conductivity [W m-1 K-1])
+                            albedo = debris_prms.albedo_random[MC]
+                            albedo_AWS = np.repeat(albedo,nsteps) 
+                            z0 = debris_prms.z0_random[MC]
+                            k = debris_prms.k_random[MC]
+                            z0_snow = debris_prms.z0_random_snow[MC]
+                            # incoming shortwave radiation of this MC simulation (scaled from the forcing, not from
+                            #  the previous simulation)
+                            Sin = Sin_timeseries * debris_prms.sin_factor_random[MC]
+                        
+                            if debug:
+                                print('  MC:', MC, albedo, z0, k, debris_prms.sin_factor_random[MC])
+                            
+                            # Additional properties
+                            # Turbulent heat flux transfer coefficient (neutral conditions)
+                            a_neutral_debris = debris_prms.Kvk**2/(np.log(debris_prms.za/z0))**2
+                            # Turbulent heat flux transfer coefficient (neutral condition)
+                            a_neutral_snow = debris_prms.Kvk**2/(np.log(debris_prms.za/z0_snow))**2
+                            # Adjust wind speed from sensor height to 2 m accounting for surface roughness
+                            u_AWS = u_AWS_raw*(np.log(2/z0)/(np.log(debris_prms.zw/z0)))
+
+                            # ===== DEBRIS-COVERED GLACIER ENERGY BALANCE MODEL =====
+                            # Number of layers, height of each layer, constant defined by Reid and Brock (2010) for 
+                            #  Crank-Nicholson Scheme and conduction step of the decoupled debris (see debris_layers.py)
+                            N, h, C, n_sub = debris_layers.debris_layers(debris_thickness, k)
+                            # "Crank Nicholson Newton Raphson" Method for LE Rain
+                            # Compute Ts from surface energy balance model using Newton-Raphson Method at each time step and Td
+                            # at all points in debris layer
+                            if args.option_numba == 1:
+                                # Compiled version of the timestep loop below (same physics)
+                                Melt, dsnow, Td_record, n_iterations = ebmodel_numba.debris_eb_nb(
+                                        Tair, eZ, u_AWS, Sin, Lin_AWS, Rain, snow, P, density_air, albedo, k, 
+                                        a_neutral_debris, a_neutral_snow, ill_angle_rad, debris_thickness, N, h, C, 
+                                        debris_prms.n_iter_max, debris_prms.option_snow, 
+                                        debris_prms.option_snow_fromAWS, 
+                                        Ts_continuation[:,MC] if Ts_continuation is not None else np.zeros(0), 
+                                        n_sub)
+                                for i in np.where(n_iterations == debris_prms.n_iter_max)[0]:
+                                    print(lat_deg, lon_deg, 'debris_thickness:', debris_thickness, 'Timestep ', i, 
+                                          'maxed out at ', n_iterations[i], 'iterations.')
+                            
                             else:
-                                snow = Snow_AWS.copy()    
-                        else:
-                            snow = Rain_AWS.copy()
-                            snow[Tair > debris_prms.Tsnow_threshold] = 0
-                            snow[snow < debris_prms.snow_min] = 0
-                            Rain_AWS[Tair <= debris_prms.Tsnow_threshold] = 0
-                            Rain_AWS[Rain_AWS < debris_prms.rain_min] = 0
+                                # Debris temperature for current and previous timestep (rolled each timestep)
+                                Td = np.zeros((N))
+                                Td_past = np.zeros((N))
+                                A_Crank = np.zeros((N))
+                                S_Crank = np.zeros((N))
+                                # Record of surface (row 0) and basal debris layer (row 1) temperatures [K]
+                                Td_record = np.zeros((2, nsteps))
+                                n_iterations = np.zeros((nsteps))
+                                Ts_past = np.zeros((nsteps))
+                                LE = np.zeros((nsteps))
+                                Rn = np.zeros((nsteps))
+                                H_flux = np.zeros((nsteps))
+                                Qc = np.zeros((nsteps))
+                                P_flux = np.zeros((nsteps))
+                                dLE = np.zeros((nsteps))
+                                dRn = np.zeros((nsteps))
+                                dH_flux = np.zeros((nsteps))
+                                dQc = np.zeros((nsteps))
+                                dP_flux = np.zeros((nsteps))
+                                F_Ts = np.zeros((nsteps))
+                                dF_Ts = np.zeros((nsteps))
+                                Qc_ice = np.zeros((nsteps))
+                                Melt = np.zeros((nsteps))
+                                dsnow = np.zeros((nsteps))      # snow depth [mwe]
+                                tsnow = np.zeros((nsteps))      # snow temperature [K]
+                                snow_tau = np.zeros((nsteps))   # non-dimensional snow age
             
-                        # Solar information
-                        zenith_angle_rad, azimuth_angle_rad, rm_r2 = (
-                                solar_calcs_NOAA(year, julian_day_of_year, time_frac, lon_deg_pixel, lat_deg_pixel, 
-                                                 nsteps))
-                        # Illumination angle / angle of Incidence b/w normal to grid slope at AWS and solar beam
-                        #  if slope & aspect are 0 degrees, then this is equal to the zenith angle
-                        ill_angle_rad = (np.arccos(np.cos(slope_rad) * np.cos(zenith_angle_rad) + np.sin(slope_rad) *
-                                         np.sin(zenith_angle_rad) * np.cos(azimuth_angle_rad - aspect_rad)))
-
-                        # ===== DEBRIS-COVERED GLACIER ENERGY BALANCE MODEL =====
-                        # Constant defined by Reid and Brock (2010) for Crank-Nicholson Scheme
-                        C = k * debris_prms.delta_t / (2 * debris_prms.row_d * debris_prms.c_d * h**2)
-                        # "Crank Nicholson Newton Raphson" Method for LE Rain
-                        # Compute Ts from surface energy balance model using Newton-Raphson Method at each time step and Td
-                        # at all points in debris layer
-                        Td = np.zeros((N, nsteps))
-                        a_Crank = np.zeros((N,nsteps))
-                        b_Crank = np.zeros((N,nsteps))
-                        c_Crank = np.zeros((N,nsteps))
-                        d_Crank = np.zeros((N,nsteps))
-                        A_Crank = np.zeros((N,nsteps))
-                        S_Crank = np.zeros((N,nsteps))
-                        n_iterations = np.zeros((nsteps))
-                        Ts_past = np.zeros((nsteps))
-                        LE = np.zeros((nsteps))
-                        Rn = np.zeros((nsteps))
-                        H_flux = np.zeros((nsteps))
-                        Qc = np.zeros((nsteps))
-                        P_flux = np.zeros((nsteps))
-                        dLE = np.zeros((nsteps))
-                        dRn = np.zeros((nsteps))
-                        dH_flux = np.zeros((nsteps))
-                        dQc = np.zeros((nsteps))
-                        dP_flux = np.zeros((nsteps))
-                        F_Ts = np.zeros((nsteps))
-                        dF_Ts = np.zeros((nsteps))
-                        Qc_ice = np.zeros((nsteps))
-                        Melt = np.zeros((nsteps))
-                        dsnow = np.zeros((nsteps))      # snow depth [mwe]
-                        tsnow = np.zeros((nsteps))      # snow temperature [K]
-                        snow_tau = np.zeros((nsteps))   # non-dimensional snow age
+                                # Initial values
+                                dsnow_t0 = 0
+                                tsnow_t0 = 273.15
+                                snow_tau_t0 = 0
+                                # Decoupled debris: sum of the surface temperature since the last conduction step
+                                Ts_sum = 0
+                                i_conduction = 0
+                                
+                                def surface_fluxes(Td):
+                                    """ Surface energy fluxes of timestep i with the kernel of the snow-free or 
+                                    snow-covered segment (same results as calc_surface_fluxes) """
+                                    if snow_free:
+                                        return (calc_surface_fluxes_debris(Td, Tair[i], eZ[i], u_AWS[i], Sin[i], 
+                                                                           Lin_AWS[i], Rain[i], P, albedo_AWS[i], k, 
+                                                                           a_neutral_debris, h) 
+                                                + (dsnow_t0 + snow[i], 273.15, snow_tau_t0))
+                                    elif snowpack is not None:
+                                        return calc_surface_fluxes_snow(Td, snowpack, k, h)
+                                    else:
+                                        return calc_surface_fluxes(Td, Tair[i], eZ[i], u_AWS[i], Sin[i], Lin_AWS[i],
+                                                                   Rain[i], snow[i], P, density_air[i], albedo_AWS[i], 
+                                                                   k, a_neutral_debris, h, dsnow_t0, tsnow_t0, 
+                                                                   snow_tau_t0, ill_angle_rad[i], a_neutral_snow, 
+                                                                   debris_thickness, 
+                                                                   option_snow=debris_prms.option_snow,
+                                                                   option_snow_fromAWS=debris_prms.option_snow_fromAWS,
+                                                                   i_step=i)
+                                
+                                def eval_Ts(Ts):
+                                    """ Net surface energy flux and its derivative for surface temperature Ts """
+                                    Td[0] = Ts
+                                    if coupled:
+                                        CrankNicholson(Td, Td_past, i, debris_thickness, N, h, C, A_Crank, S_Crank)
+                                    (F_Ts[i], Rn[i], LE[i], H_flux[i], P_flux[i], Qc[i], dF_Ts[i], dRn[i], dLE[i], 
+                                     dH_flux[i], dP_flux[i], dQc[i], dsnow[i], tsnow[i], snow_tau[i]) = (
+                                            surface_fluxes(Td))
+                                    return F_Ts[i], dF_Ts[i]
             
-                        # Initial values
-                        dsnow_t0 = 0
-                        tsnow_t0 = 273.15
-                        snow_tau_t0 = 0
+                                for i in np.arange(0,nsteps):
             
-                        for i in np.arange(0,nsteps):
+                                    if i > 0:
+                                        Td, Td_past = Td_past, Td
+                                    Td[N-1] = 273.15
             
-                            Td[N-1,i] = 273.15
+                                    if i > 0:
+                                        dsnow_t0 = dsnow[i-1]
+                                        tsnow_t0 = tsnow[i-1]
+                                        snow_tau_t0 = snow_tau[i-1]
+                                    
+                                    # Snow-free or snow-covered segment: the debris-only kernel is used without snow, 
+                                    #  and with snow the snowpack fluxes that do not depend on the debris temperature 
+                                    #  are computed once per timestep instead of every iteration
+                                    snow_free = (dsnow_t0 + snow[i] <= 0 or debris_prms.option_snow != 1)
+                                    if not snow_free and debris_prms.option_snow_fromAWS == 0:
+                                        snowpack = calc_snowpack(Tair[i], eZ[i], u_AWS[i], Sin[i], Lin_AWS[i], Rain[i],
+                                                                 snow[i], density_air[i], albedo_AWS[i], k, dsnow_t0, 
+                                                                 tsnow_t0, snow_tau_t0, ill_angle_rad[i], 
+                                                                 a_neutral_snow, debris_thickness)
+                                    else:
+                                        snowpack = None
             
-                            if i > 0:
-                                dsnow_t0 = dsnow[i-1]
-                                tsnow_t0 = tsnow[i-1]
-                                snow_tau_t0 = snow_tau[i-1]
+                                    # The decoupled debris below the surface is only updated at the end of each 
+                                    #  conduction step; snow-covered timesteps are coupled, so the conduction step ends 
+                                    #  at the previous timestep
+                                    coupled = (n_sub == 0 or i == 0 or not snow_free)
+                                    if coupled and i_conduction < i - 1:
+                                        Td_past, Qc_ice[i_conduction+1:i] = ConductionStep(
+                                                Td_past, Td, Ts_sum / (i - 1 - i_conduction), debris_thickness, N, h, 
+                                                C * (i - 1 - i_conduction), k, A_Crank, S_Crank)
+                                        Melt[i_conduction+1:i] = (Qc_ice[i-1] * debris_prms.delta_t / 
+                                                                  (debris_prms.density_ice * debris_prms.Lf))
+                                        Ts_sum = 0
+                                        i_conduction = i - 1
+                                    elif not coupled:
+                                        Td[1:N-1] = Td_past[1:N-1]
             
-                            # Initially assume Ts = Tair, for all other time steps assume it's equal to previous Ts
-                            if i == 0:
-                                Td[0,i] = Tair[i]
-                            else:
-                                Td[0,i] = Td[0,i-1]
+                                    # Initially assume Ts = Tair, for all other time steps assume it's equal to previous Ts
+                                    #  (or extrapolate from the previous time steps for the bracketed solver, or 
+                                    #  follow the surface temperature of the previous debris thickness)
+                                    if Ts_continuation is not None:
+                                        Td[0] = ts_solver.continuation_start(Td_record[0], Ts_continuation[:,MC], i)
+                                    elif args.option_ts_solver == 1:
+                                        Td[0] = ts_solver.warm_start(Td_record[0], i, Tair[i])
+                                    elif i == 0:
+                                        Td[0] = Tair[i]
+                                    else:
+                                        Td[0] = Td_past[0]
             
-                            # Calculate debris temperature profile for timestep i
-                            Td = CrankNicholson(Td, Tair, i, debris_thickness, N, h, C, a_Crank, b_Crank, c_Crank,
-                                                d_Crank, A_Crank, S_Crank)
+                                    # Calculate debris temperature profile for timestep i
+                                    if coupled:
+                                        Td = CrankNicholson(Td, Td_past, i, debris_thickness, N, h, C, A_Crank, 
+                                                            S_Crank)
             
-                            # Surface energy fluxes
-                            (F_Ts[i], Rn[i], LE[i], H_flux[i], P_flux[i], Qc[i], dF_Ts[i], dRn[i], dLE[i], dH_flux[i],
-                             dP_flux[i], dQc[i], dsnow[i], tsnow[i], snow_tau[i]) = (
-                                    calc_surface_fluxes(Td[:,i], Tair[i], RH_AWS[i], u_AWS[i], Sin[i], Lin_AWS[i],
-                                                        Rain_AWS[i], snow[i], P, albedo_AWS[i], k, a_neutral_debris,
-                                                        h, dsnow_t0, tsnow_t0, snow_tau_t0, ill_angle_rad[i],
-                                                        a_neutral_snow, debris_thickness,
-                                                        option_snow=debris_prms.option_snow,
-                                                        option_snow_fromAWS=debris_prms.option_snow_fromAWS, i_step=i))
+                                    # Surface energy fluxes
+                                    (F_Ts[i], Rn[i], LE[i], H_flux[i], P_flux[i], Qc[i], dF_Ts[i], dRn[i], dLE[i], dH_flux[i],
+                                     dP_flux[i], dQc[i], dsnow[i], tsnow[i], snow_tau[i]) = surface_fluxes(Td)
             
-                            # Newton-Raphson method to solve for surface temperature
-                            while abs(Td[0,i] - Ts_past[i]) > 0.01 and n_iterations[i] < debris_prms.n_iter_max:
+                                    # Warm-started, bracketed Newton method to solve for surface temperature
+                                    if args.option_ts_solver == 1:
+                                        Td[0], n_iterations[i], converged = ts_solver.newton_bracketed(
+                                                eval_Ts, Td[0], tol=0.01, n_iter_max=debris_prms.n_iter_max,
+                                                F0=F_Ts[i], dF0=dF_Ts[i])
+                                        if not converged:
+                                            print(lat_deg, lon_deg, 'debris_thickness:', debris_thickness, 
+                                                  'Timestep ', i, 'did not converge in ', n_iterations[i], 
+                                                  'iterations.')
+                                    
+                                    # Newton-Raphson method to solve for surface temperature
+                                    while (args.option_ts_solver == 0 and abs(Td[0] - Ts_past[i]) > 0.01 and 
+                                           n_iterations[i] < debris_prms.n_iter_max):
                                 
-#                                if i in [1022]:
-#                                    print(np.round(Td[0,i],2), np.round(Ts_past[i],2), 
-#                                          np.round(F_Ts[i],2), np.round(dF_Ts[i],2),
-#                                          '\n  Tair:', np.round(Tair[i],1), 'Rain:', np.round(Rain_AWS[i],5),
-#                                          'wind:', np.round(u_AWS[i],2), 'Sin:', np.round(Sin[i],0), 
-#                                          'Lin:', np.round(Lin_AWS[i],0), 
-#                                          '\n  Rn:', np.round(Rn[i],0), 'LE:', np.round(LE[i],0), 
-#                                          'H:', np.round(H_flux[i],0), 'Qc:', np.round(Qc[i],0), 
-#                                          'dsnow:', np.round(dsnow[i],4), 'snow:', np.round(snow[i],4)
-#                                          )
+        #                                if i in [1022]:
+        #                                    print(np.round(Td[0],2), np.round(Ts_past[i],2), 
+        #                                          np.round(F_Ts[i],2), np.round(dF_Ts[i],2),
+        #                                          '\n  Tair:', np.round(Tair[i],1), 'Rain:', np.round(Rain[i],5),
+        #                                          'wind:', np.round(u_AWS[i],2), 'Sin:', np.round(Sin[i],0), 
+        #                                          'Lin:', np.round(Lin_AWS[i],0), 
+        #                                          '\n  Rn:', np.round(Rn[i],0), 'LE:', np.round(LE[i],0), 
+        #                                          'H:', np.round(H_flux[i],0), 'Qc:', np.round(Qc[i],0), 
+        #                                          'dsnow:', np.round(dsnow[i],4), 'snow:', np.round(snow[i],4)
+        #                                          )
             
-                                n_iterations[i] = n_iterations[i] + 1
-                                Ts_past[i] = Td[0,i]
-                                # max step size is 1 degree C
-                                Td[0,i] = Ts_past[i] - F_Ts[i] /dF_Ts[i]
-                                if (Td[0,i] - Ts_past[i]) > 1:
-                                    Td[0,i] = Ts_past[i] + 1
-                                elif (Td[0,i] - Ts_past[i]) < -1:
-                                    Td[0,i] = Ts_past[i] - 1
+                                        n_iterations[i] = n_iterations[i] + 1
+                                        Ts_past[i] = Td[0]
+                                        # max step size is 1 degree C
+                                        Td[0] = Ts_past[i] - F_Ts[i] /dF_Ts[i]
+                                        if (Td[0] - Ts_past[i]) > 1:
+                                            Td[0] = Ts_past[i] + 1
+                                        elif (Td[0] - Ts_past[i]) < -1:
+                                            Td[0] = Ts_past[i] - 1
             
-                                # Debris temperature profile for timestep i
-                                Td = CrankNicholson(Td, Tair, i, debris_thickness, N, h, C, a_Crank, b_Crank, c_Crank,
-                                                    d_Crank, A_Crank, S_Crank)
+                                        # Debris temperature profile for timestep i
+                                        if coupled:
+                                            Td = CrankNicholson(Td, Td_past, i, debris_thickness, N, h, C, A_Crank, 
+                                                                S_Crank)
             
-                                # Surface energy fluxes
-                                (F_Ts[i], Rn[i], LE[i], H_flux[i], P_flux[i], Qc[i], dF_Ts[i], dRn[i], dLE[i], dH_flux[i],
-                                 dP_flux[i], dQc[i], dsnow[i], tsnow[i], snow_tau[i]) = (
-                                        calc_surface_fluxes(Td[:,i], Tair[i], RH_AWS[i], u_AWS[i], Sin[i], Lin_AWS[i],
-                                                            Rain_AWS[i], snow[i], P, albedo_AWS[i], k, a_neutral_debris,
-                                                            h, dsnow_t0, tsnow_t0, snow_tau_t0, ill_angle_rad[i],
-                                                            a_neutral_snow, debris_thickness,
-                                                            option_snow=debris_prms.option_snow,
-                                                            option_snow_fromAWS=debris_prms.option_snow_fromAWS, 
-                                                            i_step=i))
+                                        # Surface energy fluxes
+                                        (F_Ts[i], Rn[i], LE[i], H_flux[i], P_flux[i], Qc[i], dF_Ts[i], dRn[i], dLE[i], dH_flux[i],
+                                         dP_flux[i], dQc[i], dsnow[i], tsnow[i], snow_tau[i]) = surface_fluxes(Td)
             
-                                if n_iterations[i] == debris_prms.n_iter_max:
-                                    Td[0,i] = (Td[0,i] + Ts_past[i]) / 2
-                                    print(lat_deg, lon_deg, 'debris_thickness:', debris_thickness, 'Timestep ', i, 
-                                          'maxed out at ', n_iterations[i], 'iterations.')
+                                        if n_iterations[i] == debris_prms.n_iter_max:
+                                            Td[0] = (Td[0] + Ts_past[i]) / 2
+                                            print(lat_deg, lon_deg, 'debris_thickness:', debris_thickness, 'Timestep ', i, 
+                                                  'maxed out at ', n_iterations[i], 'iterations.')
             
-                            Qc_ice[i] = k * (Td[N-2,i] - Td[N-1,i]) / h
-                            if Qc_ice[i] < 0:
-                                Qc_ice[i] = 0
-                            # Melt [m ice]
-                            Melt[i] = Qc_ice[i] * debris_prms.delta_t / (debris_prms.density_ice * debris_prms.Lf)
+                                    if coupled:
+                                        Qc_ice[i] = k * (Td[N-2] - Td[N-1]) / h
+                                        if Qc_ice[i] < 0:
+                                            Qc_ice[i] = 0
+                                        # Melt [m ice]
+                                        Melt[i] = (Qc_ice[i] * debris_prms.delta_t / 
+                                                   (debris_prms.density_ice * debris_prms.Lf))
+                                        i_conduction = i
+                                    
+                                    # Conduction step of the decoupled debris with the mean surface temperature of 
+                                    #  the step
+                                    else:
+                                        Ts_sum += Td[0]
+                                        if debris_layers.conduction_step_end(i, n_sub, nsteps):
+                                            Td, Qc_ice[i_conduction+1:i+1] = ConductionStep(
+                                                    Td, Td_past, Ts_sum / (i - i_conduction), debris_thickness, N, h, 
+                                                    C * (i - i_conduction), k, A_Crank, S_Crank)
+                                            # Melt [m ice] spread evenly over the timesteps of the conduction step
+                                            Melt[i_conduction+1:i+1] = (
+                                                    Qc_ice[i] * debris_prms.delta_t / 
+                                                    (debris_prms.density_ice * debris_prms.Lf))
+                                            Ts_sum = 0
+                                            i_conduction = i
+                                    
+                                    Td_record[0,i] = Td[0]
+                                    Td_record[1,i] = Td[N-2]
             
-                        Melt_all[:,MC] = Melt
-                        dsnow_all[:,MC] = dsnow
-                        Ts_all[:,MC] = Td[0,:]
+                            melt_stats.update(Melt)
+                            dsnow_stats.update(dsnow)
+                            ts_stats.update(Td_record[0,:])
+                            n_iter_hist_slab = ts_solver.update_iteration_histogram(n_iter_hist_slab, n_iterations)
+                            if args.option_ts_continuation == 1:
+                                Ts_hd[:,MC] = Td_record[0,:]
             
-                        if debug:
-                            print(lat_deg, lon_deg, 'hd [m]:', debris_thickness, 
-                                  '  Melt[m ice/yr]:', np.round(np.sum(Melt) / (len(Melt) / 24 / 365),3), 
-                                  'Ts_max[degC]:', np.round(np.max(Td[0,:]),1), 
-                                  'Ts_min[degC]:', np.round(np.min(Td[0,:]),1))
+                            if debug:
+                                print(lat_deg, lon_deg, 'hd [m]:', debris_thickness, 
+                                      '  Melt[m ice/yr]:', np.round(np.sum(Melt) / (len(Melt) / 24 / 365),3), 
+                                      'Ts_max[degC]:', np.round(np.max(Td_record[0,:]),1), 
+                                      'Ts_min[degC]:', np.round(np.min(Td_record[0,:]),1))
+                        if args.option_ts_continuation == 1:
+                            Ts_continuation = Ts_hd
 
                 #%% ===== CLEAN ICE MODEL =============================================================================
                 else:
@@ -1419,8 +2328,8 @@ def main(list_packed_vars):
                     if debug:
                         print('Clean ice model')
             
-                    Melt_all = np.zeros((Tair_AWS.shape[0],debris_prms.mc_simulations))
-                    dsnow_all = np.zeros((Tair_AWS.shape[0],debris_prms.mc_simulations))
+                    melt_stats = mc_stats.MCStats(nsteps)
+                    dsnow_stats = mc_stats.MCStats(nsteps)
                     for MC in range(debris_prms.mc_simulations):
                         if debug:
                             print('  properties iteration ', MC)
@@ -1429,7 +2338,9 @@ def main(list_packed_vars):
                         albedo = debris_prms.albedo_random_ice[MC]
                         z0 = debris_prms.z0_random_ice[MC]
                         z0_snow = debris_prms.z0_random_snow[MC]
-                        Sin = Sin * debris_prms.sin_factor_random[MC]
+                        # incoming shortwave radiation of this MC simulation (scaled from the forcing, not from the
+                        #  previous simulation)
+                        Sin = Sin_timeseries * debris_prms.sin_factor_random[MC]
                         
                         if debug:
                             print('  MC:', MC, albedo, z0, debris_prms.sin_factor_random[MC])
@@ -1441,77 +2352,23 @@ def main(list_packed_vars):
                         a_neutral_snow = debris_prms.Kvk**2/(np.log(debris_prms.za/z0_snow))**2
                         # Adjust wind speed from sensor height to 2 m accounting for surface roughness
                         u_AWS = u_AWS_raw*(np.log(2/z0)/(np.log(debris_prms.zw/z0)))
-                        # Pressure (barometric pressure formula)
-                        P = debris_prms.P0*np.exp(-0.0289644*9.81*Elevation_pixel/(8.31447*288.15))
-                    
-                        # Air temperature
-                        Tair = Tair_AWS + lapserate*(Elevation_pixel-Elev_AWS)
-                        # Snow [m]
-                        if debris_prms.option_snow_fromAWS == 1:
-                            if Snow_AWS == None:
-                                print('\n\nNO SNOW DEPTH FROM AWS\n\n')
-                            else:
-                                snow = Snow_AWS.copy()    
-                        else:
-                            snow = Rain_AWS.copy()
-                            snow[Tair > debris_prms.Tsnow_threshold] = 0
-                            snow[snow < debris_prms.snow_min] = 0
-                            Rain_AWS[Tair <= debris_prms.Tsnow_threshold] = 0
-                            Rain_AWS[Rain_AWS < debris_prms.rain_min] = 0
-            
-                        # Solar information
-                        zenith_angle_rad, azimuth_angle_rad, rm_r2 = (
-                                solar_calcs_NOAA(year, julian_day_of_year, time_frac, lon_deg_pixel, lat_deg_pixel, 
-                                                 nsteps))
-                        # Illumination angle / angle of Incidence b/w normal to grid slope at AWS and solar beam
-                        #  if slope & aspect are 0 degrees, then this is equal to the zenith angle
-                        ill_angle_rad = (np.arccos(np.cos(slope_rad) * np.cos(zenith_angle_rad) + np.sin(slope_rad) *
-                                         np.sin(zenith_angle_rad) * np.cos(azimuth_angle_rad - aspect_rad)))
                         
-                        # ===== CLEAN ICE GLACIER ENERGY BALANCE MODEL =====                    
-                        Rn = np.zeros((nsteps))
-                        LE = np.zeros((nsteps))
-                        H_flux = np.zeros((nsteps))
-                        Qc = np.zeros((nsteps))
-                        P_flux = np.zeros((nsteps))
-                        F_Ts = np.zeros((nsteps))
-                        Qc_ice = np.zeros((nsteps))
-                        Melt = np.zeros((nsteps))
-                        dsnow = np.zeros((nsteps))      # snow depth [mwe]
-                        tsnow = np.zeros((nsteps))      # snow temperature [K]
-                        snow_tau = np.zeros((nsteps))   # non-dimensional snow age
+                        # ===== CLEAN ICE GLACIER ENERGY BALANCE MODEL =====
+                        #  snow-free timesteps computed as whole arrays, snowpack stepped through where present
                         Td = None
                         n_iterations = None
                         Qc_ice = None
-            
-                        # Initial values
-                        dsnow_t0 = 0
-                        tsnow_t0 = 273.15
-                        snow_tau_t0 = 0
-            
-                        for i in np.arange(0,nsteps):
-            
-                            if i > 0:
-                                dsnow_t0 = dsnow[i-1]
-                                tsnow_t0 = tsnow[i-1]
-                                snow_tau_t0 = snow_tau[i-1]
-                            
-                            # Clean ice energy balance model with evolving snowpack
-                            F_Ts[i], Rn[i], LE[i], H_flux[i], P_flux[i], Qc[i], dsnow[i], tsnow[i], snow_tau[i] = (
-                                    calc_surface_fluxes_cleanice(Tair[i], RH_AWS[i], u_AWS[i], Sin[i], Lin_AWS[i], 
-                                                                 Rain_AWS[i], snow[i], P, albedo, a_neutral_ice, dsnow_t0, 
-                                                                 tsnow_t0, snow_tau_t0, ill_angle_rad[i], a_neutral_snow,
-                                                                 option_snow=debris_prms.option_snow, 
-                                                                 option_snow_fromAWS=debris_prms.option_snow_fromAWS, 
-                                                                 i_step=i))
-    
-                            # Melt [m ice]
-                            if F_Ts[i] > 0:
-                                # Melt [m ice]
-                                Melt[i] = F_Ts[i] * debris_prms.delta_t / (debris_prms.density_ice * debris_prms.Lf)
+                        F_Ts, Rn, LE, H_flux, P_flux, Qc, dsnow, tsnow, snow_tau = (
+                                cleanice_eb(Tair, eZ, u_AWS, Sin, Lin_AWS, Rain, snow, P, density_air, albedo,
+                                            a_neutral_ice, ill_angle_rad, a_neutral_snow,
+                                            option_snow=debris_prms.option_snow,
+                                            option_snow_fromAWS=debris_prms.option_snow_fromAWS))
+                        # Melt [m ice]
+                        Melt = np.where(F_Ts > 0, F_Ts * debris_prms.delta_t / (debris_prms.density_ice * 
+                                                                                 debris_prms.Lf), 0)
                 
-                        Melt_all[:,MC] = Melt
-                        dsnow_all[:,MC] = dsnow
+                        melt_stats.update(Melt)
+                        dsnow_stats.update(dsnow)
                         
                         if debug:
                             print(lat_deg, lon_deg, 'hd [m]:', debris_thickness, 
@@ -1520,35 +2377,30 @@ def main(list_packed_vars):
                 # EXPORT OUTPUT
                 if debug:
                         print('Summary:', lat_deg, lon_deg, 'hd [m]:', debris_thickness, 
-                              '  Melt[m ice/yr]:', np.round(np.sum(Melt_all.mean(axis=1)) / (len(Melt) / 24 / 365),3))
+                              '  Melt[m ice/yr]:', np.round(np.sum(melt_stats.mean()) / (nsteps / 24 / 365),3))
                         
                 # RECORD OUTPUT
-                output_ds_all['melt'].values[n_thickness,:,nelev] = (
-                        Melt_all.mean(axis=1) * debris_prms.density_ice / debris_prms.density_water)
-                output_ds_all['snow_depth'].values[n_thickness,:,nelev] = dsnow_all.mean(axis=1)
-                if debris_thickness > 0:
-                    output_ds_all['ts'].values[n_thickness,:,nelev] = Ts_all.mean(axis=1)
-                if 'std' in debris_prms.mc_stat_cns:
-                    output_ds_all['melt_std'].values[n_thickness,:,nelev] = (
-                        Melt_all.std(axis=1) * debris_prms.density_ice / debris_prms.density_water)
-                    output_ds_all['snow_depth_std'].values[n_thickness,:,nelev] = dsnow_all.std(axis=1)
-                    if debris_thickness > 0:
-                        output_ds_all['ts_std'].values[n_thickness,:,nelev] = Ts_all.std(axis=1)
-                if 'med' in debris_prms.mc_stat_cns:
-                    output_ds_all['melt_med'].values[n_thickness,:,nelev] = (
-                        np.median(Melt_all, axis=1) * debris_prms.density_ice / debris_prms.density_water)
-                    output_ds_all['snow_depth_med'].values[n_thickness,:,nelev] = np.median(dsnow_all, axis=1)
-                    if debris_thickness > 0:
-                        output_ds_all['ts_med'].values[n_thickness,:,nelev] = np.median(Ts_all, axis=1)
-                if 'mad' in debris_prms.mc_stat_cns:
-                    output_ds_all['melt_mad'].values[n_thickness,:,nelev] = (
-                        median_absolute_deviation(Melt_all, axis=1) 
-                        * debris_prms.density_ice / debris_prms.density_water)
-                    output_ds_all['snow_depth_mad'].values[n_thickness,:,nelev] = (
-                            median_absolute_deviation(dsnow_all, axis=1))
+                output_slab = {}
+                for stat_cn in debris_prms.mc_stat_cns:
+                    if stat_cn == 'mean':
+                        stat_str = ''
+                    else:
+                        stat_str = '_' + stat_cn
+                    output_slab['melt' + stat_str] = (
+                            melt_stats.stat(stat_cn) * debris_prms.density_ice / debris_prms.density_water)
+                    output_slab['snow_depth' + stat_str] = dsnow_stats.stat(stat_cn)
+                    # clean ice surface temperature is not modeled (recorded as zero)
                     if debris_thickness > 0:
-                        output_ds_all['ts_mad'].values[n_thickness,:,nelev] = (
-                                median_absolute_deviation(Ts_all, axis=1))
+                        output_slab['ts' + stat_str] = ts_stats.stat(stat_cn)
+                    else:
+                        output_slab['ts' + stat_str] = np.zeros(nsteps)
+                if debris_prms.option_hd_adaptive == 1:
+                    hd_sampler.record(n_thickness, output_slab)
+                else:
+                    record_output(n_thickness, nelev, output_slab)
+                n_iter_hist += n_iter_hist_slab
+                if checkpoint is not None:
+                    checkpoint.save(nelev, n_thickness, output_slab, n_iter_hist=n_iter_hist_slab)
                         
 #                # Kennicott check
 #                print('\nKENNICOTT CHECK - DELETE ME ONCE DONE, DO WE NEED THE MEDIAN?')
@@ -1561,30 +2413,39 @@ def main(list_packed_vars):
 #                print('      5%:', np.round(melt_5[153048:154488].sum() / (6437-6377) * 1000,1))
 #                print('     95%:', np.round(melt_95[153048:154488].sum() / (6437-6377) * 1000,1))
                         
+            # Simulated and interpolated debris thicknesses
+            if debris_prms.option_hd_adaptive == 1:
+                for n_thickness in range(debris_thickness_all.shape[0]):
+                    record_output(n_thickness, nelev, hd_sampler.output_slab(n_thickness))
+                output_ds_all.attrs['hd_cm_simulated_' + str(elev)] = (
+                        output_ds_all.hd_cm.values[hd_sampler.simulated()].astype(np.int32))
+                if debug:
+                    print(lat_deg, lon_deg, 'elev:', elev, 'simulated', len(hd_sampler.simulated()), 'of', 
+                          debris_thickness_all.shape[0], 'debris thicknesses in', hd_sampler.n_batches, 'batches')
+            
+        # Surface temperature solver telemetry (the continuation changes the surface temperature, see getparser)
+        output_ds_all.attrs.update(ts_solver.iteration_attrs(n_iter_hist))
+        output_ds_all.attrs['ts_continuation'] = int(args.option_ts_continuation)
+        if output_ds_all.attrs['ts_solver_nonconverged_steps'] > 0 or debug:
+            print(lat_deg, lon_deg, 'surface temperature iterations per timestep:', 
+                  np.round(output_ds_all.attrs['ts_solver_iterations_mean'],2), ' not converged:', 
+                  output_ds_all.attrs['ts_solver_nonconverged_steps'], 'of', output_ds_all.attrs['ts_solver_steps'], 
+                  'timesteps')
             
         # ===== EXPORT OUTPUT DATASET ===== 
-        output_fp = debris_prms.output_fp + 'exp' + str(debris_prms.experiment_no) + '/' + debris_prms.roi + '/'
-        if os.path.exists(output_fp) == False:
-            os.makedirs(output_fp)
-        # add MC string and count string
-        if debris_prms.experiment_no == 3:
-            mc_str = ''
-            count_str = ''
-        else:
-            mc_str = str(int(debris_prms.mc_simulations)) + 'MC_'
-            count_str = '--' + str(count)
-        # Latitude string
-        if lat_deg < 0:
-            lat_str = 'S-'
-        else:
-            lat_str = 'N-'
-        output_ds_fn = (debris_prms.fn_prefix + str(int(abs(lat_deg)*100)) + lat_str + str(int(lon_deg*100)) + 'E-'
-                        + mc_str + debris_prms.date_start + count_str + '.nc')
-        # Export netcdf
-        output_ds_all.to_netcdf(output_fp + output_ds_fn, encoding=encoding)
+        if debris_prms.option_output_hourly == 1 and not emulated:
+            if debris_prms.option_output_incremental == 1:
+                output_writer.close(attrs=output_ds_all.attrs)
+            else:
+                output_ds_all.to_netcdf(output_fp + output_ds_fn, encoding=encoding)
+        if debris_prms.option_output_daily == 1 or emulated:
+            ds_ostrem.attrs = output_ds_all.attrs
+            ds_ostrem.to_netcdf(ostrem_fp + ds_ostrem_fn, encoding=encoding_ostrem)
+        if checkpoint is not None:
+            checkpoint.mark_completed()
                 
     if debug:
-        return (time_pd, Tair_AWS, RH_AWS, u_AWS, Rain_AWS, snow, Sin_AWS, Lin_AWS, Elev_AWS, Snow_AWS, Td, 
+        return (time_pd, Tair_AWS, RH_AWS, u_AWS, Rain, snow, Sin_AWS, Lin_AWS, Elev_AWS, Snow_AWS, Td, 
                 n_iterations, LE, Rn, H_flux, Qc, P_flux, F_Ts, Qc_ice, Melt, dsnow, tsnow, snow_tau, output_ds_all)
                 
 #%%
@@ -1597,6 +2458,15 @@ if __name__ == '__main__':
         debug = True
     else:
         debug = False
+        
+    # The warm-started, bracketed Newton solver is only implemented in the energy balance model in Python that runs 
+    #  one MC simulation at a time
+    assert args.option_ts_solver == 0 or (args.option_numba == 0 and args.option_vectorized == 0 and 
+                                          args.option_hd_lockstep == 0), (
+            'option_ts_solver requires option_numba, option_vectorized and option_hd_lockstep to be 0')
+    # The elevations are only simulated together by the vectorized model
+    assert args.option_elev_lockstep == 0 or args.option_vectorized == 1 or args.option_hd_lockstep == 1, (
+            'option_elev_lockstep requires option_vectorized or option_hd_lockstep')
 
     time_start = time.time()
     
@@ -1609,48 +2479,58 @@ if __name__ == '__main__':
 
     # Number of cores for parallel processing
     if args.option_parallels != 0:
-        if len(latlon_list) == 1 and debris_prms.experiment_no == 4:
-            num_cores = int(np.min([len(debris_prms.debris_thickness_all), args.num_simultaneous_processes]))
-        else:
-            num_cores = int(np.min([len(latlon_list), args.num_simultaneous_processes]))
+        num_cores = args.num_simultaneous_processes
     else:
         num_cores = 1
 
-    # Glacier number lists to pass for parallel processing
-    latlon_lsts = split_list(latlon_list, n=num_cores, option_ordered=args.option_ordered)
-    
-    # Debris thicknesses
-    if len(latlon_list) == 1 and debris_prms.experiment_no == 4:
-        hd_lsts = split_list(debris_prms.debris_thickness_all.tolist(), n=num_cores, option_ordered=args.option_ordered)
-
-    # Pack variables for multiprocessing
-    # Option to run various debris thicknesses in parallel
-    if len(latlon_list) == 1 and debris_prms.experiment_no == 4:
-        list_packed_vars = []
-        for count, hd_lst in enumerate(hd_lsts):
-            list_packed_vars.append([count, latlon_list, hd_lst])
-    # Option to run latitude and longitudes in parallel
+    # Debris thicknesses of each task: in experiment 4, the debris thicknesses of each grid cell are split into blocks 
+    #  when there are too few grid cells to keep all cores busy (each block is exported to its own file and the files
+    #  are merged below); the adaptive debris thicknesses are chosen from all of them
+    if args.task_fp is not None:
+        # the grid cells are claimed from the task ledger as a whole
+        n_hd_blocks = 1
+    elif debris_prms.experiment_no == 4 and debris_prms.option_hd_adaptive == 0:
+        n_hd_blocks = scheduler.n_blocks(len(latlon_list), len(debris_prms.debris_thickness_all), num_cores)
     else:
-        list_packed_vars = []
-        for count, latlon_lst in enumerate(latlon_lsts):
-            list_packed_vars.append([count, latlon_lst, debris_prms.debris_thickness_all])
+        n_hd_blocks = 1
+    hd_lsts = split_list(debris_prms.debris_thickness_all.tolist(), n=n_hd_blocks, option_ordered=args.option_ordered)
+    # The surface temperature depends on the initial guess of the solver (within its step size tolerance), so with the 
+    #  continuation the output would depend on the blocks of debris thicknesses and on where a checkpoint resumed
+    if args.option_ts_continuation == 1 and (n_hd_blocks > 1 or debris_prms.option_checkpoint == 1):
+        print('option_ts_continuation is not used with blocks of debris thicknesses or checkpoints')
+        args.option_ts_continuation = 0
+
+    # Pack variables for multiprocessing: one task for each grid cell and block of debris thicknesses
+    list_packed_vars = []
+    task_costs = []
+    task_labels = []
+    for latlon in latlon_list:
+        for hd_lst in hd_lsts:
+            list_packed_vars.append([len(list_packed_vars), [latlon], hd_lst])
+            task_costs.append(scheduler.meltmodel_cost(hd_lst))
+            task_labels.append(str(latlon[0]) + '_' + str(latlon[1]) + '_hd' + 
+                               '-'.join([str(int(np.round(x*100))) for x in hd_lst]))
         
-    # Parallel processing
+    # Tasks are issued longest first to the processes as they become free
     if args.option_parallels != 0:
         print('Processing in parallel with ' + str(args.num_simultaneous_processes) + ' cores...')
-        with multiprocessing.Pool(args.num_simultaneous_processes) as p:
-            p.map(main,list_packed_vars)
-    # If not in parallel, then only should be one loop
+    if args.task_fp is not None:
+        # Coordinator mode: the processes of every node claim the grid cells from the ledger until none are left 
+        #  (the grid cells processed by this node are merged below)
+        latlon_list, df_timings = task_ledger.run_workers(
+                main, args.task_fp, func_args=[debris_prms.debris_thickness_all.tolist()], 
+                cost=scheduler.meltmodel_cost(debris_prms.debris_thickness_all), num_processes=num_cores, 
+                option_parallels=args.option_parallels,
+                timings_fn='meltmodel_global_batch' + str(args.batchno) + '_timings.csv')
     else:
-        # Loop through the chunks and export bias adjustments
-        for n in range(len(list_packed_vars)):
-            if debug and num_cores == 1:
-                (time_pd, Tair_AWS, RH_AWS, u_AWS, Rain_AWS, snow, Sin_AWS, Lin_AWS, Elev_AWS, Snow_AWS, Td, 
-                 n_iterations, LE, Rn, H_flux, Qc, P_flux, F_Ts, Qc_ice, Melt, dsnow, tsnow, snow_tau, 
-                 output_ds_all) = (
-                         main(list_packed_vars[n]))
-            else:
-                main(list_packed_vars[n])
+        results, df_timings = scheduler.run_tasks(
+                main, list_packed_vars, costs=task_costs, num_processes=num_cores, 
+                option_parallels=args.option_parallels, task_labels=task_labels, 
+                timings_fn='meltmodel_global_batch' + str(args.batchno) + '_timings.csv')
+    if debug and args.option_parallels == 0 and args.task_fp is None:
+        (time_pd, Tair_AWS, RH_AWS, u_AWS, Rain_AWS, snow, Sin_AWS, Lin_AWS, Elev_AWS, Snow_AWS, Td, 
+         n_iterations, LE, Rn, H_flux, Qc, P_flux, F_Ts, Qc_ice, Melt, dsnow, tsnow, snow_tau, 
+         output_ds_all) = results[-1]
                 
     
     # Merge the datasets for experiment 4
@@ -1669,21 +2549,29 @@ if __name__ == '__main__':
                 if i.startswith(ds_prefix + '--') and i.endswith('.nc'):
                     fns_2merge.append(i)
             fns_2merge = sorted(fns_2merge)
-            # MERGE AND EXPORT
-            if len(fns_2merge) == num_cores:
-                ds_all = None
-                for fn in fns_2merge:
-                    ds = xr.open_dataset(output_fp + fn)
-                    # Merge datasets of stats into one output
-                    if ds_all is None:
-                        ds_all = ds
-                    else:
-                        ds_all = xr.concat([ds_all, ds], 'hd_cm')
-                ds_all = ds_all.sortby('hd_cm')
-                ds_all.to_netcdf(output_fp + ds_prefix + '.nc')
+            # MERGE AND EXPORT (each debris thickness is copied into its index of the merged file)
+            if len(fns_2merge) == n_hd_blocks:
+                merge_parts([output_fp + fn for fn in fns_2merge], output_fp + ds_prefix + '.nc')
             # Clean up directory
             for fn in fns_2merge:
                 os.remove(output_fp + fn)
+                
+            # Daily melt
+            if debris_prms.option_output_daily == 1:
+                ostrem_fp = debris_prms.ostrem_fp + 'exp' + str(debris_prms.experiment_no) + '/'
+                ds_ostrem_fn = debris_prms.ostrem_fn_sample.replace(
+                        'XXXX', str(int(abs(lat_deg)*100)) + lat_str + str(int(lon_deg*100)) + 'E-')
+                fns_2merge = []
+                for i in os.listdir(ostrem_fp):
+                    if i.startswith(ds_ostrem_fn.replace('.nc', '--')) and i.endswith('.nc'):
+                        fns_2merge.append(i)
+                fns_2merge = sorted(fns_2merge)
+                # MERGE AND EXPORT
+                if len(fns_2merge) == n_hd_blocks:
+                    merge_parts([ostrem_fp + fn for fn in fns_2merge], ostrem_fp + ds_ostrem_fn)
+                # Clean up directory
+                for fn in fns_2merge:
+                    os.remove(ostrem_fp + fn)
             
                             
     print('\nProcessing time of :',time.time()-time_start, 's')
@@ -2,12 +2,19 @@
 #SBATCH --partition=debug
 #SBATCH --ntasks=48
 #SBATCH --tasks-per-node=24
+# The wall time can be sized from the runtime of the batches predicted by the cost model calibrated with the timings 
+#  of previous runs (see debrisglobal/cost_model.py), e.g., for ROI 11 on 2 nodes:
+#    python spc_split_lists.py -n_batches=2 -option_cost=1
+#    sbatch --nodes=2 --time=$(cat 11_batch_walltime.txt) spc_run_meltmodel.sh
 
 echo partition: $SLURM_JOB_PARTITION
 echo num_nodes: $SLURM_JOB_NUM_NODES nodes: $SLURM_JOB_NODELIST
 echo num_tasks: $SLURM_NTASKS tasks_node: $SLURM_NTASKS_PER_NODE
 
 ORDERED_SWITCH=1
+# switch to claim the grid cells from a task ledger shared by the nodes (1) or to split them into batches (0)
+COORDINATOR_SWITCH=0
+COST_SWITCH=1
 
 # activate environment
 module load lang/Anaconda3/2.5.0
@@ -17,30 +24,43 @@ ROI="11"
 # region batch string
 latlon_batch_str="${ROI}_latlon_batch"
 
-# split glaciers into batches for different nodes
-python spc_split_lists.py -n_batches=$SLURM_JOB_NUM_NODES -option_ordered=$ORDERED_SWITCH
+if [ $COORDINATOR_SWITCH -eq 1 ]
+then
+  # task ledger shared by the nodes: the processes of every node claim the grid cells until none are left
+  TASK_FP="${ROI}_tasks_meltmodel/"
+  python spc_split_lists.py -n_batches=$SLURM_JOB_NUM_NODES -option_cost=$COST_SWITCH -num_simultaneous_processes=24 -task_fp=$TASK_FP
+  
+  for BATCHNO in $(seq 0 $(($SLURM_JOB_NUM_NODES - 1)))
+  do
+    srun -N 1 -n 1 python meltmodel_global.py -num_simultaneous_processes=24 -task_fp=$TASK_FP -batchno=$BATCHNO&
+  done
+  wait
+else
+  # split glaciers into batches for different nodes
+  python spc_split_lists.py -n_batches=$SLURM_JOB_NUM_NODES -option_ordered=$ORDERED_SWITCH -option_cost=$COST_SWITCH -num_simultaneous_processes=24
 
-# list  batch filenames
-latlon_fns=$(find ${latlon_batch_str}*)
-echo latlon filenames:$latlon_fns
-# create list
-list_latlon_fns=($latlon_fns)
-echo first_batch:${list_latlon_fns[0]}
+  # list  batch filenames
+  latlon_fns=$(find ${latlon_batch_str}*)
+  echo latlon filenames:$latlon_fns
+  # create list
+  list_latlon_fns=($latlon_fns)
+  echo first_batch:${list_latlon_fns[0]}
 
 
-for i in $latlon_fns 
-do
-  # print the filename
-  echo $i
+  for i in $latlon_fns 
+  do
+    # print the filename
+    echo $i
   
-  # determine batch number
-  BATCHNO="$(cut -d'.' -f1 <<<$(cut -d'_' -f6 <<<"$i"))"
-  echo $BATCHNO
+    # determine batch number
+    BATCHNO="$(cut -d'.' -f1 <<<$(cut -d'_' -f4 <<<"$i"))"
+    echo $BATCHNO
   
-  # run the file on a separate node (& tells the command to move to the next loop for any empty nodes)
-  srun -N 1 -n 1 python meltmodel_global.py -num_simultaneous_processes=24 -latlon_fn=$i&
-done
-# wait tells the loop to not move on until all the srun commands are completed
-wait
+    # run the file on a separate node (& tells the command to move to the next loop for any empty nodes)
+    srun -N 1 -n 1 python meltmodel_global.py -num_simultaneous_processes=24 -latlon_fn=$i -batchno=$BATCHNO&
+  done
+  # wait tells the loop to not move on until all the srun commands are completed
+  wait
+fi
 
 echo -e "\nScript finished"
@@ -8,6 +8,8 @@ echo num_nodes: $SLURM_JOB_NUM_NODES nodes: $SLURM_JOB_NODELIST
 echo num_tasks: $SLURM_NTASKS tasks_node: $SLURM_NTASKS_PER_NODE
 
 ORDERED_SWITCH=1
+# switch to claim the grid cells from a task ledger shared by the nodes (1) or to split them into batches (0)
+COORDINATOR_SWITCH=0
 
 # activate environment
 module load lang/Anaconda3/2.5.0
@@ -17,30 +19,43 @@ ROI="HMA"
 # region batch string
 latlon_batch_str="${ROI}_latlon_batch"
 
-# split glaciers into batches for different nodes
-python spc_split_lists.py -n_batches=$SLURM_JOB_NUM_NODES -option_ordered=$ORDERED_SWITCH
-
-# list  batch filenames
-latlon_fns=$(find ${latlon_batch_str}*)
-echo latlon filenames:$latlon_fns
-# create list
-list_latlon_fns=($latlon_fns)
-echo first_batch:${list_latlon_fns[0]}
-
-
-for i in $latlon_fns 
-do
-  # print the filename
-  echo $i
+if [ $COORDINATOR_SWITCH -eq 1 ]
+then
+  # task ledger shared by the nodes: the processes of every node claim the grid cells until none are left
+  TASK_FP="${ROI}_tasks_meltcurves/"
+  python spc_split_lists.py -n_batches=$SLURM_JOB_NUM_NODES -task_fp=$TASK_FP
+  
+  for BATCHNO in $(seq 0 $(($SLURM_JOB_NUM_NODES - 1)))
+  do
+    srun -N 1 -n 1 python meltcurves.py -plotfigs=0 -num_simultaneous_processes=24 -task_fp=$TASK_FP -batchno=$BATCHNO&
+  done
+  wait
+else
+  # split glaciers into batches for different nodes
+  python spc_split_lists.py -n_batches=$SLURM_JOB_NUM_NODES -option_ordered=$ORDERED_SWITCH
+
+  # list  batch filenames
+  latlon_fns=$(find ${latlon_batch_str}*)
+  echo latlon filenames:$latlon_fns
+  # create list
+  list_latlon_fns=($latlon_fns)
+  echo first_batch:${list_latlon_fns[0]}
+
+
+  for i in $latlon_fns 
+  do
+    # print the filename
+    echo $i
   
-  # determine batch number
-  BATCHNO="$(cut -d'.' -f1 <<<$(cut -d'_' -f6 <<<"$i"))"
-  echo $BATCHNO
+    # determine batch number
+    BATCHNO="$(cut -d'.' -f1 <<<$(cut -d'_' -f6 <<<"$i"))"
+    echo $BATCHNO
   
-  # run the file on a separate node (& tells the command to move to the next loop for any empty nodes)
-  srun -N 1 -n 1 python meltcurves.py -plotfigs=0 -num_simultaneous_processes=24 -latlon_fn=$i&
-done
-# wait tells the loop to not move on until all the srun commands are completed
-wait
+    # run the file on a separate node (& tells the command to move to the next loop for any empty nodes)
+    srun -N 1 -n 1 python meltcurves.py -plotfigs=0 -num_simultaneous_processes=24 -latlon_fn=$i&
+  done
+  # wait tells the loop to not move on until all the srun commands are completed
+  wait
+fi
 
 echo -e "\nScript finished"
@@ -5,10 +5,14 @@ import argparse
 import os
 # External libraries
 import numpy as np
+import pandas as pd
 import pickle
 # Local libraries
 #import globaldebris_input as input
 import debrisglobal.globaldebris_input as debris_prms
+import debrisglobal.cost_model as cost_model
+import debrisglobal.scheduler as scheduler
+import debrisglobal.task_ledger as task_ledger
 
 
 def getparser():
@@ -27,6 +31,14 @@ def getparser():
         option to keep glaciers ordered or to grab every n value for the batch
         (the latter helps make sure run times on each core are similar as it removes any timing differences caused by 
          regional variations)
+    option_cost : int
+        switch to balance the batches with the runtime of each grid cell predicted by the cost model, calibrated with 
+        the timings of previous runs, and to export the predicted runtime of each batch (1) or not (0)
+    num_simultaneous_processes (optional) : int
+        number of cores used on each node (to predict the runtime of each batch)
+    task_fp (optional) : str
+        directory of the task ledger shared by the nodes, created instead of the batches (see 
+        debrisglobal/task_ledger.py)
         
     Returns
     -------
@@ -40,10 +52,16 @@ def getparser():
                         help='switch to include the region name or not in the batch filenames')
     parser.add_argument('-option_ordered', action='store', type=int, default=1,
                         help='switch to keep lists ordered or not')
+    parser.add_argument('-option_cost', action='store', type=int, default=0,
+                        help='switch to balance the batches with the predicted runtime of each grid cell')
+    parser.add_argument('-num_simultaneous_processes', action='store', type=int, default=24,
+                        help='number of cores used on each node')
+    parser.add_argument('-task_fp', action='store', type=str, default=None,
+                        help='directory of the task ledger created instead of the batches')
     return parser
 
 
-def split_list(lst, n=1, option_ordered=1):
+def split_list(lst, n=1, option_ordered=1, costs=None):
     """
     Split list into batches for the supercomputer.
     
@@ -53,6 +71,10 @@ def split_list(lst, n=1, option_ordered=1):
         List that you want to split into separate batches
     n : int
         Number of batches to split glaciers into.
+    costs : list
+        estimated cost (e.g., runtime) of each item; if provided, the items are split with the longest processing time
+        rule (each item, longest first, is added to the batch with the lowest total cost) and option_ordered only sets
+        whether the items of each batch keep the order of lst
     
     Returns
     -------
@@ -60,7 +82,21 @@ def split_list(lst, n=1, option_ordered=1):
         list of n lists that have sequential values in each list
     """
     # If batches is more than list, then there will be one glacier in each batch
-    if option_ordered == 1:
+    if costs is not None:
+        if n > len(lst):
+            n = len(lst)
+        costs = np.array(costs, dtype=float)
+        batch_costs = np.zeros(n)
+        batch_idx = [[] for x in np.arange(n)]
+        for idx in np.argsort(-costs, kind='stable'):
+            nbatch = np.argmin(batch_costs)
+            batch_idx[nbatch].append(idx)
+            batch_costs[nbatch] += costs[idx]
+        if option_ordered == 1:
+            batch_idx = [sorted(x) for x in batch_idx]
+        lst_batches = [[lst[idx] for idx in x] for x in batch_idx]
+    
+    elif option_ordered == 1:
         if n > len(lst):
             n = len(lst)
         n_perlist_low = int(len(lst)/n)
@@ -97,6 +133,30 @@ def split_list(lst, n=1, option_ordered=1):
     return lst_batches   
 
 
+def predict_runtimes(latlon_list):
+    """
+    Runtime of each grid cell predicted by the cost model, calibrated with the timings of previous runs
+    
+    Returns
+    -------
+    latlon_runtime : np.array
+        predicted runtime [s] of each grid cell
+    latlon_snow : np.array
+        snow fraction of each grid cell (see debrisglobal/cost_model.py)
+    """
+    df_timings = cost_model.read_timings()
+    if df_timings is not None:
+        coeffs = cost_model.calibrate(df_timings)
+        cost_model.save(coeffs)
+        print('Cost model calibrated with', coeffs['n_tasks'], 'tasks (relative root mean square error:', 
+              np.round(coeffs['rel_rmse'],2), ')\n')
+    coeffs = cost_model.load()
+    latlon_snow = cost_model.fill_snow_fraction([cost_model.snow_fraction(latlon[0], latlon[1]) 
+                                                 for latlon in latlon_list])
+    latlon_runtime = cost_model.predict(coeffs, cost_model.cell_work(), latlon_snow)
+    return latlon_runtime, latlon_snow
+
+
 if __name__ == '__main__':
     parser = getparser()
     args = parser.parse_args()   
@@ -125,15 +185,20 @@ if __name__ == '__main__':
     #%%    
     # Check if need to update old batch files or not
     #  (different number of glaciers or batches)
-    if (count_latlons != len(debris_prms.latlon_list) or args.n_batches != len(batch_list) or 
-        debris_prms.overwrite_batches):
+    if args.task_fp is None and (count_latlons != len(debris_prms.latlon_list) or args.n_batches != len(batch_list) 
+                                 or debris_prms.overwrite_batches):
         # Delete old files
         for i in batch_list:
             os.remove(i)
             
         # Split list of of lat/lons
         # Lat/lon lists to pass for parallel processing
-        latlon_lsts = split_list(debris_prms.latlon_list, n=args.n_batches, option_ordered=args.option_ordered)
+        if args.option_cost == 1:
+            latlon_runtime, latlon_snow = predict_runtimes(debris_prms.latlon_list)
+            latlon_lsts = split_list(debris_prms.latlon_list, n=args.n_batches, option_ordered=args.option_ordered,
+                                     costs=latlon_runtime)
+        else:
+            latlon_lsts = split_list(debris_prms.latlon_list, n=args.n_batches, option_ordered=args.option_ordered)
     
         # Export new lists
         for n in range(len(latlon_lsts)):
@@ -144,4 +209,50 @@ if __name__ == '__main__':
                 
             print('Batch', n, ':\n', batch_fn, '\n')
             with open(batch_fn, 'wb') as f:
-                pickle.dump(latlon_lsts[n], f)
\ No newline at end of file
+                pickle.dump(latlon_lsts[n], f)
+        
+        # Predicted runtime of each batch: the cores of the node share the grid cells (see debrisglobal/scheduler.py),
+        #  but a grid cell takes at least the runtime of its longest block of debris thicknesses
+        if args.option_cost == 1:
+            latlon_idx_dict = {latlon: nlatlon for nlatlon, latlon in enumerate(debris_prms.latlon_list)}
+            batch_runtimes = []
+            for n in range(len(latlon_lsts)):
+                batch_idx = [latlon_idx_dict[latlon] for latlon in latlon_lsts[n]]
+                n_hd_blocks = scheduler.n_blocks(len(batch_idx), len(debris_prms.debris_thickness_all), 
+                                                 args.num_simultaneous_processes)
+                batch_runtime = max(latlon_runtime[batch_idx].sum() / args.num_simultaneous_processes,
+                                    latlon_runtime[batch_idx].max() / n_hd_blocks)
+                batch_runtimes.append([n, len(batch_idx), latlon_snow[batch_idx].mean(), batch_runtime, 
+                                       cost_model.walltime_str(batch_runtime * debris_prms.cost_model_walltime_factor)])
+            df_runtimes = pd.DataFrame(batch_runtimes, columns=['batch', 'n_latlon', 'snow_fraction', 
+                                                                'runtime_predicted_s', 'walltime'])
+            print(df_runtimes.to_string(index=False), '\n')
+            # Wall time of the longest batch (e.g., sbatch --time=$(cat 11_batch_walltime.txt))
+            if args.ignore_regionname == 0:
+                runtimes_prefix = debris_prms.roi + '_batch_'
+            elif args.ignore_regionname == 1:
+                runtimes_prefix = 'batch_'
+            df_runtimes.to_csv(runtimes_prefix + 'runtimes.csv', index=False)
+            with open(runtimes_prefix + 'walltime.txt', 'w') as f:
+                f.write(cost_model.walltime_str(df_runtimes['runtime_predicted_s'].max() * 
+                                                debris_prms.cost_model_walltime_factor))
+    
+    # Task ledger shared by the nodes instead of the batches: the grid cells are claimed longest first with the cost 
+    #  model and in the order of latlon_list otherwise
+    if args.task_fp is not None:
+        latlon_costs = None
+        if args.option_cost == 1:
+            latlon_costs = predict_runtimes(debris_prms.latlon_list)[0]
+        ledger_counts = task_ledger.TaskLedger(args.task_fp).create(debris_prms.latlon_list, costs=latlon_costs)
+        print('Task ledger', args.task_fp, ':', ledger_counts)
+        # Wall time: the cores of all nodes (n_batches) share the grid cells, which are simulated as a whole
+        if args.option_cost == 1:
+            ledger_runtime = max(latlon_costs.sum() / (args.n_batches * args.num_simultaneous_processes), 
+                                 latlon_costs.max())
+            if args.ignore_regionname == 0:
+                runtimes_prefix = debris_prms.roi + '_batch_'
+            elif args.ignore_regionname == 1:
+                runtimes_prefix = 'batch_'
+            print('Predicted runtime [s]:', np.round(ledger_runtime,0))
+            with open(runtimes_prefix + 'walltime.txt', 'w') as f:
+                f.write(cost_model.walltime_str(ledger_runtime * debris_prms.cost_model_walltime_factor))
\ No newline at end of file
@@ -8,7 +8,6 @@ Created on Sat Aug 11 10:17:13 2018
 # Built-in libraries
 import argparse
 import collections
-import multiprocessing
 import os
 import pickle
 import time
@@ -24,7 +23,9 @@ import xarray as xr
 
 # Local libraries
 import debrisglobal.globaldebris_input as debris_prms
-from spc_split_lists import split_list
+import debrisglobal.daily_melt as daily_melt
+import debrisglobal.scheduler as scheduler
+import debrisglobal.task_ledger as task_ledger
 
 
 #%% ===== FUNCTIONS =====
@@ -38,6 +39,9 @@ def getparser():
         batch number used to differentiate output on supercomputer
     batches (optional) : int
         total number of batches based on supercomputer
+    task_fp (optional) : str
+        directory of the task ledger shared by the nodes (the processes claim the grid cells from it instead of 
+        latlon_fn, see debrisglobal/task_ledger.py)
     num_simultaneous_processes (optional) : int
         number of cores to use in parallels
     option_parallels (optional) : int
@@ -57,6 +61,8 @@ def getparser():
                         help='Total number of batches (nodes) for supercomputer')
     parser.add_argument('-latlon_fn', action='store', type=str, default=None,
                         help='Filename containing list of lat/lon tuples for running batches on spc')
+    parser.add_argument('-task_fp', action='store', type=str, default=None,
+                        help='Directory of the task ledger from which the processes claim the grid cells')
     parser.add_argument('-num_simultaneous_processes', action='store', type=int, default=4,
                         help='number of simultaneous processes (cores) to use')
     parser.add_argument('-option_parallels', action='store', type=int, default=1,
@@ -191,14 +197,8 @@ def main(list_packed_vars):
         else:
             lat_str = 'N-'
         latlon_str = str(int(abs(lat_deg*100))) + lat_str + str(int(lon_deg*100)) + 'E-'
-        if debris_prms.experiment_no == 3:
-            mc_str = ''
-        else:
-            mc_str = str(int(debris_prms.mc_simulations)) + 'MC_'
-            
         # Raw meltmodel output filename
-#        ds_meltmodel_fn = debris_prms.fn_prefix + latlon_str + debris_prms.date_start + '.nc'
-        ds_meltmodel_fn = debris_prms.fn_prefix + latlon_str + mc_str + debris_prms.date_start + '.nc'
+        ds_meltmodel_fn = daily_melt.meltmodel_fn(latlon)
         # Output processed surface temperature curve dataset
         ds_tscurve_fn = debris_prms.output_ts_fn_sample.replace('XXXX', latlon_str)
         
@@ -289,28 +289,30 @@ if __name__ == '__main__':
     else:
         num_cores = 1
 
-    # Glacier number lists to pass for parallel processing
-    latlon_lsts = split_list(latlon_list, n=num_cores, option_ordered=args.option_ordered)
-
-    # Pack variables for multiprocessing
+    # Pack variables for multiprocessing: one task for each grid cell, issued largest melt model output first to the 
+    #  processes as they become free
     list_packed_vars = []
-    for count, latlon_lst in enumerate(latlon_lsts):
-        list_packed_vars.append([count, latlon_lst])
+    for count, latlon in enumerate(latlon_list):
+        list_packed_vars.append([count, [latlon]])
+    task_costs = [scheduler.file_cost(debris_prms.eb_fp + daily_melt.meltmodel_fn(latlon)) 
+                  for latlon in latlon_list]
+    task_labels = [str(latlon[0]) + '_' + str(latlon[1]) for latlon in latlon_list]
 
-    # Parallel processing
     if args.option_parallels != 0:
         print('Processing in parallel with ' + str(args.num_simultaneous_processes) + ' cores...')
-        with multiprocessing.Pool(args.num_simultaneous_processes) as p:
-            p.map(main,list_packed_vars)
-    # If not in parallel, then only should be one loop
+    if args.task_fp is not None:
+        # Coordinator mode: the processes of every node claim the grid cells from the ledger until none are left
+        latlon_list, df_timings = task_ledger.run_workers(
+                main, args.task_fp, num_processes=num_cores, option_parallels=args.option_parallels,
+                timings_fn='tscurves_batch' + str(args.batchno) + '_timings.csv')
     else:
-        # Loop through the chunks and export bias adjustments
-        for n in range(len(list_packed_vars)):
-            if debug and num_cores == 1:
-                ds_ts = main(list_packed_vars[n])
-            else:
-                main(list_packed_vars[n])
-     
+        results, df_timings = scheduler.run_tasks(
+                main, list_packed_vars, costs=task_costs, num_processes=num_cores, 
+                option_parallels=args.option_parallels, task_labels=task_labels, 
+                timings_fn='tscurves_batch' + str(args.batchno) + '_timings.csv')
+    if debug and num_cores == 1 and args.task_fp is None:
+        ds_ts = results[-1]
+                
     print('\nProcessing time of :',time.time()-time_start, 's')
     
     